@@ -0,0 +1,261 @@
+# Running engagement aggregates
+#
+# get_engagement_metrics used to average watch time and count completed
+# views and comments over the source tables on every call. Engagement is now
+# kept as running totals, written in the same transaction as the rows they
+# describe:
+#
+# - VideoEngagement: per video views, completed views, summed watch time and
+#   comments, so per-video completion rates are a primary-key read.
+# - EngagementCounter: the same totals platform-wide, plus comments per UTC
+#   day, spread over ENGAGEMENT_COUNTER_SHARDS rows that readers sum.
+#
+# Writers add deltas: a new view adds one view, a progress update adds the
+# watch time gained and a completion the first time a view completes, a
+# comment adds one comment (its deletion removes it). Anything that bypasses
+# these paths (history deletes, retention, raw SQL) makes the totals drift;
+# reconcile_engagement (Celery, e.g. nightly) recomputes them from VideoView
+# and Comment in chunks of videos, locking each chunk's rows so concurrent
+# increments land on top of the corrected values. The platform-wide rows
+# are rebuilt under a short table lock. backfill_engagement runs the same
+# reconciliation over all history to populate the totals after deploying.
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from celery import shared_task
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+from ..history.view_storage import upsert_totals, utc_day
+
+DEFAULT_SHARDS = 16
+
+# Videos recomputed per reconciliation transaction
+RECONCILE_BATCH_SIZE = 500
+
+# Days of per-day comment counts recomputed by reconciliation
+RECONCILE_COMMENT_DAYS = 30
+
+TOTALS = ('views', 'completed_views', 'watch_duration', 'comments')
+
+
+def shard_count():
+    return getattr(settings, 'ENGAGEMENT_COUNTER_SHARDS', DEFAULT_SHARDS)
+
+
+def _comparable(totals):
+    # Summation order changes the last bits of watch_duration
+    return totals[:2] + (round(totals[2], 3),) + totals[3:]
+
+
+def _lock_counters():
+    """
+    Keep writers off EngagementCounter until the transaction ends.
+
+    PostgreSQL takes a table lock. SQLite has a single database-wide write
+    lock, which the caller holds from its first write, so callers must
+    write (delete) before they read the totals they rebuild from.
+    """
+    from ..models import EngagementCounter
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {EngagementCounter._meta.db_table} IN SHARE ROW EXCLUSIVE MODE')
+
+
+def view_delta(created, watch_duration, completed, previous_duration=0.0, previously_completed=False):
+    """(views, completed_views, watch_duration) added by one view write"""
+    return (
+        1 if created else 0,
+        1 if completed and not previously_completed else 0,
+        max(watch_duration - previous_duration, 0.0),
+    )
+
+
+class Engagement:
+    """Maintains and reads the running engagement totals"""
+
+    @staticmethod
+    def _upsert_videos(rows, accumulate=True):
+        """Upsert (video_id, views, completed_views, watch_duration, comments) rows"""
+        from ..models import VideoEngagement
+
+        upsert_totals(VideoEngagement, ('video_id',), TOTALS, rows, accumulate)
+
+    @staticmethod
+    def _add_to_counter(day, deltas):
+        """Add (views, completed_views, watch_duration, comments) to one shard of a counter row"""
+        from ..models import EngagementCounter
+
+        qn = connection.ops.quote_name
+        table = qn(EngagementCounter._meta.db_table)
+        totals = [qn(name) for name in TOTALS]
+        update = ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in totals)
+        # The all-time rows have a partial unique index (day IS NULL)
+        if day is None:
+            target = f'({qn("shard")}) WHERE {qn("day")} IS NULL'
+        else:
+            target = f'({qn("day")}, {qn("shard")})'
+        sql = (
+            f'INSERT INTO {table} ({qn("day")}, {qn("shard")}, {", ".join(totals)}) '
+            f'VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT {target} DO UPDATE SET {update}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [day, random.randrange(shard_count()), *deltas])
+
+    @staticmethod
+    def record_views(deltas):
+        """
+        Apply {video_id: (views, completed_views, watch_duration)} deltas.
+
+        Call inside the transaction that writes the views.
+        """
+        deltas = {video_id: delta for video_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        # Sorted so concurrent writers lock video rows in the same order
+        Engagement._upsert_videos([
+            (video_id, views, completed, watch_duration, 0)
+            for video_id, (views, completed, watch_duration) in sorted(deltas.items())
+        ])
+        Engagement._add_to_counter(None, (
+            sum(delta[0] for delta in deltas.values()),
+            sum(delta[1] for delta in deltas.values()),
+            sum(delta[2] for delta in deltas.values()),
+            0,
+        ))
+
+    @staticmethod
+    def record_comment(video_id, created_at, amount=1):
+        """Count a written (amount=1) or deleted (amount=-1) comment"""
+        from ..models import VideoEngagement
+
+        if amount > 0:
+            Engagement._upsert_videos([(video_id, 0, 0, 0.0, amount)])
+        else:
+            # Never insert a negative count; a missing row is fixed by reconciliation
+            VideoEngagement.objects.filter(video_id=video_id, comments__gte=-amount).update(
+                comments=F('comments') + amount
+            )
+        Engagement._add_to_counter(None, (0, 0, 0.0, amount))
+        Engagement._add_to_counter(utc_day(created_at), (0, 0, 0.0, amount))
+
+    @staticmethod
+    def totals():
+        """{'views', 'completed_views', 'watch_duration', 'comments'}, summed over the shards"""
+        from ..models import EngagementCounter
+
+        totals = EngagementCounter.objects.filter(day__isnull=True).aggregate(
+            **{name: Sum(name) for name in TOTALS}
+        )
+        return {name: value or 0 for name, value in totals.items()}
+
+    @staticmethod
+    def comments_since(days, now=None):
+        """Comments written in the last `days` UTC days, today included"""
+        from ..models import EngagementCounter
+        from django.utils import timezone
+
+        first = utc_day(now or timezone.now()) - timedelta(days=days - 1)
+        return EngagementCounter.objects.filter(day__gte=first).aggregate(
+            total=Sum('comments')
+        )['total'] or 0
+
+    @staticmethod
+    def for_videos(video_ids):
+        """{video_id: VideoEngagement} for the videos that have one"""
+        from ..models import VideoEngagement
+
+        return VideoEngagement.objects.in_bulk(list(video_ids))
+
+    @staticmethod
+    def reconcile_videos(batch_size=RECONCILE_BATCH_SIZE):
+        """Recompute every video's totals from the source tables; returns how many were corrected"""
+        from ..models import Video, VideoView, VideoEngagement, Comment
+
+        corrected = 0
+        video_ids = list(Video.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(video_ids), batch_size):
+            chunk = video_ids[i:i + batch_size]
+            with transaction.atomic():
+                if connection.vendor != 'postgresql':
+                    # Take SQLite's write lock before reading (see _lock_counters)
+                    VideoEngagement.objects.filter(video_id__in=chunk).update(views=F('views'))
+                # Writers of these videos wait here and add on top of the result
+                current = {
+                    row.video_id: tuple(getattr(row, name) for name in TOTALS)
+                    for row in VideoEngagement.objects.select_for_update().filter(
+                        video_id__in=chunk
+                    ).order_by('video_id')
+                }
+                actual = defaultdict(lambda: [0, 0, 0.0, 0])
+                for row in VideoView.objects.filter(video_id__in=chunk).values('video_id').annotate(
+                    views=Count('id'),
+                    completed_views=Count('id', filter=Q(completed=True)),
+                    watch_duration=Sum('watch_duration')
+                ).order_by():
+                    actual[row['video_id']][:3] = [row['views'], row['completed_views'],
+                                                   row['watch_duration'] or 0.0]
+                for video_id, comments in Comment.objects.filter(video_id__in=chunk).values(
+                    'video_id'
+                ).annotate(count=Count('id')).order_by().values_list('video_id', 'count'):
+                    actual[video_id][3] = comments
+
+                rows = []
+                for video_id in chunk:
+                    totals = tuple(actual[video_id]) if video_id in actual else (0, 0, 0.0, 0)
+                    if _comparable(current.get(video_id, (0, 0, 0.0, 0))) != _comparable(totals):
+                        rows.append((video_id, *totals))
+                Engagement._upsert_videos(rows, accumulate=False)
+                corrected += len(rows)
+        return corrected
+
+    @staticmethod
+    def reconcile_totals():
+        """Reset the all-time counters to the sum of the per-video totals"""
+        from ..models import EngagementCounter, VideoEngagement
+
+        with transaction.atomic():
+            _lock_counters()
+            EngagementCounter.objects.filter(day__isnull=True).delete()
+            totals = VideoEngagement.objects.aggregate(**{name: Sum(name) for name in TOTALS})
+            EngagementCounter.objects.create(day=None, shard=0, **{
+                name: value or 0 for name, value in totals.items()
+            })
+
+    @staticmethod
+    def reconcile_comment_days(days=RECONCILE_COMMENT_DAYS, now=None):
+        """Recompute the per-day comment counters of the last `days` days (None: every day)"""
+        from ..models import Comment, EngagementCounter
+        from django.utils import timezone
+
+        if days is None:
+            oldest = Comment.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if oldest is None:
+                return
+            first = utc_day(oldest)
+        else:
+            first = utc_day(now or timezone.now()) - timedelta(days=days - 1)
+        with transaction.atomic():
+            _lock_counters()
+            EngagementCounter.objects.filter(day__gte=first).delete()
+            per_day = Comment.objects.filter(
+                created_at__gte=datetime.combine(first, time.min, tzinfo=dt_timezone.utc)
+            ).annotate(
+                day=TruncDate('created_at', tzinfo=dt_timezone.utc)
+            ).values('day').annotate(count=Count('id')).order_by().values_list('day', 'count')
+            EngagementCounter.objects.bulk_create([
+                EngagementCounter(day=day, shard=0, comments=count) for day, count in per_day
+            ])
+
+
+@shared_task(name='analytics.reconcile_engagement')
+def reconcile_engagement():
+    """Periodic reconciliation (e.g. nightly with Celery beat); returns the number of videos corrected"""
+    corrected = Engagement.reconcile_videos()
+    Engagement.reconcile_totals()
+    Engagement.reconcile_comment_days()
+    return corrected
@@ -0,0 +1,349 @@
+# Append-only analytics event log
+#
+# Analytics used to be computed by querying the transactional tables
+# (VideoView, Comment, Payment, SearchLog), so every dashboard load competed
+# with the write path for database IO. Those writes now also emit events,
+# which are written to local disk as compressed Parquet files and queried
+# with Arrow (see event_queries), never touching the database:
+#
+#   <EVENT_LOG_DIR>/<event type>/day=<YYYY-MM-DD>/<file>.parquet
+#
+# - emit() puts an event on a bounded in-memory queue and never blocks; a
+#   full queue drops the event (counted in stats()).
+# - A background thread writes the queue every EVENT_LOG_FLUSH_INTERVAL
+#   seconds (or every EVENT_LOG_BATCH_SIZE events): one zstd-compressed file
+#   per (event type, UTC day) in the batch. Files are written under a
+#   dot-prefixed name and renamed into place, so readers never see a
+#   partial file.
+# - compact_event_log (Celery, daily) merges each finished day's files into
+#   one. Days older than EVENT_LOG_RETENTION_DAYS are deleted by that task
+#   and, once a day, by each writer thread.
+#
+# Events carry user ids and raw search queries. Logging is off unless
+# EVENT_LOG_ENABLED is set or ANALYTICS_SOURCE is 'events', and the default
+# EVENT_LOG_DIR is outside MEDIA_ROOT, which is served publicly.
+#
+# Each process writes its own files, so no coordination is needed. Events
+# still queued when a process dies are lost; the database stays the source
+# of truth and backfill() re-exports a day from it.
+import atexit
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from celery import shared_task
+from django.conf import settings
+
+DEFAULT_QUEUE_SIZE = 50000
+DEFAULT_BATCH_SIZE = 20000
+DEFAULT_FLUSH_INTERVAL = 30.0
+DEFAULT_RETENTION_DAYS = 90
+
+# Seconds between the retention passes of a writer thread
+EXPIRE_INTERVAL = 86400
+
+COMPRESSION = 'zstd'
+
+# Columns of each event type, besides ts (UTC, microseconds)
+SCHEMAS = {
+    'view': [('view_id', 'int64'), ('user_id', 'int64'), ('video_id', 'int64'), ('category', 'string')],
+    'progress': [('view_id', 'int64'), ('video_id', 'int64'), ('watch_duration', 'float64'),
+                 ('completed', 'bool_')],
+    'search': [('user_id', 'int64'), ('query', 'string'), ('result_count', 'int64')],
+    'comment': [('comment_id', 'int64'), ('user_id', 'int64'), ('video_id', 'int64')],
+    'payment': [('payment_id', 'int64'), ('user_id', 'int64'), ('amount', 'float64')],
+}
+
+
+def event_log_dir():
+    default = os.path.join(str(getattr(settings, 'BASE_DIR', os.getcwd())), 'var', 'analytics_events')
+    return getattr(settings, 'EVENT_LOG_DIR', default)
+
+
+def retention_days():
+    """Days of events kept; None keeps everything"""
+    return getattr(settings, 'EVENT_LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+
+
+def logging_enabled():
+    return getattr(settings, 'EVENT_LOG_ENABLED', getattr(settings, 'ANALYTICS_SOURCE', 'database') == 'events')
+
+
+def schema(event_type):
+    """Arrow schema of one event type's files"""
+    import pyarrow as pa
+
+    return pa.schema([('ts', pa.timestamp('us', tz='UTC'))] + [
+        (name, getattr(pa, arrow_type)()) for name, arrow_type in SCHEMAS[event_type]
+    ])
+
+
+def day_dir(event_type, day):
+    return os.path.join(event_log_dir(), event_type, f'day={day.isoformat()}')
+
+
+def day_files(event_type, day):
+    path = day_dir(event_type, day)
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.endswith('.parquet') and not name.startswith('.'))
+
+
+def write_events(event_type, day, rows):
+    """Write [(ts, {column: value})] as one Parquet file of `day`; returns its path"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = {'ts': [ts for ts, _ in rows]}
+    for name, _ in SCHEMAS[event_type]:
+        columns[name] = [fields.get(name) for _, fields in rows]
+    table = pa.Table.from_pydict(columns, schema=schema(event_type))
+
+    path = day_dir(event_type, day)
+    os.makedirs(path, exist_ok=True)
+    name = f'{int(time.time() * 1000)}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet'
+    staged = os.path.join(path, f'.{name}')
+    pq.write_table(table, staged, compression=COMPRESSION)
+    os.replace(staged, os.path.join(path, name))
+    return os.path.join(path, name)
+
+
+class EventLog:
+    """Bounded queue + background Parquet writer for analytics events"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, queue_size=None, batch_size=None, flush_interval=None):
+        self.queue_size = queue_size or getattr(settings, 'EVENT_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+        self.batch_size = batch_size or getattr(settings, 'EVENT_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.flush_interval = flush_interval or getattr(settings, 'EVENT_LOG_FLUSH_INTERVAL',
+                                                        DEFAULT_FLUSH_INTERVAL)
+        self.enabled = logging_enabled()
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._expired_at = None
+        self._stopping = threading.Event()
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,
+            'dropped': 0,
+            'written': 0,
+            'files': 0,
+            'failed_batches': 0,
+        }
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                atexit.register(cls._instance.stop)
+            return cls._instance
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def emit(self, event_type, moment=None, **fields):
+        """Queue one event; never blocks. Returns False if it was not kept."""
+        if not self.enabled:
+            return False
+        if event_type not in SCHEMAS:
+            raise ValueError(f'Unknown event type {event_type!r}')
+        self._ensure_started()
+
+        moment = (moment or datetime.now(dt_timezone.utc)).astimezone(dt_timezone.utc)
+        try:
+            self._queue.put_nowait((event_type, moment, fields))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        stats['queue_size'] = self.queue_size
+        return stats
+
+    def _ensure_started(self):
+        # Threads do not survive fork(); pre-fork servers start one per worker
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._instance_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+            self._expire()
+
+    def _expire(self):
+        """Apply the retention window at most once per EXPIRE_INTERVAL"""
+        if not retention_days():
+            return
+        if self._expired_at is not None and time.monotonic() - self._expired_at < EXPIRE_INTERVAL:
+            return
+        self._expired_at = time.monotonic()
+        try:
+            drop_before(datetime.now(dt_timezone.utc).date() - timedelta(days=retention_days()))
+        except OSError:
+            pass
+
+    def _collect(self):
+        """Block for the first event, then gather until the batch fills or the interval ends"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        groups = defaultdict(list)
+        for event_type, moment, fields in batch:
+            groups[(event_type, moment.date())].append((moment, fields))
+
+        with self._flush_lock:
+            for (event_type, day), rows in groups.items():
+                try:
+                    write_events(event_type, day, rows)
+                except Exception:
+                    self._count('failed_batches')
+                    continue
+                self._count('written', len(rows))
+                self._count('files')
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def stop(self):
+        self._stopping.set()
+        # Let the writer finish the batch it is collecting
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(self.flush_interval + 5)
+        self.flush()
+
+
+def emit(event_type, moment=None, **fields):
+    return EventLog.instance().emit(event_type, moment, **fields)
+
+
+def compact(event_type, day):
+    """
+    Merge a day's files into one; returns the number of files merged.
+
+    Only run on finished days: a reader listing the directory between the
+    rename and the deletes would see the merged rows twice.
+    """
+    import pyarrow.parquet as pq
+    import pyarrow as pa
+
+    files = day_files(event_type, day)
+    if len(files) < 2:
+        return 0
+    table = pa.concat_tables([pq.read_table(path, schema=schema(event_type)) for path in files])
+    table = table.sort_by('ts')
+
+    path = day_dir(event_type, day)
+    name = f'compacted-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.parquet'
+    staged = os.path.join(path, f'.{name}')
+    pq.write_table(table, staged, compression=COMPRESSION)
+    os.replace(staged, os.path.join(path, name))
+    for merged in files:
+        os.remove(merged)
+    return len(files)
+
+
+def drop_before(cutoff):
+    """Delete every day directory older than `cutoff`; returns how many"""
+    dropped = 0
+    for event_type in SCHEMAS:
+        root = os.path.join(event_log_dir(), event_type)
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            if name.startswith('day=') and date.fromisoformat(name[4:]) < cutoff:
+                # Other processes may be expiring the same day
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                dropped += 1
+    return dropped
+
+
+def backfill(day):
+    """
+    Re-export one day's view, progress and search events from the database.
+
+    Replaces that day's files. Comments and payments are left alone, as
+    their tables are not guaranteed to carry every emitted field.
+    """
+    from ..models import VideoView, SearchLog
+
+    start = datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc)
+    end = start + timedelta(days=1)
+    views = list(VideoView.objects.filter(viewed_at__gte=start, viewed_at__lt=end).values_list(
+        'id', 'user_id', 'video_id', 'video__category', 'viewed_at', 'watch_duration', 'completed'
+    ).order_by('viewed_at'))
+    searches = list(SearchLog.objects.filter(created_at__gte=start, created_at__lt=end).values_list(
+        'user_id', 'query', 'result_count', 'created_at'
+    ).order_by('created_at'))
+
+    exported = {
+        'view': [(viewed_at, {'view_id': view_id, 'user_id': user_id, 'video_id': video_id,
+                              'category': category})
+                 for view_id, user_id, video_id, category, viewed_at, _, _ in views],
+        'progress': [(viewed_at, {'view_id': view_id, 'video_id': video_id,
+                                  'watch_duration': watch_duration, 'completed': completed})
+                     for view_id, _, video_id, _, viewed_at, watch_duration, completed in views],
+        'search': [(created_at, {'user_id': user_id, 'query': query, 'result_count': result_count})
+                   for user_id, query, result_count, created_at in searches],
+    }
+    for event_type, rows in exported.items():
+        shutil.rmtree(day_dir(event_type, day), ignore_errors=True)
+        if rows:
+            write_events(event_type, day, rows)
+    return {event_type: len(rows) for event_type, rows in exported.items()}
+
+
+@shared_task(name='analytics.compact_event_log')
+def compact_event_log(days=7):
+    """Daily: compact the last `days` finished days and apply retention"""
+    today = datetime.now(dt_timezone.utc).date()
+    merged = 0
+    for offset in range(1, days + 1):
+        for event_type in SCHEMAS:
+            merged += compact(event_type, today - timedelta(days=offset))
+    dropped = drop_before(today - timedelta(days=retention_days())) if retention_days() else 0
+    return {'files_merged': merged, 'days_dropped': dropped}
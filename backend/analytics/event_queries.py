@@ -0,0 +1,122 @@
+# Vectorized analytics over the event log
+#
+# Aggregations over the Parquet files written by event_log, with Arrow
+# compute: a query reads only the day directories in its window (hive
+# partition pruning) and only the columns it needs. Set
+# ANALYTICS_SOURCE = 'events' to serve the dashboard and trending rebuilds
+# from here instead of the database.
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+
+from .event_log import event_log_dir, schema
+
+
+def analytics_source():
+    return getattr(settings, 'ANALYTICS_SOURCE', 'database')
+
+
+def use_events():
+    return analytics_source() == 'events'
+
+
+def first_day(days, now=None):
+    today = (now or datetime.now(dt_timezone.utc)).astimezone(dt_timezone.utc).date()
+    return today - timedelta(days=days - 1)
+
+
+class EventQueries:
+    """Dashboard and trending aggregates computed from event files"""
+
+    @staticmethod
+    def scan(event_type, columns, days=None, now=None):
+        """Arrow table of `columns` for the last `days` UTC days (all days if None)"""
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        full_schema = schema(event_type).append(pa.field('day', pa.string()))
+        path = os.path.join(event_log_dir(), event_type)
+        if not os.path.isdir(path):
+            return full_schema.empty_table().select(columns)
+
+        dataset = ds.dataset(path, format='parquet', schema=full_schema,
+                             partitioning=ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive'))
+        where = None
+        if days is not None:
+            # ISO dates compare correctly as strings
+            where = ds.field('day') >= first_day(days, now).isoformat()
+        return dataset.to_table(columns=columns, filter=where)
+
+    @staticmethod
+    def _counts(table, key):
+        return dict(zip(*table.group_by(key).aggregate([(key, 'count')]).select([key, f'{key}_count'])
+                        .to_pydict().values()))
+
+    @staticmethod
+    def views_per_day(days, now=None):
+        """{date: views} for the last `days` days"""
+        counts = EventQueries._counts(EventQueries.scan('view', ['day'], days, now), 'day')
+        return {datetime.strptime(day, '%Y-%m-%d').date(): count for day, count in counts.items()}
+
+    @staticmethod
+    def top_videos(limit=10, days=None, now=None):
+        """[(video_id, views)] most viewed first"""
+        counts = EventQueries.scan('view', ['video_id'], days, now).group_by('video_id').aggregate(
+            [('video_id', 'count')]
+        ).sort_by([('video_id_count', 'descending'), ('video_id', 'ascending')]).slice(0, limit)
+        return list(zip(counts['video_id'].to_pylist(), counts['video_id_count'].to_pylist()))
+
+    @staticmethod
+    def active_users(days, now=None):
+        import pyarrow.compute as pc
+
+        return pc.count_distinct(EventQueries.scan('view', ['user_id'], days, now)['user_id']).as_py()
+
+    @staticmethod
+    def engagement(days=None, now=None):
+        """{'views', 'avg_watch_time', 'completion_rate'} from each view's last progress"""
+        import pyarrow.compute as pc
+
+        view_ids = EventQueries.scan('view', ['view_id'], days, now)['view_id']
+        views = len(view_ids)
+        # Progress of the window's views only, not of sessions started before it
+        progress = EventQueries.scan('progress', ['view_id', 'watch_duration', 'completed'], days, now)
+        progress = progress.filter(pc.is_in(progress['view_id'], value_set=view_ids))
+        progress = progress.set_column(2, 'completed', pc.cast(progress['completed'], 'int8'))
+        per_view = progress.group_by('view_id').aggregate([('watch_duration', 'max'), ('completed', 'max')])
+        watch_time = pc.sum(per_view['watch_duration_max']).as_py() or 0
+        completed = pc.sum(per_view['completed_max']).as_py() or 0
+        return {
+            'views': views,
+            'avg_watch_time': watch_time / views if views else 0,
+            'completion_rate': round(completed / views * 100, 2) if views else 0,
+        }
+
+    @staticmethod
+    def count(event_type, days=None, now=None):
+        return EventQueries.scan(event_type, ['ts'], days, now).num_rows
+
+    @staticmethod
+    def revenue(days, now=None):
+        """Sum of completed payments; a payment emitted more than once counts once"""
+        import pyarrow.compute as pc
+
+        payments = EventQueries.scan('payment', ['payment_id', 'amount'], days, now)
+        per_payment = payments.group_by('payment_id').aggregate([('amount', 'max')])
+        return float(pc.sum(per_payment['amount_max']).as_py() or 0)
+
+    @staticmethod
+    def popular_searches(limit=10, days=7, now=None):
+        """[(query, searches)] most searched first"""
+        counts = EventQueries.scan('search', ['query'], days, now).group_by('query').aggregate(
+            [('query', 'count')]
+        ).sort_by([('query_count', 'descending')]).slice(0, limit)
+        return list(zip(counts['query'].to_pylist(), counts['query_count'].to_pylist()))
+
+    @staticmethod
+    def iter_views(days, now=None, batch_size=65536):
+        """(video_id, category, viewed_at) of the window's views, oldest first"""
+        table = EventQueries.scan('view', ['ts', 'video_id', 'category'], days, now).sort_by('ts')
+        for batch in table.to_batches(max_chunksize=batch_size):
+            columns = batch.to_pydict()
+            yield from zip(columns['video_id'], columns['category'], columns['ts'])
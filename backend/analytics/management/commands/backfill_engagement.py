@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+
+from ...engagement import RECONCILE_BATCH_SIZE, Engagement
+
+
+class Command(BaseCommand):
+    help = 'Populate the running engagement totals from VideoView and Comment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE,
+                            help='Videos recomputed per transaction')
+        parser.add_argument('--comment-days', type=int, default=None,
+                            help='Recompute per-day comment counts for this many days (default: all)')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        corrected = Engagement.reconcile_videos(options['batch_size'])
+        Engagement.reconcile_totals()
+        Engagement.reconcile_comment_days(options['comment_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled engagement for {corrected} videos in {time.monotonic() - start:.1f}s'
+        ))
@@ -0,0 +1,58 @@
+# Model signal wiring for analytics
+#
+# Call connect_analytics_signals() from the project's AppConfig.ready() so
+# comments and payments completing are emitted as events (views and searches
+# are emitted where they are recorded) and comments are counted in the
+# running engagement totals. Events go out after the transaction commits, so
+# rolled-back writes never reach the log.
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .engagement import Engagement
+from .event_log import emit
+
+
+def _comment_saved(sender, instance, created, **kwargs):
+    if created:
+        # Running totals change in the comment's own transaction
+        Engagement.record_comment(instance.video_id, instance.created_at)
+        transaction.on_commit(lambda: emit(
+            'comment', instance.created_at,
+            comment_id=instance.pk, user_id=instance.user_id, video_id=instance.video_id
+        ))
+
+
+def _comment_deleted(sender, instance, **kwargs):
+    Engagement.record_comment(instance.video_id, instance.created_at, amount=-1)
+
+
+def _payment_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Status before this save, so only the transition into 'completed' is emitted
+    previous = None
+    if update_fields is not None and 'status' not in update_fields:
+        previous = instance.status
+    elif instance.pk is not None and not raw:
+        previous = sender.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+    instance._analytics_previous_status = previous
+
+
+def _payment_saved(sender, instance, created, **kwargs):
+    if instance.status != 'completed':
+        return
+    if getattr(instance, '_analytics_previous_status', None) == 'completed':
+        return
+    instance._analytics_previous_status = instance.status
+    transaction.on_commit(lambda: emit(
+        'payment', None,
+        payment_id=instance.pk, user_id=getattr(instance, 'user_id', None), amount=float(instance.amount)
+    ))
+
+
+def connect_analytics_signals():
+    """Emit comment and completed-payment events and count comments as those rows are written"""
+    from ..models import Comment, Payment
+
+    post_save.connect(_comment_saved, sender=Comment, dispatch_uid='analytics_comment_saved')
+    post_delete.connect(_comment_deleted, sender=Comment, dispatch_uid='analytics_comment_deleted')
+    pre_save.connect(_payment_saving, sender=Payment, dispatch_uid='analytics_payment_saving')
+    post_save.connect(_payment_saved, sender=Payment, dispatch_uid='analytics_payment_saved')
@@ -0,0 +1,156 @@
+# Content-addressed storage for uploaded sources
+#
+# Sources are stored under videos/sources/ by the hash of their bytes, so
+# files with the same name no longer overwrite each other and a byte-identical
+# re-upload links to the existing file and its HLS/DASH renditions instead of
+# being stored and transcoded again.
+#
+# The content hash is a chunked SHA-256: each UPLOAD_CHUNK_SIZE block is
+# hashed on its own and the result is the SHA-256 of the ordered block
+# digests. Resumable uploads compute the block digests as chunks arrive in
+# any order; single-request uploads compute the same value in one pass.
+import hashlib
+import os
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+
+def combine_chunk_digests(digests):
+    """Content hash from the ordered list of per-chunk hex digests"""
+    tree = hashlib.sha256()
+    for digest in digests:
+        tree.update(bytes.fromhex(digest))
+    return tree.hexdigest()
+
+
+class ChunkedHasher:
+    """Incremental content hash for data that arrives sequentially"""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.digests = []
+        self._current = hashlib.sha256()
+        self._filled = 0
+        self.size = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        self.size += len(view)
+        while view:
+            take = min(self.chunk_size - self._filled, len(view))
+            self._current.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.chunk_size:
+                self.digests.append(self._current.hexdigest())
+                self._current = hashlib.sha256()
+                self._filled = 0
+
+    def hexdigest(self):
+        digests = list(self.digests)
+        if self._filled or not digests:
+            digests.append(self._current.hexdigest())
+        return combine_chunk_digests(digests)
+
+
+class ContentStore:
+    """Deduplicating store for video sources"""
+
+    @staticmethod
+    def source_name(content_hash, filename):
+        """Storage name for a source: videos/sources/ab/cd/<hash><ext>"""
+        ext = os.path.splitext(filename)[1].lower()
+        return f'videos/sources/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext}'
+
+    @staticmethod
+    def ingest(staged_path, content_hash, size, filename):
+        """
+        Move a fully written, hashed file into the store.
+
+        Returns (source, created). When the content already exists the staged
+        file is discarded; otherwise it is renamed into place (same
+        filesystem, no copy).
+        """
+        from ..models import ContentSource
+
+        existing = ContentSource.objects.filter(content_hash=content_hash).first()
+        if existing:
+            # Already moved into the store by an earlier, failed completion
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+            return existing, False
+
+        name = ContentStore.source_name(content_hash, filename)
+        final_path = default_storage.path(name)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if os.path.exists(staged_path) or not os.path.exists(final_path):
+            os.replace(staged_path, final_path)
+
+        try:
+            with transaction.atomic():
+                source = ContentSource.objects.create(
+                    content_hash=content_hash,
+                    file_path=final_path,
+                    size=size
+                )
+            return source, True
+        except IntegrityError:
+            # A concurrent upload of the same bytes won the insert; the file
+            # it renamed into place is identical to ours
+            return ContentSource.objects.get(content_hash=content_hash), False
+
+    @staticmethod
+    def create_video(source, title, description):
+        """Create the Video row for a stored source, without linking or queueing it"""
+        from ..models import Video
+
+        return Video.objects.create(
+            title=title,
+            description=description,
+            file_path=source.file_path
+        )
+
+    @staticmethod
+    def register_video(source, title, description, video=None):
+        """
+        Create a Video for a stored source.
+
+        The first video of a source owns its renditions and is queued for
+        transcoding; later ones copy the existing streaming URLs, or share
+        the job already in flight for the owner. Pass `video` (from
+        create_video) to register a Video created by an earlier attempt
+        instead of creating another.
+        """
+        from ..models import ContentSource
+        from ..streaming.jobs import TranscodeJobQueue
+
+        if video is None:
+            video = ContentStore.create_video(source, title, description)
+
+        if source.video_id is None:
+            ContentSource.objects.filter(id=source.id, video__isnull=True).update(video=video)
+            source.refresh_from_db()
+
+        if source.is_transcoded:
+            video.hls_url = source.hls_url
+            video.dash_url = source.dash_url
+            video.save()
+            return video, None
+
+        # Returns the owner's running job instead of starting a second one
+        job, _ = TranscodeJobQueue.submit(source.video_id)
+        return video, job
+
+    @staticmethod
+    def mark_transcoded(video, hls_url, dash_url):
+        """Record renditions on the source and every video that shares it"""
+        from ..models import Video, ContentSource
+
+        ContentSource.objects.filter(file_path=video.file_path).update(
+            hls_url=hls_url,
+            dash_url=dash_url
+        )
+        Video.objects.filter(file_path=video.file_path).update(
+            hls_url=hls_url,
+            dash_url=dash_url
+        )
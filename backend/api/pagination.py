@@ -0,0 +1,152 @@
+# Keyset (cursor) pagination
+#
+# PageNumberPagination turns page N into OFFSET N * page_size, which makes
+# every deep page scan and discard all the rows before it. KeysetPagination
+# instead remembers the ordering values of the last row it returned and asks
+# for rows strictly after them, so every page costs the same index range scan.
+# The queryset must be ordered by a unique key: callers end their ordering
+# with id as a tie-breaker. NULLs in nullable sort columns (duration,
+# views) are ordered last in both directions, on every database, and the
+# cursor condition has explicit IS NULL branches, since a comparison with
+# NULL never matches.
+import base64
+import json
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only cursor pagination over a queryset's order_by()"""
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    # ?count=false skips the COUNT(*) (count is returned as null)
+    count_query_param = 'count'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def include_count(self, request):
+        return request.query_params.get(self.count_query_param, 'true').lower() not in ('false', '0', 'no')
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = [str(field) for field in queryset.query.order_by]
+        if not ordering or ordering[-1].lstrip('-') not in ('id', 'pk'):
+            raise ValueError('KeysetPagination needs a queryset ordered with an id tie-breaker')
+        return ordering
+
+    def encode_cursor(self, row):
+        values = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'o': self.ordering, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if payload['o'] != self.ordering:
+                raise ValueError('cursor belongs to a different ordering')
+            values = []
+            for field, value in zip(self.ordering, payload['v']):
+                try:
+                    value = model._meta.get_field(field.lstrip('-')).to_python(value)
+                except FieldDoesNotExist:
+                    pass  # annotations such as search_rank are stored as-is
+                values.append(value)
+            return values
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound('Invalid cursor')
+
+    @staticmethod
+    def nullable_fields(ordering, model):
+        nullable = set()
+        for field in ordering:
+            try:
+                if model._meta.get_field(field.lstrip('-')).null:
+                    nullable.add(field.lstrip('-'))
+            except FieldDoesNotExist:
+                pass  # annotations such as search_rank are never NULL
+        return nullable
+
+    def order_nulls_last(self, queryset):
+        """Reapply the ordering with NULLS LAST on nullable fields, matching keyset_filter()"""
+        if not self.nullable:
+            return queryset
+        ordering = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            if name not in self.nullable:
+                ordering.append(field)
+            elif field.startswith('-'):
+                ordering.append(F(name).desc(nulls_last=True))
+            else:
+                ordering.append(F(name).asc(nulls_last=True))
+        return queryset.order_by(*ordering)
+
+    def keyset_filter(self, values):
+        """(a, b, id) after (x, y, z): a > x OR (a = x AND b > y) OR ..., NULLs last"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            if value is None:
+                # Nothing sorts after NULL in this column
+                equal &= Q(**{f'{name}__isnull': True})
+                continue
+            lookup = f'{name}__lt' if field.startswith('-') else f'{name}__gt'
+            after = Q(**{lookup: value})
+            if name in self.nullable:
+                after |= Q(**{f'{name}__isnull': True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        self.nullable = self.nullable_fields(self.ordering, queryset.model)
+        self.page_size = self.get_page_size(request)
+        self.count = queryset.count() if self.include_count(request) else None
+        queryset = self.order_nulls_last(queryset)
+
+        values = self.decode_cursor(request, queryset.model)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values))
+
+        # One extra row tells us whether there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
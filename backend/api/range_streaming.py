@@ -0,0 +1,252 @@
+# HTTP Range / Partial Content support for video delivery
+import os
+import mimetypes
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, quote_etag
+
+# Multi-range requests beyond this are answered with the whole file, which
+# keeps a single request from fanning out into thousands of tiny reads.
+MAX_RANGES = 16
+
+# Chunk size used when the response has to be streamed through Python
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range_header(header, size):
+    """
+    Parse an RFC 7233 ``Range: bytes=...`` header into (start, end) pairs.
+
+    Returns a sorted list of inclusive, coalesced byte ranges, an empty list
+    when none of the ranges is satisfiable, or None when the header is
+    missing, malformed or uses a unit other than bytes (in which case the
+    header must be ignored and the full representation served).
+    """
+    if not header or '=' not in header:
+        return None
+
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part or '-' not in part:
+            return None
+        first, _, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+
+        try:
+            if not first:
+                # Suffix range: the final N bytes
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and start > end:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+
+        if start < 0 or start >= size:
+            continue
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Coalesce overlapping and adjacent ranges
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def build_etag(size, modified_time=None):
+    """Build a strong validator from file size and modification time"""
+    if modified_time is None:
+        return quote_etag(f'{size:x}')
+    return quote_etag(f'{int(modified_time.timestamp()):x}-{size:x}')
+
+
+def _storage_stat(storage, name):
+    """Return (size, modified_time) for a stored file"""
+    size = storage.size(name)
+    try:
+        modified_time = storage.get_modified_time(name)
+    except (NotImplementedError, AttributeError):
+        modified_time = None
+    return size, modified_time
+
+
+def _local_path(storage, name):
+    """Return the filesystem path for local storages, or None for remote ones"""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+class RangeFileWrapper:
+    """
+    File-like view over ``[start, start + length)`` of an open file.
+
+    The underlying descriptor is positioned at ``start`` and ``fileno()`` is
+    exposed, so WSGI servers with a ``wsgi.file_wrapper`` (gunicorn) send the
+    slice with ``os.sendfile`` using the response Content-Length, while plain
+    servers fall back to bounded ``read()`` calls. Iterating it yields
+    STREAM_CHUNK_SIZE blocks, for responses streamed through Python.
+    """
+
+    def __init__(self, filelike, start, length):
+        self.filelike = filelike
+        self.remaining = length
+        self.filelike.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.filelike.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(STREAM_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+    def fileno(self):
+        return self.filelike.fileno()
+
+    def close(self):
+        self.filelike.close()
+
+
+def _multipart_ranges(filelike, ranges, size, content_type, boundary):
+    """Yield a multipart/byteranges body, reading each part in chunks"""
+    try:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode('ascii')
+            filelike.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = filelike.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+    finally:
+        filelike.close()
+
+
+def _multipart_length(ranges, size, content_type, boundary):
+    """Compute the exact Content-Length of a multipart/byteranges body"""
+    length = len(f'\r\n--{boundary}--\r\n')
+    for start, end in ranges:
+        length += len(
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        )
+        length += end - start + 1
+    return length
+
+
+def _open(storage, name, local_path):
+    """Open a stored file, bypassing the storage wrapper for local files"""
+    if local_path:
+        return open(local_path, 'rb')
+    return storage.open(name, 'rb')
+
+
+def serve_file(request, storage, name, filename=None, content_type=None):
+    """
+    Serve a stored file honouring Range, If-Range and If-None-Match.
+
+    Full and single-range responses go through FileResponse so local files
+    are sent zero-copy by the WSGI server, unless STREAMING_USE_SENDFILE is
+    off, in which case they are streamed in chunks through Python; multi-range
+    responses are always streamed as multipart/byteranges.
+    """
+    size, modified_time = _storage_stat(storage, name)
+    etag = build_etag(size, modified_time)
+    content_type = content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    filename = filename or os.path.basename(name)
+
+    def finalize(response):
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        if modified_time is not None:
+            response['Last-Modified'] = http_date(modified_time.timestamp())
+        return response
+
+    # Conditional GET: the player already has this exact file
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        return finalize(HttpResponse(status=304))
+
+    ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+    # If-Range: only honour the range when the client's copy is current
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if ranges is not None and if_range and if_range.strip() != etag:
+        ranges = None
+
+    if ranges is not None and not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return finalize(response)
+
+    local_path = _local_path(storage, name)
+    use_sendfile = getattr(settings, 'STREAMING_USE_SENDFILE', True) and local_path
+    filelike = _open(storage, name, local_path if use_sendfile else None)
+
+    # FileResponse hands the file to the server's wsgi.file_wrapper (and so
+    # to sendfile); iterating the wrapper keeps the server from seeing it
+    response_class = FileResponse if use_sendfile else StreamingHttpResponse
+
+    if ranges is None:
+        response = response_class(
+            filelike if use_sendfile else RangeFileWrapper(filelike, 0, size),
+            content_type=content_type
+        )
+        response['Content-Length'] = str(size)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        response = response_class(
+            RangeFileWrapper(filelike, start, length),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        boundary = etag.strip('"').replace('-', '') + 'byteranges'
+        response = StreamingHttpResponse(
+            _multipart_ranges(filelike, ranges, size, content_type, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(_multipart_length(ranges, size, content_type, boundary))
+
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return finalize(response)
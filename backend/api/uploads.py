@@ -0,0 +1,309 @@
+# Resumable chunked video uploads
+#
+# Protocol:
+#   POST /api/videos/uploads/                       -> create session, returns upload_id + chunk_size
+#   PUT  /api/videos/uploads/{upload_id}/?offset=N  -> raw chunk bytes written at offset N
+#   GET  /api/videos/uploads/{upload_id}/           -> received chunks, to resume after a drop
+#   POST /api/videos/uploads/{upload_id}/complete/  -> verify, create Video, queue transcode
+#
+# Chunks are fixed-size and aligned (only the last one may be shorter), may
+# arrive in any order and over several connections at once, and are written
+# directly into the pre-allocated staging file. Each chunk is hashed as it
+# streams in; the content hash is the SHA-256 of the ordered chunk digests
+# (see content_store), so it never needs a second read of the file. On
+# completion the file is renamed into the content-addressed store.
+import hashlib
+import os
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.utils.text import get_valid_filename
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from .content_store import ContentStore, combine_chunk_digests
+
+# Default chunk size; part of the content hash definition, so changing it
+# changes the hash of every new upload
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Incomplete sessions can be resumed for this long
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# Bytes read from the request stream per write
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """Invalid upload request; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _session_key(upload_id):
+    return f'upload:{upload_id}'
+
+
+def _chunk_key(upload_id, index):
+    return f'upload:{upload_id}:chunk:{index}'
+
+
+class ResumableUploadService:
+    """State and file handling for chunked uploads"""
+
+    @staticmethod
+    def chunk_size():
+        return getattr(settings, 'UPLOAD_CHUNK_SIZE', UPLOAD_CHUNK_SIZE)
+
+    @staticmethod
+    def chunk_count(session):
+        return max(1, -(-session['size'] // session['chunk_size']))
+
+    @staticmethod
+    def create_session(user, filename, size, title='Untitled', description=''):
+        """Pre-allocate the destination file and store the session"""
+        max_size = getattr(settings, 'UPLOAD_MAX_SIZE', None)
+        if size <= 0:
+            raise UploadError('Upload size must be positive')
+        if max_size and size > max_size:
+            raise UploadError('Upload exceeds maximum size', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        upload_id = uuid.uuid4().hex
+        name = f'videos/uploads/{upload_id}/{get_valid_filename(os.path.basename(filename)) or "video"}'
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            # Sparse pre-allocation: chunks are written in place at their offsets
+            f.truncate(size)
+
+        session = {
+            'id': upload_id,
+            'name': name,
+            'path': path,
+            'filename': filename,
+            'size': size,
+            'chunk_size': ResumableUploadService.chunk_size(),
+            'title': title,
+            'description': description,
+            'user_id': user.id if user.is_authenticated else None,
+            'status': 'uploading',
+            'created_at': time.time(),
+        }
+        cache.set(_session_key(upload_id), session, UPLOAD_SESSION_TTL)
+        return session
+
+    @staticmethod
+    def get_session(upload_id, user=None):
+        session = cache.get(_session_key(upload_id))
+        if not session:
+            raise UploadError('Upload not found', status.HTTP_404_NOT_FOUND)
+        if user is not None and session['user_id'] not in (None, getattr(user, 'id', None)):
+            raise UploadError('Upload not found', status.HTTP_404_NOT_FOUND)
+        return session
+
+    @staticmethod
+    def write_chunk(session, offset, stream, length):
+        """
+        Stream one chunk from the request into the destination file.
+
+        The chunk is hashed while it is written; nothing is buffered beyond a
+        single STREAM_BLOCK_SIZE block.
+        """
+        if session['status'] != 'uploading':
+            raise UploadError('Upload already completed', status.HTTP_409_CONFLICT)
+
+        chunk_size, size = session['chunk_size'], session['size']
+        if offset < 0 or offset % chunk_size or offset >= size:
+            raise UploadError('Offset must be a chunk boundary inside the file')
+        expected = min(chunk_size, size - offset)
+        if length != expected:
+            raise UploadError(f'Chunk at offset {offset} must be {expected} bytes')
+
+        digest = hashlib.sha256()
+        remaining = length
+        try:
+            f = open(session['path'], 'r+b')
+        except FileNotFoundError:
+            # Our copy of the session predates a completion that moved the file
+            raise UploadError('Upload already completed', status.HTTP_409_CONFLICT)
+        with f:
+            f.seek(offset)
+            while remaining > 0:
+                block = stream.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    raise UploadError('Chunk body ended early')
+                digest.update(block)
+                f.write(block)
+                remaining -= len(block)
+
+        index = offset // chunk_size
+        cache.set(_chunk_key(session['id'], index), digest.hexdigest(), UPLOAD_SESSION_TTL)
+        # Keep the session alive while data is still arriving
+        cache.touch(_session_key(session['id']), UPLOAD_SESSION_TTL)
+        return index
+
+    @staticmethod
+    def chunk_digests(session):
+        """Map of chunk index -> hex digest for every chunk received so far"""
+        count = ResumableUploadService.chunk_count(session)
+        keys = {_chunk_key(session['id'], i): i for i in range(count)}
+        found = cache.get_many(list(keys))
+        return {keys[key]: digest for key, digest in found.items()}
+
+    @staticmethod
+    def content_hash(session, digests):
+        """SHA-256 over the ordered chunk digests"""
+        count = ResumableUploadService.chunk_count(session)
+        return combine_chunk_digests(digests[index] for index in range(count))
+
+    @staticmethod
+    def complete(session):
+        """Verify every chunk arrived, store the source and create the Video"""
+        digests = ResumableUploadService.chunk_digests(session)
+        missing = [i for i in range(ResumableUploadService.chunk_count(session)) if i not in digests]
+        if missing:
+            raise UploadError(f'{len(missing)} chunks missing', status.HTTP_409_CONFLICT)
+
+        # Only one request may finalize a session
+        guard = f'{_session_key(session["id"])}:complete'
+        if not cache.add(guard, True, UPLOAD_SESSION_TTL):
+            raise UploadError('Upload already completed', status.HTTP_409_CONFLICT)
+
+        from ..models import Video
+
+        content_hash = ResumableUploadService.content_hash(session, digests)
+        try:
+            source, created = ContentStore.ingest(
+                session['path'], content_hash, session['size'], session['filename']
+            )
+            video = Video.objects.filter(id=session['video_id']).first() if session.get('video_id') else None
+            if video is None:
+                video = ContentStore.create_video(source, session['title'], session['description'])
+                # Recorded before queueing so a retry reuses this Video
+                session['video_id'] = video.id
+                cache.set(_session_key(session['id']), session, UPLOAD_SESSION_TTL)
+            video, job = ContentStore.register_video(source, session['title'], session['description'], video=video)
+
+            staging_dir = os.path.dirname(session['path'])
+            if os.path.isdir(staging_dir):
+                os.rmdir(staging_dir)
+        except Exception:
+            # Every step above can be repeated, so the client may retry
+            cache.delete(guard)
+            raise
+
+        session.update(
+            status='completed',
+            content_hash=content_hash,
+            video_id=video.id,
+            deduplicated=not created
+        )
+        cache.set(_session_key(session['id']), session, UPLOAD_SESSION_TTL)
+        cache.delete_many([_chunk_key(session['id'], i) for i in digests])
+        return session, job
+
+
+def _session_data(session, received=None):
+    data = {
+        'upload_id': session['id'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'chunk_count': ResumableUploadService.chunk_count(session),
+        'status': session['status'],
+    }
+    if received is not None:
+        data['received_chunks'] = sorted(received)
+    return data
+
+
+# API Views
+@api_view(['POST'])
+def create_upload(request):
+    """
+    Start a resumable upload
+    POST /api/videos/uploads/
+    {
+        "filename": "string",
+        "size": int,
+        "title": "string",
+        "description": "string"
+    }
+    """
+    filename = request.data.get('filename')
+    try:
+        size = int(request.data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+
+    if not filename or not size:
+        return Response({'error': 'filename and size required'},
+                       status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        session = ResumableUploadService.create_session(
+            request.user,
+            filename,
+            size,
+            title=request.data.get('title', 'Untitled'),
+            description=request.data.get('description', '')
+        )
+    except UploadError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response(_session_data(session, received=[]), status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PUT'])
+def upload_chunk(request, upload_id):
+    """
+    Upload or inspect chunks
+    GET /api/videos/uploads/{upload_id}/
+    PUT /api/videos/uploads/{upload_id}/?offset={offset}
+    Body: raw chunk bytes (Content-Length required)
+    """
+    try:
+        session = ResumableUploadService.get_session(upload_id, request.user)
+
+        if request.method == 'GET':
+            digests = ResumableUploadService.chunk_digests(session)
+            return Response(_session_data(session, received=digests.keys()))
+
+        try:
+            offset = int(request.GET.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'offset and Content-Length required'},
+                           status=status.HTTP_400_BAD_REQUEST)
+
+        # Read the raw request stream; request.data would parse and buffer it
+        index = ResumableUploadService.write_chunk(session, offset, request.stream, length)
+    except UploadError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response({'upload_id': upload_id, 'chunk': index, 'offset': offset, 'length': length})
+
+
+@api_view(['POST'])
+def complete_upload(request, upload_id):
+    """
+    Finish an upload and hand it to the transcoding pipeline
+    POST /api/videos/uploads/{upload_id}/complete/
+    """
+    try:
+        session = ResumableUploadService.get_session(upload_id, request.user)
+        session, job = ResumableUploadService.complete(session)
+    except UploadError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response({
+        'upload_id': upload_id,
+        'video_id': session['video_id'],
+        'content_hash': session['content_hash'],
+        'deduplicated': session['deduplicated'],
+        'job': job
+    }, status=status.HTTP_201_CREATED)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, uploads
 
 urlpatterns = [
     # Authentication endpoints
@@ -9,6 +9,9 @@ urlpatterns = [
     # Video endpoints
     path('videos/', views.list_videos, name='list-videos'),
     path('videos/upload/', views.upload_video, name='upload-video'),
+    path('videos/uploads/', uploads.create_upload, name='create-upload'),
+    path('videos/uploads/<str:upload_id>/', uploads.upload_chunk, name='upload-chunk'),
+    path('videos/uploads/<str:upload_id>/complete/', uploads.complete_upload, name='complete-upload'),
     path('videos/<int:video_id>/stream/', views.stream_video, name='stream-video'),
     
     # Comment endpoints
@@ -6,9 +6,12 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login
 from rest_framework.authtoken.models import Token
 import os
+import uuid
 from django.core.files.storage import default_storage
-from django.http import StreamingHttpResponse
 import mimetypes
+from .range_streaming import serve_file
+from .content_store import ChunkedHasher, ContentStore
+from .uploads import ResumableUploadService
 
 # User Authentication APIs
 @api_view(['POST'])
@@ -88,15 +91,27 @@ def upload_video(request):
     title = request.data.get('title', 'Untitled')
     description = request.data.get('description', '')
     
-    # Save video file
-    file_path = default_storage.save(f'videos/{video_file.name}', video_file)
+    # Stage the file, hashing it in the same pass that writes it
+    hasher = ChunkedHasher(ResumableUploadService.chunk_size())
+    staged_path = default_storage.path(f'videos/uploads/{uuid.uuid4().hex}')
+    os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    with open(staged_path, 'wb') as f:
+        for chunk in video_file.chunks():
+            hasher.update(chunk)
+            f.write(chunk)
+    
+    # Identical bytes link to the existing source and its renditions
+    source, created = ContentStore.ingest(staged_path, hasher.hexdigest(), hasher.size, video_file.name)
+    video, job = ContentStore.register_video(source, title, description)
     
-    # In production, save metadata to database
     video_data = {
-        'id': 1,  # Would come from database
+        'id': video.id,
         'title': title,
         'description': description,
-        'file_path': file_path,
+        'file_path': source.file_path,
+        'content_hash': source.content_hash,
+        'deduplicated': not created,
+        'job': job,
         'uploaded_by': request.user.username if request.user.is_authenticated else 'anonymous'
     }
     
@@ -109,6 +124,8 @@ def stream_video(request, video_id):
     """
     Stream video
     GET /api/videos/{video_id}/stream/
+    Supports Range requests (206 Partial Content, multipart/byteranges),
+    If-Range and If-None-Match.
     """
     # In production, fetch from database
     video_path = f'videos/sample_{video_id}.mp4'
@@ -117,18 +134,14 @@ def stream_video(request, video_id):
         return Response({'error': 'Video not found'}, 
                        status=status.HTTP_404_NOT_FOUND)
     
-    # Open video file
-    video_file = default_storage.open(video_path, 'rb')
-    content_type, _ = mimetypes.guess_type(video_path)
-    
-    # Create streaming response
-    response = StreamingHttpResponse(
-        video_file,
-        content_type=content_type or 'video/mp4'
+    # Serve with Range support so seeks only fetch the bytes they need
+    return serve_file(
+        request,
+        default_storage,
+        video_path,
+        filename=f'video_{video_id}.mp4',
+        content_type=mimetypes.guess_type(video_path)[0] or 'video/mp4'
     )
-    response['Content-Disposition'] = f'inline; filename="video_{video_id}.mp4"'
-    
-    return response
 
 
 @api_view(['GET'])
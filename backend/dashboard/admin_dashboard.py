@@ -6,44 +6,79 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from django.contrib.auth.models import User
+from ..analytics.engagement import Engagement
+from ..analytics.event_queries import EventQueries, use_events
+from ..history.distinct_counters import DistinctCounters
+from ..history.view_storage import ViewRollups, utc_day
+from .queries import (count_of, dashboard_database, large_table_estimates, recent_window, scalars, sum_of,
+                      time_series)
+from .snapshot import DashboardSnapshot
 
 class DashboardAnalytics:
     """Service for generating admin dashboard analytics"""
     
     @staticmethod
     def get_overview_stats():
-        """Get overall platform statistics"""
-        from ..models import Video, VideoView, Subscription
-        
-        total_users = User.objects.count()
-        total_videos = Video.objects.count()
-        total_views = VideoView.objects.count()
-        active_subscriptions = Subscription.objects.filter(status='active').count()
-        
-        # Calculate growth rates
+        """
+        Get overall platform statistics
+        Large tables' totals come from planner estimates (listed under
+        'estimated'); everything else is one query of scalar subqueries.
+        Served to admins through the cached DashboardSnapshot.
+        """
+        from ..models import Video, VideoView, Subscription, Payment
+        
+        using = dashboard_database()
         last_30_days = timezone.now() - timedelta(days=30)
-        new_users_30d = User.objects.filter(date_joined__gte=last_30_days).count()
-        new_videos_30d = Video.objects.filter(created_at__gte=last_30_days).count()
+        totals = {'total_users': User, 'total_videos': Video, 'total_views': VideoView}
+        estimates = large_table_estimates(totals.values(), using)
+        
+        metrics = {name: count_of(model.objects.all())
+                   for name, model in totals.items() if model not in estimates}
+        metrics.update({
+            'active_subscriptions': count_of(Subscription.objects.filter(status='active')),
+            # Calculate growth rates
+            'new_users_30d': count_of(User.objects.filter(date_joined__gte=last_30_days)),
+            'new_videos_30d': count_of(Video.objects.filter(created_at__gte=last_30_days)),
+        })
+        if not use_events():
+            metrics['revenue_30d'] = sum_of(Payment.objects.filter(
+                status='completed',
+                created_at__gte=last_30_days
+            ), 'amount')
+        stats = scalars(metrics, using)
         
         return {
-            'total_users': total_users,
-            'total_videos': total_videos,
-            'total_views': total_views,
-            'active_subscriptions': active_subscriptions,
-            'new_users_30d': new_users_30d,
-            'new_videos_30d': new_videos_30d,
-            'revenue_30d': DashboardAnalytics.calculate_revenue(30)
+            'total_users': estimates.get(User, stats.get('total_users')),
+            'total_videos': estimates.get(Video, stats.get('total_videos')),
+            'total_views': estimates.get(VideoView, stats.get('total_views')),
+            'active_subscriptions': stats['active_subscriptions'],
+            'new_users_30d': stats['new_users_30d'],
+            'new_videos_30d': stats['new_videos_30d'],
+            'revenue_30d': EventQueries.revenue(30) if use_events() else float(stats['revenue_30d']),
+            'estimated': [name for name, model in totals.items() if model in estimates],
+            'generated_at': timezone.now().isoformat()
         }
     
     @staticmethod
     def get_video_statistics():
         """Get detailed video statistics"""
-        from ..models import Video, VideoView
-        
-        # Top 10 most viewed videos
-        top_videos = Video.objects.annotate(
-            view_count=Count('views')
-        ).order_by('-view_count')[:10]
+        from ..models import Video
+        
+        # Top 10 most viewed videos (from the event log or the daily rollups)
+        top_counts = EventQueries.top_videos(10) if use_events() else ViewRollups.top_videos(10)
+        titles = dict(Video.objects.filter(
+            id__in=[video_id for video_id, _ in top_counts]
+        ).values_list('id', 'title'))
+        unique_viewers = DistinctCounters.instance().unique_viewers_many(
+            [video_id for video_id, _ in top_counts], days=30
+        )
+        engagement = Engagement.for_videos(video_id for video_id, _ in top_counts)
+        top_videos = [
+            {'id': video_id, 'title': titles.get(video_id), 'view_count': count,
+             'unique_viewers_30d': unique_viewers.get(video_id, 0),
+             'completion_rate': engagement[video_id].completion_rate if video_id in engagement else 0}
+            for video_id, count in top_counts
+        ]
         
         # Videos by category
         videos_by_category = Video.objects.values('category').annotate(
@@ -53,17 +88,19 @@ class DashboardAnalytics:
         # Average video duration
         avg_duration = Video.objects.aggregate(Avg('duration'))['duration__avg']
         
-        # View trends (last 7 days)
+        # View trends (last 7 UTC days, one rollup query or event scan)
+        today = utc_day(timezone.now())
+        if use_events():
+            per_day = EventQueries.views_per_day(7)
+        else:
+            per_day = ViewRollups.views_per_day(today - timedelta(days=6))
         view_trends = []
         for i in range(7):
-            date = timezone.now() - timedelta(days=i)
-            views = VideoView.objects.filter(
-                viewed_at__date=date.date()
-            ).count()
-            view_trends.append({'date': date.strftime('%Y-%m-%d'), 'views': views})
+            date = today - timedelta(days=i)
+            view_trends.append({'date': date.strftime('%Y-%m-%d'), 'views': per_day.get(date, 0)})
         
         return {
-            'top_videos': list(top_videos.values('id', 'title', 'view_count')),
+            'top_videos': top_videos,
             'videos_by_category': list(videos_by_category),
             'avg_duration': avg_duration,
             'view_trends': view_trends
@@ -72,20 +109,17 @@ class DashboardAnalytics:
     @staticmethod
     def get_user_statistics():
         """Get detailed user statistics"""
-        from ..models import Subscription, VideoView
+        from ..models import Subscription
         
-        # User registration trends (last 30 days)
-        registration_trends = []
-        for i in range(30):
-            date = timezone.now() - timedelta(days=i)
-            count = User.objects.filter(date_joined__date=date.date()).count()
-            registration_trends.append({'date': date.strftime('%Y-%m-%d'), 'count': count})
+        # User registration trends (last 30 days, one range scan)
+        registrations = time_series(User.objects.all(), 'date_joined', *recent_window(30))
+        registration_trends = [
+            {'date': date.strftime('%Y-%m-%d'), 'count': count}
+            for date, count in reversed(registrations)
+        ]
         
-        # Active users (watched video in last 7 days)
-        last_7_days = timezone.now() - timedelta(days=7)
-        active_users = VideoView.objects.filter(
-            viewed_at__gte=last_7_days
-        ).values('user').distinct().count()
+        # Active users (started a video in the last 7 days; HyperLogLog estimate)
+        active_users = DistinctCounters.instance().active_users(7)
         
         # Subscription distribution
         subscription_stats = Subscription.objects.values('plan_type').annotate(
@@ -103,6 +137,9 @@ class DashboardAnalytics:
         """Calculate revenue for specified period"""
         from ..models import Payment
         
+        if use_events():
+            return EventQueries.revenue(days)
+        
         start_date = timezone.now() - timedelta(days=days)
         revenue = Payment.objects.filter(
             status='completed',
@@ -114,23 +151,27 @@ class DashboardAnalytics:
     @staticmethod
     def get_engagement_metrics():
         """Get user engagement metrics"""
-        from ..models import Video, VideoView, Comment
+        # Running totals (see analytics.engagement): a few counter rows
+        totals = Engagement.totals()
+        
+        if use_events():
+            engagement = EventQueries.engagement()
+            return {
+                'avg_watch_time': engagement['avg_watch_time'],
+                'total_comments': totals['comments'],
+                'comments_last_7d': EventQueries.count('comment', 7),
+                'completion_rate': engagement['completion_rate']
+            }
         
-        # Average watch time
-        avg_watch_time = VideoView.objects.aggregate(
-            Avg('watch_duration')
-        )['watch_duration__avg'] or 0
+        total_views = totals['views']
+        avg_watch_time = totals['watch_duration'] / total_views if total_views > 0 else 0
         
         # Comment activity
-        total_comments = Comment.objects.count()
-        comments_last_7d = Comment.objects.filter(
-            created_at__gte=timezone.now() - timedelta(days=7)
-        ).count()
+        total_comments = totals['comments']
+        comments_last_7d = Engagement.comments_since(7)
         
         # Video completion rate
-        completed_views = VideoView.objects.filter(completed=True).count()
-        total_views = VideoView.objects.count()
-        completion_rate = (completed_views / total_views * 100) if total_views > 0 else 0
+        completion_rate = (totals['completed_views'] / total_views * 100) if total_views > 0 else 0
         
         return {
             'avg_watch_time': avg_watch_time,
@@ -143,8 +184,8 @@ class DashboardAnalytics:
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def dashboard_overview(request):
-    """Get dashboard overview statistics"""
-    stats = DashboardAnalytics.get_overview_stats()
+    """Get dashboard overview statistics (cached snapshot)"""
+    stats = DashboardSnapshot.get()
     return Response(stats)
 
 @api_view(['GET'])
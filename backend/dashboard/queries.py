@@ -0,0 +1,143 @@
+# Query helpers for dashboard analytics
+#
+# Dashboard numbers are read far more often than they change, and most of
+# them are counts over large tables. These helpers keep the number of round
+# trips and full scans down:
+#
+# - estimated_counts() reads the planner's row estimates (pg_class.reltuples,
+#   maintained by autovacuum/ANALYZE) instead of counting. Partitioned tables
+#   report the sum of their partitions.
+# - scalars() evaluates any number of count/sum querysets as scalar
+#   subqueries of a single SELECT.
+# - time_series() buckets rows by day or hour in one GROUP BY over a plain
+#   range on the timestamp (indexable, unlike field__date=), and fills
+#   empty buckets in Python.
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+# Tables estimated above this many rows are reported from estimates
+DEFAULT_ESTIMATE_THRESHOLD = 1000000
+
+DAY = 'day'
+HOUR = 'hour'
+
+_TRUNCATE = {DAY: TruncDate, HOUR: TruncHour}
+
+
+def dashboard_database():
+    """Database alias analytics read from (point it at a replica)"""
+    return getattr(settings, 'DASHBOARD_DATABASE', 'default')
+
+
+def estimate_threshold():
+    return getattr(settings, 'DASHBOARD_ESTIMATE_THRESHOLD', DEFAULT_ESTIMATE_THRESHOLD)
+
+
+def estimated_counts(models, using=None):
+    """{model: estimated rows} on PostgreSQL; {} elsewhere"""
+    using = using or dashboard_database()
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return {}
+
+    tables = {model._meta.db_table: model for model in models}
+    with connection.cursor() as cursor:
+        # reltuples is -1 for never-analyzed tables (PostgreSQL 14+)
+        cursor.execute(
+            'SELECT p.relname, SUM(GREATEST(c.reltuples, 0))::bigint FROM pg_class p '
+            'LEFT JOIN pg_inherits i ON i.inhparent = p.oid '
+            'JOIN pg_class c ON c.oid = COALESCE(i.inhrelid, p.oid) '
+            'WHERE p.oid IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name) '
+            'GROUP BY p.relname',
+            [list(tables)]
+        )
+        return {tables[name]: count for name, count in cursor.fetchall() if name in tables}
+
+
+def count_of(queryset):
+    return ('COUNT(*)', queryset.order_by().values('pk'))
+
+
+def sum_of(queryset, field):
+    return (f'COALESCE(SUM(m.{connections[queryset.db].ops.quote_name(field)}), 0)',
+            queryset.order_by().values(field))
+
+
+def scalars(metrics, using=None):
+    """
+    Evaluate {name: count_of(...) / sum_of(...)} in one query.
+
+    Each queryset becomes `(SELECT <aggregate> FROM (<queryset>) AS m)`.
+    """
+    if not metrics:
+        return {}
+    using = using or dashboard_database()
+    connection = connections[using]
+    columns, params = [], []
+    for aggregate, queryset in metrics.values():
+        sql, query_params = queryset.using(using).query.get_compiler(using).as_sql()
+        columns.append(f'(SELECT {aggregate} FROM ({sql}) AS m)')
+        params.extend(query_params)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {", ".join(columns)}', params)
+        return dict(zip(metrics, cursor.fetchone()))
+
+
+def large_table_estimates(models, using=None):
+    """{model: estimated rows} for the models at or above DASHBOARD_ESTIMATE_THRESHOLD"""
+    threshold = estimate_threshold()
+    return {model: count for model, count in estimated_counts(models, using).items() if count >= threshold}
+
+
+def recent_window(count, granularity=DAY, tz=None, now=None):
+    """(start, end) covering the last `count` buckets, the current one included"""
+    tz = tz or timezone.get_current_timezone()
+    now = now or timezone.now()
+    local = now.astimezone(tz)
+    if granularity == DAY:
+        first = local.date() - timedelta(days=count - 1)
+        return datetime.combine(first, time.min, tzinfo=tz), now
+    current = local.replace(minute=0, second=0, microsecond=0)
+    return current.astimezone(dt_timezone.utc) - timedelta(hours=count - 1), now
+
+
+def buckets(start, end, granularity=DAY, tz=None):
+    """Every bucket key in [start, end): local dates, or aware hour starts"""
+    tz = tz or timezone.get_current_timezone()
+    if granularity == DAY:
+        day = start.astimezone(tz).date()
+        last = (end - timedelta(microseconds=1)).astimezone(tz).date()
+        while day <= last:
+            yield day
+            day += timedelta(days=1)
+        return
+    # Step in UTC so DST changes neither skip nor repeat an hour
+    moment = start.astimezone(tz).replace(minute=0, second=0, microsecond=0)
+    while moment < end:
+        yield moment
+        moment = (moment.astimezone(dt_timezone.utc) + timedelta(hours=1)).astimezone(tz)
+
+
+def time_series(queryset, field, start, end, granularity=DAY, tz=None, value=None, using=None):
+    """
+    [(bucket, value)] for every bucket of [start, end), oldest first.
+
+    One query: `field` is filtered as a range and grouped by its day or
+    hour in `tz` (default: the current time zone). `value` is the
+    aggregate per bucket (default: row count); empty buckets are 0.
+    """
+    tz = tz or timezone.get_current_timezone()
+    rows = queryset.using(using or dashboard_database()).filter(**{
+        f'{field}__gte': start,
+        f'{field}__lt': end,
+    }).annotate(
+        bucket=_TRUNCATE[granularity](field, tzinfo=tz)
+    ).order_by().values('bucket').annotate(
+        value=value if value is not None else Count('pk')
+    ).values_list('bucket', 'value')
+    found = dict(rows)
+    return [(bucket, found.get(bucket, 0)) for bucket in buckets(start, end, granularity, tz)]
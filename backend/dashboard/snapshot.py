@@ -0,0 +1,120 @@
+# Cached dashboard overview snapshot
+#
+# Every admin opening the dashboard used to recompute the overview against
+# the database. The overview is now a snapshot shared by all admins:
+#
+# - refresh_dashboard_snapshot (Celery beat, every
+#   DASHBOARD_SNAPSHOT_MAX_AGE seconds or so) recomputes it and stores it
+#   in the cache.
+# - A read returns the cached snapshot. One older than
+#   DASHBOARD_SNAPSHOT_MAX_AGE is still returned, and a single refresh is
+#   queued for it; only a cold cache computes inline, by the one reader
+#   holding the refresh lock while the others wait for its result.
+#   Refreshes go to Celery (DASHBOARD_REFRESH_BACKEND = 'celery', the
+#   default) or to a background thread ('local'); if the broker cannot be
+#   reached the refresh falls back to a thread.
+#
+# Snapshots carry generated_at and the list of metrics that came from
+# row estimates (see queries.estimated_counts).
+import threading
+import time
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+DEFAULT_MAX_AGE = 300
+
+# Stale snapshots are kept this many times longer than they are fresh
+TTL_FACTOR = 12
+
+KEY = 'dashboard:overview'
+REFRESH_LOCK_KEY = 'dashboard:overview:refreshing'
+REFRESH_LOCK_TTL = 120
+
+# How long a cold read waits for another reader's inline refresh
+COLD_WAIT = 10.0
+COLD_POLL_INTERVAL = 0.1
+
+
+def max_age():
+    return getattr(settings, 'DASHBOARD_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE)
+
+
+class DashboardSnapshot:
+    """Shared, periodically refreshed overview statistics"""
+
+    @staticmethod
+    def refresh(release_lock=False):
+        """
+        Compute and cache a new snapshot; returns its stats.
+
+        release_lock=True when the caller took REFRESH_LOCK_KEY for this
+        refresh; other refreshes leave the lock alone.
+        """
+        from .admin_dashboard import DashboardAnalytics
+
+        try:
+            stats = DashboardAnalytics.get_overview_stats()
+            cache.set(KEY, {'stats': stats, 'computed_at': time.time()}, max_age() * TTL_FACTOR)
+            return stats
+        finally:
+            if release_lock:
+                cache.delete(REFRESH_LOCK_KEY)
+
+    @staticmethod
+    def get():
+        entry = cache.get(KEY)
+        if entry is None:
+            return DashboardSnapshot._cold_get()
+        if time.time() - entry['computed_at'] > max_age() and cache.add(REFRESH_LOCK_KEY, True, REFRESH_LOCK_TTL):
+            DashboardSnapshot._queue_refresh()
+        return entry['stats']
+
+    @staticmethod
+    def _queue_refresh():
+        """Refresh in the background; the refresh releases the lock taken for it"""
+        if getattr(settings, 'DASHBOARD_REFRESH_BACKEND', 'celery') == 'celery':
+            try:
+                refresh_dashboard_snapshot.delay(release_lock=True)
+                return
+            except Exception:
+                pass  # Broker unreachable: refresh in this process instead
+        try:
+            threading.Thread(target=_refresh_in_thread, name='dashboard-snapshot', daemon=True).start()
+        except Exception:
+            cache.delete(REFRESH_LOCK_KEY)
+
+    @staticmethod
+    def _cold_get():
+        """Compute inline under the refresh lock, or wait for whoever holds it"""
+        deadline = time.monotonic() + COLD_WAIT
+        while not cache.add(REFRESH_LOCK_KEY, True, REFRESH_LOCK_TTL):
+            if time.monotonic() >= deadline:
+                # The holder is taking too long; compute without the lock
+                return DashboardSnapshot.refresh()
+            time.sleep(COLD_POLL_INTERVAL)
+            entry = cache.get(KEY)
+            if entry is not None:
+                return entry['stats']
+        return DashboardSnapshot.refresh(release_lock=True)
+
+    @staticmethod
+    def invalidate():
+        cache.delete(KEY)
+
+
+def _refresh_in_thread():
+    try:
+        DashboardSnapshot.refresh(release_lock=True)
+    except Exception:
+        pass  # The next stale read tries again
+    finally:
+        connection.close()
+
+
+@shared_task(name='dashboard.refresh_snapshot')
+def refresh_dashboard_snapshot(release_lock=False):
+    """Periodic refresh (schedule with Celery beat at about DASHBOARD_SNAPSHOT_MAX_AGE)"""
+    DashboardSnapshot.refresh(release_lock)
+    return True
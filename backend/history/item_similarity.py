@@ -0,0 +1,328 @@
+# Item-to-item collaborative filtering
+#
+# Complements the category recommender (see recommendations) with "people
+# who watched these also watched" candidates learned from VideoView:
+#
+# - X is the binary users x videos interaction matrix, and the co-occurrence
+#   counts are C = X^T X (diagonal dropped), accumulated over user blocks. Each
+#   video keeps its COUNT_NEIGHBORS largest counts.
+# - Similarity is cosine, S = D^-1/2 C D^-1/2 with D the per-video viewer
+#   counts. Each row is pruned to its NEIGHBORS most similar videos.
+# - Scoring a user is one sparse row gather plus a weighted bincount: the
+#   rows of S for the user's recent videos (weighted by recency) are summed,
+#   watched videos are zeroed, and argpartition picks the top N.
+#
+# The model is built offline (build_item_similarity command) from the last
+# BUILD_DAYS of views and saved as one .npz file. update_item_similarity
+# folds in views recorded since the build's watermark:
+#   delta C = Xnew^T Xold + Xold^T Xnew + Xnew^T Xnew
+# where Xold is the earlier history of the users with new views. Incremental
+# counts do not age out, so schedule a periodic full rebuild as well.
+#
+# Web processes load the file lazily and reload it when it changes on disk.
+import os
+import threading
+import numpy as np
+from scipy import sparse
+from celery import shared_task
+from django.conf import settings
+
+NEIGHBORS = 50
+COUNT_NEIGHBORS = 200
+
+# Views older than this are ignored by full builds
+BUILD_DAYS = 180
+
+# Recent distinct videos used to score a user, and their recency decay
+HISTORY_ITEMS = 50
+HISTORY_DECAY = 0.9
+
+# Users per block when accumulating X^T X
+BLOCK_USERS = 100000
+
+# Rows fetched per chunk when reading VideoView
+READ_CHUNK = 100000
+
+
+def model_path():
+    return getattr(settings, 'ITEM_SIMILARITY_MODEL_PATH', os.path.join(
+        getattr(settings, 'MEDIA_ROOT', ''), 'recommender', 'item_similarity.npz'))
+
+
+def interaction_matrix(user_idx, item_idx, n_users, n_items):
+    """Binary users x items CSR matrix (repeated views count once)"""
+    data = np.ones(len(user_idx), dtype=np.float32)
+    matrix = sparse.csr_matrix((data, (user_idx, item_idx)), shape=(n_users, n_items))
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def cooccurrence(interactions, block_users=BLOCK_USERS):
+    """X^T X without its diagonal, summed block by block to bound peak memory"""
+    counts = sparse.csr_matrix((interactions.shape[1], interactions.shape[1]), dtype=np.float32)
+    for start in range(0, interactions.shape[0], block_users):
+        block = interactions[start:start + block_users]
+        counts = counts + (block.T @ block).tocsr()
+    return drop_diagonal(counts)
+
+
+def drop_diagonal(matrix):
+    matrix = matrix.tocoo()
+    keep = matrix.row != matrix.col
+    return sparse.csr_matrix((matrix.data[keep], (matrix.row[keep], matrix.col[keep])), shape=matrix.shape)
+
+
+def top_k_per_row(matrix, k):
+    """Keep the k largest entries of each CSR row"""
+    matrix = matrix.tocsr(copy=True)
+    lengths = np.diff(matrix.indptr)
+    for row in np.flatnonzero(lengths > k):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        smallest = np.argpartition(matrix.data[start:end], -k)[:-k]
+        matrix.data[start + smallest] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+
+class ItemItemModel:
+    """Co-occurrence counts and pruned cosine similarity over video ids"""
+
+    def __init__(self, item_ids, counts, item_counts, watermark=0, neighbors=NEIGHBORS):
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)  # sorted video ids
+        self.counts = counts.tocsr()
+        self.item_counts = np.asarray(item_counts, dtype=np.float32)
+        self.watermark = int(watermark)  # last VideoView id included
+        self.neighbors = neighbors
+        self.similarity = self._similarity()
+
+    @classmethod
+    def build(cls, user_ids, video_ids, watermark=0, neighbors=NEIGHBORS):
+        """Model from parallel arrays of (user id, video id) views"""
+        item_ids, item_idx = np.unique(video_ids, return_inverse=True)
+        users, user_idx = np.unique(user_ids, return_inverse=True)
+        interactions = interaction_matrix(user_idx, item_idx, len(users), len(item_ids))
+        counts = top_k_per_row(cooccurrence(interactions), COUNT_NEIGHBORS)
+        item_counts = np.asarray(interactions.sum(axis=0)).ravel()
+        return cls(item_ids, counts, item_counts, watermark, neighbors)
+
+    def _similarity(self):
+        inverse = np.zeros_like(self.item_counts)
+        nonzero = self.item_counts > 0
+        inverse[nonzero] = 1.0 / np.sqrt(self.item_counts[nonzero])
+        scale = sparse.diags(inverse)
+        return top_k_per_row(scale @ self.counts @ scale, self.neighbors)
+
+    def positions(self, video_ids):
+        """Column of each video id, or -1 for videos unknown to the model"""
+        video_ids = np.asarray(video_ids, dtype=np.int64)
+        positions = np.searchsorted(self.item_ids, video_ids)
+        positions[positions >= len(self.item_ids)] = 0
+        found = len(self.item_ids) > 0
+        known = (self.item_ids[positions] == video_ids) if found else np.zeros(len(video_ids), bool)
+        return np.where(known, positions, -1)
+
+    def _grow(self, video_ids):
+        """Add columns for videos first seen in an update"""
+        item_ids = np.union1d(self.item_ids, video_ids)
+        if len(item_ids) == len(self.item_ids):
+            return
+        moved = np.searchsorted(item_ids, self.item_ids)
+        counts = self.counts.tocoo()
+        self.counts = sparse.csr_matrix(
+            (counts.data, (moved[counts.row], moved[counts.col])), shape=(len(item_ids), len(item_ids)))
+        item_counts = np.zeros(len(item_ids), dtype=np.float32)
+        item_counts[moved] = self.item_counts
+        self.item_ids, self.item_counts = item_ids, item_counts
+
+    def update(self, new_user_ids, new_video_ids, history_user_ids, history_video_ids, watermark):
+        """Fold new views into the counts given the earlier history of the same users"""
+        self._grow(new_video_ids)
+        users, user_idx = np.unique(np.concatenate([new_user_ids, history_user_ids]), return_inverse=True)
+        new_users, history_users = user_idx[:len(new_user_ids)], user_idx[len(new_user_ids):]
+        n_items = len(self.item_ids)
+
+        history_positions = self.positions(history_video_ids)
+        known = history_positions >= 0
+        previous = interaction_matrix(history_users[known], history_positions[known], len(users), n_items)
+        current = interaction_matrix(new_users, self.positions(new_video_ids), len(users), n_items)
+        # A video the user had already watched adds no new co-occurrences
+        current = (current - current.multiply(previous)).tocsr()
+        current.eliminate_zeros()
+
+        cross = (current.T @ previous).tocsr()
+        delta = drop_diagonal(cross + cross.T + current.T @ current)
+
+        self.counts = top_k_per_row(self.counts + delta, COUNT_NEIGHBORS)
+        self.item_counts = self.item_counts + np.asarray(current.sum(axis=0)).ravel()
+        self.watermark = int(watermark)
+        self.similarity = self._similarity()
+
+    def score(self, history_video_ids, limit=20, exclude=()):
+        """[(video_id, score)] best first for a user's recent videos, most recent first"""
+        positions = self.positions(history_video_ids)
+        weights = HISTORY_DECAY ** np.arange(len(positions), dtype=np.float32)
+        known = positions >= 0
+        positions, weights = positions[known], weights[known]
+        if not len(positions):
+            return []
+
+        rows = self.similarity[positions]
+        scores = np.bincount(
+            rows.indices,
+            weights=rows.data * np.repeat(weights, np.diff(rows.indptr)),
+            minlength=len(self.item_ids)
+        )
+        seen = self.positions(list(history_video_ids) + list(exclude))
+        scores[seen[seen >= 0]] = 0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(scores[candidates], -limit)[-limit:]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(self.item_ids[i]), float(scores[i])) for i in candidates]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f'{path}.tmp.npz'
+        counts = self.counts.tocsr()
+        np.savez(
+            temporary,
+            item_ids=self.item_ids,
+            item_counts=self.item_counts,
+            counts_data=counts.data, counts_indices=counts.indices, counts_indptr=counts.indptr,
+            meta=np.array([self.watermark, self.neighbors], dtype=np.int64)
+        )
+        # Readers only ever see a complete file
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            n_items = len(data['item_ids'])
+            counts = sparse.csr_matrix(
+                (data['counts_data'], data['counts_indices'], data['counts_indptr']), shape=(n_items, n_items))
+            watermark, neighbors = data['meta']
+            return cls(data['item_ids'], counts, data['item_counts'], watermark, int(neighbors))
+
+
+def read_views(queryset):
+    """(view ids, user ids, video ids) arrays from a VideoView queryset, read in chunks"""
+    chunks, chunk = [], []
+    for row in queryset.values_list('id', 'user_id', 'video_id').iterator(chunk_size=READ_CHUNK):
+        chunk.append(row)
+        if len(chunk) >= READ_CHUNK:
+            chunks.append(np.array(chunk, dtype=np.int64))
+            chunk = []
+    if chunk:
+        chunks.append(np.array(chunk, dtype=np.int64))
+    if not chunks:
+        return np.zeros((3, 0), dtype=np.int64)
+    rows = np.concatenate(chunks)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+class ItemSimilarity:
+    """Builds, updates and serves the item-item model from VideoView"""
+
+    _model = None
+    _mtime = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def build(days=BUILD_DAYS, neighbors=NEIGHBORS, path=None):
+        from ..models import VideoView
+        from django.db.models import Max
+        from django.utils import timezone
+        from datetime import timedelta
+
+        watermark = VideoView.objects.aggregate(last=Max('id'))['last'] or 0
+        _, users, videos = read_views(VideoView.objects.filter(
+            id__lte=watermark, viewed_at__gte=timezone.now() - timedelta(days=days)))
+        model = ItemItemModel.build(users, videos, watermark, neighbors)
+        model.save(path or model_path())
+        return model
+
+    @staticmethod
+    def update(path=None, days=BUILD_DAYS, user_batch=1000):
+        """Fold views newer than the saved watermark into the model; returns views applied"""
+        from ..models import VideoView
+        from django.utils import timezone
+        from datetime import timedelta
+
+        path = path or model_path()
+        if not os.path.exists(path):
+            ItemSimilarity.build(days, path=path)
+            return 0
+        model = ItemItemModel.load(path)
+        view_ids, new_users, new_videos = read_views(
+            VideoView.objects.filter(id__gt=model.watermark).order_by('id'))
+        if not len(view_ids):
+            return 0
+
+        since = timezone.now() - timedelta(days=days)
+        history_users, history_videos = [], []
+        user_ids = np.unique(new_users).tolist()
+        for start in range(0, len(user_ids), user_batch):
+            _, users, videos = read_views(VideoView.objects.filter(
+                user_id__in=user_ids[start:start + user_batch],
+                id__lte=model.watermark,
+                viewed_at__gte=since
+            ))
+            history_users.append(users)
+            history_videos.append(videos)
+
+        model.update(new_users, new_videos, np.concatenate(history_users), np.concatenate(history_videos),
+                     view_ids.max())
+        model.save(path)
+        return len(view_ids)
+
+    @classmethod
+    def model(cls):
+        """Current model from disk (reloaded when the file changes), or None"""
+        path = model_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with cls._lock:
+            if cls._model is None or cls._mtime != mtime:
+                cls._model, cls._mtime = ItemItemModel.load(path), mtime
+            return cls._model
+
+    @staticmethod
+    def recommend(user_id, limit=20):
+        """Videos similar to the user's recent history, best first"""
+        from ..models import Video, VideoView
+
+        model = ItemSimilarity.model()
+        if model is None:
+            return []
+
+        history = []
+        for video_id in VideoView.objects.filter(user_id=user_id).order_by(
+                '-viewed_at').values_list('video_id', flat=True)[:HISTORY_ITEMS * 2]:
+            if video_id not in history:
+                history.append(video_id)
+        history = history[:HISTORY_ITEMS]
+
+        ranked = model.score(history, limit * 2)
+        # Older views are not in the scored history; drop them among the candidates
+        watched = set(VideoView.objects.filter(
+            user_id=user_id, video_id__in=[video_id for video_id, _ in ranked]
+        ).values_list('video_id', flat=True))
+        ids = [video_id for video_id, _ in ranked if video_id not in watched][:limit]
+
+        videos = Video.objects.in_bulk(ids)
+        return [videos[video_id] for video_id in ids if video_id in videos]
+
+
+@shared_task(name='history.build_item_similarity')
+def build_item_similarity(days=BUILD_DAYS):
+    """Full rebuild (e.g. nightly with Celery beat)"""
+    return ItemSimilarity.build(days).watermark
+
+
+@shared_task(name='history.update_item_similarity')
+def update_item_similarity():
+    """Incremental update from new views (e.g. every 15 minutes)"""
+    return ItemSimilarity.update()
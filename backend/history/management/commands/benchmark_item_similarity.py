@@ -0,0 +1,69 @@
+import statistics
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ...item_similarity import ItemItemModel
+
+
+class Command(BaseCommand):
+    help = ('Build, update and score the item-item model on a synthetic interaction set '
+            '(no database access)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--videos', type=int, default=100000)
+        parser.add_argument('--views-per-user', type=float, default=15.0, help='Mean (Poisson)')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Video popularity skew')
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        users, videos = self._synthesize(rng, options)
+        self.stdout.write(f'{len(users)} views by {options["users"]} users over {options["videos"]} videos')
+
+        start = time.perf_counter()
+        model = ItemItemModel.build(users, videos)
+        self.stdout.write(f'{"build":>10}: {time.perf_counter() - start:8.1f} s, '
+                          f'{model.counts.nnz} counts, {model.similarity.nnz} similarities')
+
+        # One new view for each of 10k existing users
+        new_users = rng.choice(options['users'], size=10000, replace=False)
+        new_videos = self._popular(rng, options, len(new_users))
+        history = np.isin(users, new_users)
+        start = time.perf_counter()
+        model.update(new_users, new_videos, users[history], videos[history], 0)
+        self.stdout.write(f'{"update":>10}: {time.perf_counter() - start:8.1f} s for {len(new_users)} views')
+
+        order = np.argsort(users, kind='stable')
+        bounds = np.searchsorted(users[order], np.arange(options['users'] + 1))
+        timings = []
+        for user in rng.choice(options['users'], size=options['queries']):
+            recent = videos[order[bounds[user]:bounds[user + 1]]][::-1]
+            start = time.perf_counter()
+            model.score(recent, 20)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f'{"score":>10}: median {statistics.median(timings):8.3f} ms, p95 {p95:8.3f} ms')
+        size = sum(array.nbytes for array in (model.similarity.data, model.similarity.indices,
+                                               model.similarity.indptr, model.item_ids))
+        self.stdout.write(self.style.SUCCESS(f'Serving model size: {size / 2 ** 20:.1f} MiB'))
+
+    def _popular(self, rng, options, size):
+        ranks = np.arange(1, options['videos'] + 1, dtype=np.float64)
+        weights = ranks ** -options['zipf']
+        return rng.choice(options['videos'], size=size, p=weights / weights.sum())
+
+    def _synthesize(self, rng, options):
+        """Zipf-popular videos; each user stays near a random 'taste' region of the catalog"""
+        counts = np.maximum(rng.poisson(options['views_per_user'], options['users']), 1)
+        users = np.repeat(np.arange(options['users']), counts)
+        popular = self._popular(rng, options, len(users))
+        taste = np.repeat(rng.integers(0, options['videos'], options['users']), counts)
+        local = (taste + rng.integers(-500, 500, len(users))) % options['videos']
+        # Half of the views follow global popularity, half the user's taste
+        videos = np.where(rng.random(len(users)) < 0.5, popular, local)
+        return users, videos.astype(np.int64)
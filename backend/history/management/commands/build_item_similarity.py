@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+
+from ...item_similarity import BUILD_DAYS, NEIGHBORS, ItemSimilarity, model_path
+
+
+class Command(BaseCommand):
+    help = 'Build the item-item similarity model from VideoView (or fold in new views with --update)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=BUILD_DAYS, help='Views from this many days')
+        parser.add_argument('--neighbors', type=int, default=NEIGHBORS, help='Similar videos kept per video')
+        parser.add_argument('--update', action='store_true', help='Incremental update instead of a full build')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        if options['update']:
+            applied = ItemSimilarity.update(days=options['days'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Applied {applied} new views in {time.monotonic() - start:.1f}s'
+            ))
+            return
+
+        model = ItemSimilarity.build(options['days'], options['neighbors'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Built {len(model.item_ids)} videos, {model.similarity.nnz} similarities '
+            f'(watermark {model.watermark}) in {time.monotonic() - start:.1f}s -> {model_path()}'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...watch_history import WatchHistory
+
+
+class Command(BaseCommand):
+    help = 'Create the (user_id, video_id, viewed_at) index used by record_view session lookups'
+
+    def handle(self, *args, **options):
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        with connection.cursor() as cursor:
+            for statement in WatchHistory.install_sql():
+                cursor.execute(statement)
+        self.stdout.write(self.style.SUCCESS('Installed watch history session index'))
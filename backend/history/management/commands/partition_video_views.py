@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...view_storage import PARTITIONS_AHEAD, ViewPartitions
+
+
+class Command(BaseCommand):
+    help = 'Convert VideoView to monthly partitions (PostgreSQL) and create upcoming partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=PARTITIONS_AHEAD,
+                            help='Create partitions this many months past the current one')
+
+    def handle(self, *args, **options):
+        if not ViewPartitions.supported():
+            raise CommandError('Partitioned VideoView storage requires PostgreSQL')
+        boundary = ViewPartitions.convert()
+        if boundary is not None:
+            self.stdout.write(f'Attached existing rows as the legacy partition (before {boundary})')
+        created = ViewPartitions.ensure(options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS(f'VideoView partitions up to date ({len(created)} checked)'))
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+
+from ...recommendations import ACTIVE_DAYS, RecommendationCache
+
+
+class Command(BaseCommand):
+    help = 'Rebuild cached recommendations for every recently active user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=1,
+                            help='Split users into this many user_id % shards groups')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Rebuild shards on a pool of this many processes')
+        parser.add_argument('--days', type=int, default=ACTIVE_DAYS,
+                            help='Users with a view in this many days are rebuilt')
+
+    def handle(self, *args, **options):
+        shards = max(options['shards'], options['processes'])
+        start = time.monotonic()
+        built = RecommendationCache.rebuild_all(shards, options['processes'], options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt recommendations for {built} users in {time.monotonic() - start:.1f}s'
+        ))
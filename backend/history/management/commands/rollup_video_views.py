@@ -0,0 +1,27 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand
+
+from ...view_storage import ROLLUP_DAYS, ViewRollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute VideoViewDaily rollups from raw views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ROLLUP_DAYS,
+                            help='Recompute this many most recent days')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Recompute every day since --since (default: the oldest view)')
+        parser.add_argument('--since', type=date.fromisoformat, default=None,
+                            help='First day (YYYY-MM-DD) for --backfill')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        if options['backfill']:
+            rows = ViewRollups.backfill(options['since'])
+            summary = f'Backfilled {rows} rollup rows'
+        else:
+            days = ViewRollups.rollup(options['days'])
+            summary = f'Recomputed {days} days'
+        self.stdout.write(self.style.SUCCESS(f'{summary} in {time.monotonic() - start:.1f}s'))
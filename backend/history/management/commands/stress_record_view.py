@@ -0,0 +1,65 @@
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from ...watch_history import SESSION_WINDOW, WatchHistory
+
+
+class Command(BaseCommand):
+    help = ('Hammer record_view for one user/video pair from many threads and check that '
+            'concurrent heartbeats end up in a single session row')
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int)
+        parser.add_argument('video_id', type=int)
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--beats', type=int, default=20, help='Heartbeats per thread')
+        parser.add_argument('--keep', action='store_true', help='Keep the rows created by the run')
+
+    def handle(self, *args, **options):
+        from django.contrib.auth import get_user_model
+        from ....models import Video, VideoView
+
+        user = get_user_model().objects.get(id=options['user_id'])
+        video = Video.objects.get(id=options['video_id'])
+        session_views = VideoView.objects.filter(
+            user=user, video=video, viewed_at__gte=timezone.now() - SESSION_WINDOW
+        )
+        if session_views.exists():
+            raise CommandError('The pair already has a view in the current session window')
+
+        errors = []
+        start = threading.Barrier(options['threads'])
+
+        def worker(index):
+            try:
+                start.wait()
+                for beat in range(options['beats']):
+                    WatchHistory.record_view(user, video, index * options['beats'] + beat)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        rows = list(session_views.order_by('id'))
+        expected_duration = options['threads'] * options['beats'] - 1
+        self.stdout.write(f'{options["threads"] * options["beats"]} heartbeats, {len(rows)} session rows, '
+                          f'{len(errors)} errors')
+
+        if not options['keep']:
+            session_views.delete()
+
+        if errors:
+            raise CommandError(f'record_view raised: {errors[0]!r}')
+        if len(rows) != 1:
+            raise CommandError(f'Expected one session row, found {len(rows)}')
+        if rows[0].watch_duration != expected_duration:
+            raise CommandError(f'watch_duration {rows[0].watch_duration} != max heartbeat {expected_duration}')
+        self.stdout.write(self.style.SUCCESS('OK: one session row with the max watch_duration'))
@@ -0,0 +1,382 @@
+# Write-behind buffer for watch-progress heartbeats
+#
+# Players report progress every few seconds, and record_view costs a lookup
+# plus an UPDATE or INSERT per report, so database writes grew with the
+# number of concurrent viewers. Heartbeats now only merge into a buffer keyed
+# by (user, video), using record_view's rules: watch_duration is the max seen,
+# completed is sticky, last_position is the latest report. Buffered entries go
+# to VideoView in bulk every WATCH_PROGRESS_FLUSH_INTERVAL seconds
+# (WatchHistory.apply_progress). An entry is also flushed at once when its
+# session ends.
+#
+# Stores:
+# - Redis (through django-redis, when the default cache is Redis): one hash
+#   per pair plus a set of dirty pairs. Merging and draining are Lua scripts,
+#   so any number of processes can write and flush concurrently. Draining
+#   renames each hash into a processing area (tracked in a sorted set by
+#   drain time) instead of deleting it; the flusher acks the entries once
+#   they are written, and entries left unacked for PROCESSING_TIMEOUT
+#   seconds are merged back into the buffer by the next drain.
+# - In-process dict: merged in memory and flushed by the process that
+#   buffered it.
+#
+# Durability:
+# - Redis: buffered progress survives web process crashes and restarts,
+#   including a crash between draining a batch and writing it. It is lost
+#   only if Redis loses data, within its persistence settings. A reclaimed
+#   batch that its flusher did write after all is written again, which
+#   apply_progress's session rule makes harmless.
+# - In-process: at most one flush interval of progress per process is lost
+#   on a crash. An atexit hook flushes on clean shutdown.
+# - With either store, a flush that fails puts its entries back to be retried.
+#   The worst outcome is a slightly stale position, never a lost view.
+import atexit
+import os
+import threading
+import time
+import uuid
+from itertools import islice
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULT_FLUSH_INTERVAL = 10.0
+DEFAULT_BATCH_SIZE = 500
+
+# Buffered Redis entries expire if nothing flushes them for this long
+REDIS_ENTRY_TTL = 24 * 3600
+
+# Drained Redis entries not acked within this many seconds go back to the buffer
+PROCESSING_TIMEOUT = 300
+
+KEY_PREFIX = 'progress'
+
+_MERGE_SCRIPT = """
+local duration = tonumber(redis.call('HGET', KEYS[1], 'watch_duration') or '-1')
+if tonumber(ARGV[1]) > duration then
+    redis.call('HSET', KEYS[1], 'watch_duration', ARGV[1])
+end
+if ARGV[2] == '1' then
+    redis.call('HSET', KEYS[1], 'completed', '1')
+end
+local last_seen = tonumber(redis.call('HGET', KEYS[1], 'last_seen') or '-1')
+if tonumber(ARGV[4]) >= last_seen then
+    redis.call('HSET', KEYS[1], 'last_position', ARGV[3], 'last_seen', ARGV[4])
+end
+local first_seen = redis.call('HGET', KEYS[1], 'first_seen')
+if not first_seen or tonumber(ARGV[7]) < tonumber(first_seen) then
+    redis.call('HSET', KEYS[1], 'first_seen', ARGV[7])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('SADD', KEYS[2], ARGV[5])
+return 1
+"""
+
+_DRAIN_SCRIPT = """
+local function fold(dst, src)
+    local fields = redis.call('HGETALL', src)
+    if #fields == 0 then
+        return false
+    end
+    local entry = {}
+    for i = 1, #fields, 2 do
+        entry[fields[i]] = fields[i + 1]
+    end
+    local duration = tonumber(redis.call('HGET', dst, 'watch_duration') or '-1')
+    if tonumber(entry.watch_duration) > duration then
+        redis.call('HSET', dst, 'watch_duration', entry.watch_duration)
+    end
+    if entry.completed == '1' then
+        redis.call('HSET', dst, 'completed', '1')
+    end
+    local last_seen = tonumber(redis.call('HGET', dst, 'last_seen') or '-1')
+    if tonumber(entry.last_seen) >= last_seen then
+        redis.call('HSET', dst, 'last_position', entry.last_position, 'last_seen', entry.last_seen)
+    end
+    local first_seen = redis.call('HGET', dst, 'first_seen')
+    if not first_seen or tonumber(entry.first_seen) < tonumber(first_seen) then
+        redis.call('HSET', dst, 'first_seen', entry.first_seen)
+    end
+    return true
+end
+
+local members
+if ARGV[3] ~= '' then
+    members = {}
+    if redis.call('SREM', KEYS[1], ARGV[3]) == 1 then
+        members[1] = ARGV[3]
+    end
+else
+    -- Batches whose flusher never acked them (crashed) go back to the buffer
+    for _, item in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[7], 'LIMIT', 0, ARGV[1])) do
+        local member = string.sub(item, string.find(item, ':', 1, true) + 1)
+        local key = ARGV[2] .. member
+        if fold(key, ARGV[4] .. item) then
+            redis.call('EXPIRE', key, ARGV[8])
+            redis.call('SADD', KEYS[1], member)
+        end
+        redis.call('DEL', ARGV[4] .. item)
+        redis.call('ZREM', KEYS[2], item)
+    end
+    members = redis.call('SPOP', KEYS[1], ARGV[1])
+end
+local out = {}
+for _, member in ipairs(members) do
+    local key = ARGV[2] .. member
+    if redis.call('EXISTS', key) == 1 then
+        local item = ARGV[5] .. ':' .. member
+        redis.call('RENAME', key, ARGV[4] .. item)
+        redis.call('EXPIRE', ARGV[4] .. item, ARGV[8])
+        redis.call('ZADD', KEYS[2], ARGV[6], item)
+        out[#out + 1] = item
+        out[#out + 1] = redis.call('HGETALL', ARGV[4] .. item)
+    end
+end
+return out
+"""
+
+
+def merge(entry, watch_duration, completed, position, moment, first_seen=None):
+    """Fold one heartbeat into a buffered entry (record_view's rules)"""
+    entry['watch_duration'] = max(entry.get('watch_duration', watch_duration), watch_duration)
+    entry['completed'] = bool(completed) or entry.get('completed', False)
+    if moment >= entry.get('last_seen', moment):
+        entry['last_position'] = position
+        entry['last_seen'] = moment
+    entry['first_seen'] = min(entry.get('first_seen', moment), first_seen or moment)
+    return entry
+
+
+class LocalProgressStore:
+    """Per-process dict of buffered entries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # (user_id, video_id) -> entry
+
+    def merge(self, user_id, video_id, watch_duration, completed, position, moment):
+        with self._lock:
+            entry = self._entries.setdefault((user_id, video_id), {'user_id': user_id, 'video_id': video_id})
+            merge(entry, watch_duration, completed, position, moment)
+
+    def drain(self, limit, pair=None):
+        with self._lock:
+            if pair is not None:
+                entry = self._entries.pop(pair, None)
+                return [entry] if entry else []
+            pairs = list(islice(self._entries, limit))
+            return [self._entries.pop(key) for key in pairs]
+
+    def discard(self, user_id, video_id=None):
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key[0] == user_id and (video_id is None or key[1] == video_id)]:
+                del self._entries[key]
+
+    def ack(self, entries):
+        """Drained entries leave the dict at once; nothing to release"""
+
+    def restore(self, entries):
+        """Put entries back after a failed flush, merging with newer heartbeats"""
+        with self._lock:
+            for entry in entries:
+                key = (entry['user_id'], entry['video_id'])
+                current = self._entries.setdefault(key, {'user_id': entry['user_id'],
+                                                         'video_id': entry['video_id']})
+                merge(current, entry['watch_duration'], entry['completed'], entry['last_position'],
+                      entry['last_seen'], entry['first_seen'])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisProgressStore:
+    """Hash per (user, video) plus a dirty set, shared by all processes"""
+
+    def __init__(self, alias='default'):
+        from django_redis import get_redis_connection
+
+        self.redis = get_redis_connection(alias)
+        self._merge = self.redis.register_script(_MERGE_SCRIPT)
+        self._drain = self.redis.register_script(_DRAIN_SCRIPT)
+        self.dirty_key = f'{KEY_PREFIX}:dirty'
+        self.entry_prefix = f'{KEY_PREFIX}:entry:'
+        self.processing_key = f'{KEY_PREFIX}:processing'
+        self.processing_prefix = f'{KEY_PREFIX}:processing:'
+
+    def merge(self, user_id, video_id, watch_duration, completed, position, moment, first_seen=None):
+        member = f'{user_id}:{video_id}'
+        self._merge(keys=[self.entry_prefix + member, self.dirty_key],
+                    args=[watch_duration, '1' if completed else '0', position, repr(moment), member,
+                          REDIS_ENTRY_TTL, repr(first_seen or moment)])
+
+    def drain(self, limit, pair=None):
+        member = f'{pair[0]}:{pair[1]}' if pair is not None else ''
+        now = time.time()
+        raw = self._drain(keys=[self.dirty_key, self.processing_key],
+                          args=[limit, self.entry_prefix, member, self.processing_prefix, uuid.uuid4().hex,
+                                repr(now), repr(now - PROCESSING_TIMEOUT), REDIS_ENTRY_TTL])
+        entries = []
+        for i in range(0, len(raw), 2):
+            item = raw[i].decode()
+            fields = {key.decode(): value.decode() for key, value in zip(raw[i + 1][::2], raw[i + 1][1::2])}
+            _, user_id, video_id = item.split(':')
+            entries.append({
+                'item': item,
+                'user_id': int(user_id),
+                'video_id': int(video_id),
+                'watch_duration': float(fields['watch_duration']),
+                'completed': fields.get('completed') == '1',
+                'last_position': float(fields['last_position']),
+                'first_seen': float(fields['first_seen']),
+                'last_seen': float(fields['last_seen']),
+            })
+        return entries
+
+    def discard(self, user_id, video_id=None):
+        if video_id is not None:
+            members = [f'{user_id}:{video_id}']
+        else:
+            members = [member.decode() for member in self.redis.sscan_iter(self.dirty_key, match=f'{user_id}:*')]
+        if members:
+            pipe = self.redis.pipeline()
+            pipe.srem(self.dirty_key, *members)
+            pipe.delete(*[self.entry_prefix + member for member in members])
+            pipe.execute()
+
+    def ack(self, entries):
+        """Release drained entries once they are written (or dropped)"""
+        items = [entry['item'] for entry in entries]
+        if items:
+            pipe = self.redis.pipeline()
+            pipe.zrem(self.processing_key, *items)
+            pipe.delete(*[self.processing_prefix + item for item in items])
+            pipe.execute()
+
+    def restore(self, entries):
+        for entry in entries:
+            # Merging keeps any newer heartbeat's position
+            self.merge(entry['user_id'], entry['video_id'], entry['watch_duration'], entry['completed'],
+                       entry['last_position'], entry['last_seen'], entry['first_seen'])
+        self.ack(entries)
+
+    def __len__(self):
+        return self.redis.scard(self.dirty_key)
+
+
+class ProgressBuffer:
+    """Buffers progress heartbeats and flushes them to VideoView in bulk"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, store, flush_interval=None, batch_size=None):
+        self.store = store
+        self.flush_interval = flush_interval or getattr(settings, 'WATCH_PROGRESS_FLUSH_INTERVAL',
+                                                        DEFAULT_FLUSH_INTERVAL)
+        self.batch_size = batch_size or getattr(settings, 'WATCH_PROGRESS_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self.dropped = 0
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                backend = getattr(settings, 'WATCH_PROGRESS_BACKEND', None)
+                if backend is None:
+                    configured = getattr(settings, 'CACHES', {}).get('default', {}).get('BACKEND', '')
+                    backend = 'redis' if 'redis' in configured.lower() else 'memory'
+                cls._instance = cls(RedisProgressStore() if backend == 'redis' else LocalProgressStore())
+                atexit.register(cls._instance.stop)
+            return cls._instance
+
+    def record(self, user_id, video_id, watch_duration, completed=False):
+        """Buffer one heartbeat; no database access"""
+        self._ensure_started()
+        # Merged entries are compared with max(); never mix strings in
+        watch_duration = float(watch_duration)
+        self.store.merge(user_id, video_id, watch_duration, bool(completed), watch_duration, time.time())
+
+    def end_session(self, user_id, video_id):
+        """
+        Flush one pair now (player closed or video finished); returns its
+        VideoView, or None if nothing was buffered or the write failed (the
+        entry is then restored and goes out with the next flush).
+        """
+        try:
+            views = self._apply(self.store.drain(1, pair=(user_id, video_id)))
+        except Exception:
+            return None
+        return views[0] if views else None
+
+    def discard(self, user_id, video_id=None):
+        """Drop buffered progress of a user (or one of their videos) without writing it"""
+        self.store.discard(user_id, video_id)
+
+    def _ensure_started(self):
+        # Threads do not survive fork(); pre-fork servers start one per worker
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._instance_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='watch-progress-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+        close_old_connections()
+
+    def _apply(self, entries):
+        """
+        Write entries; on failure retry them one by one. If every entry still
+        fails the database is likely unavailable and all are restored; entries
+        that fail while others succeed (e.g. a deleted video) are dropped.
+        """
+        from .watch_history import WatchHistory
+
+        if not entries:
+            return []
+        try:
+            views = WatchHistory.apply_progress(entries)
+            self.store.ack(entries)
+            return views
+        except Exception:
+            if len(entries) == 1:
+                self.store.restore(entries)
+                raise
+
+        views, failed = [], []
+        for entry in entries:
+            try:
+                views.extend(WatchHistory.apply_progress([entry]))
+            except Exception:
+                failed.append(entry)
+        if len(failed) == len(entries):
+            self.store.restore(entries)
+            raise RuntimeError('Watch progress flush failed; entries restored')
+        self.store.ack(entries)
+        self.dropped += len(failed)
+        return views
+
+    def flush(self):
+        """Write everything buffered; returns the number of entries flushed"""
+        flushed = 0
+        with self._flush_lock:
+            close_old_connections()
+            while True:
+                entries = self.store.drain(self.batch_size)
+                if not entries:
+                    return flushed
+                try:
+                    self._apply(entries)
+                except Exception:
+                    return flushed  # restored; retried on the next interval
+                flushed += len(entries)
+
+    def stop(self):
+        self._stopping.set()
+        self.flush()
@@ -0,0 +1,175 @@
+# Precomputed per-user recommendations
+#
+# get_recommended_based_on_history used to load every category of a user's
+# whole history into Python and then run NOT IN (every watched id) over the
+# catalog on each request. Recommendations are now built ahead of time:
+#
+# - build_user() counts the user's top categories in the database (GROUP BY)
+#   and picks the most viewed videos in them that the user has not watched.
+#   Watched videos are excluded by a NOT EXISTS probe of the
+#   (user_id, video_id, viewed_at) index per candidate, so users who watched
+#   the most popular videos still get a full pool.
+# - The result is cached under recs:<user_id> for RECOMMENDATION_TTL seconds:
+#   a few category weights and a list of video ids.
+# - rebuild_recommendations (Celery) rebuilds every recently active user,
+#   either in-process or sharded by user id over a process pool.
+#
+# Online reads fetch the cached entry, drop videos the user watched since it
+# was built, and load the remaining videos in one query. A cache miss builds
+# the entry inline.
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Exists, OuterRef, Value
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+TOP_CATEGORIES = 3
+
+# Candidates kept per user; reads return the first `limit` still unwatched
+CANDIDATE_POOL = 100
+
+DEFAULT_TTL = 6 * 3600
+
+# Batch rebuilds cover users with a view in this many days
+ACTIVE_DAYS = 30
+
+KEY_PREFIX = 'recs'
+
+
+def cache_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def ttl():
+    return getattr(settings, 'RECOMMENDATION_TTL', DEFAULT_TTL)
+
+
+class RecommendationCache:
+    """Builds, stores and serves per-user recommendation entries"""
+
+    @staticmethod
+    def build_user(user_id):
+        """Compute one user's entry: {'categories', 'candidates', 'built_at'}"""
+        from ..models import Video, VideoView
+
+        top = list(VideoView.objects.filter(user_id=user_id).values('video__category').annotate(
+            count=Count('id')
+        ).order_by('-count')[:TOP_CATEGORIES])
+        categories = [(row['video__category'], row['count']) for row in top]
+
+        candidates = []
+        if categories:
+            watched = VideoView.objects.filter(user_id=user_id, video_id=OuterRef('pk'))
+            candidates = list(Video.objects.filter(
+                category__in=[category for category, _ in categories]
+            ).filter(~Exists(watched)).order_by('-views', '-created_at').values_list(
+                'id', flat=True
+            )[:CANDIDATE_POOL])
+
+        return {'categories': categories, 'candidates': candidates, 'built_at': time.time()}
+
+    @staticmethod
+    def store(user_id, entry):
+        cache.set(cache_key(user_id), entry, ttl())
+
+    @staticmethod
+    def store_many(entries):
+        cache.set_many({cache_key(user_id): entry for user_id, entry in entries.items()}, ttl())
+
+    @staticmethod
+    def get_entry(user_id):
+        entry = cache.get(cache_key(user_id))
+        if entry is None:
+            entry = RecommendationCache.build_user(user_id)
+            RecommendationCache.store(user_id, entry)
+        return entry
+
+    @staticmethod
+    def recommend(user_id, limit=20):
+        """Videos from the cached candidates the user has not watched since the build"""
+        from ..models import Video, VideoView
+        from datetime import datetime, timezone as dt_timezone
+
+        entry = RecommendationCache.get_entry(user_id)
+        candidates = entry['candidates']
+        if not candidates:
+            return []
+
+        built_at = datetime.fromtimestamp(entry['built_at'], tz=dt_timezone.utc)
+        recent = set(VideoView.objects.filter(
+            user_id=user_id, viewed_at__gte=built_at, video_id__in=candidates
+        ).values_list('video_id', flat=True))
+
+        ids = [video_id for video_id in candidates if video_id not in recent][:limit]
+        videos = Video.objects.in_bulk(ids)
+        return [videos[video_id] for video_id in ids if video_id in videos]
+
+    @staticmethod
+    def invalidate(user_id):
+        cache.delete(cache_key(user_id))
+
+    @staticmethod
+    def active_user_ids(days=ACTIVE_DAYS, shard=0, shards=1):
+        from ..models import VideoView
+
+        users = VideoView.objects.filter(viewed_at__gte=timezone.now() - timedelta(days=days))
+        if shards > 1:
+            users = users.annotate(shard=Mod('user_id', Value(shards))).filter(shard=shard)
+        return users.values_list('user_id', flat=True).distinct().order_by('user_id').iterator()
+
+    @staticmethod
+    def rebuild_shard(shard=0, shards=1, days=ACTIVE_DAYS, batch_size=500):
+        """Rebuild every active user with user_id % shards == shard; returns the count"""
+        built = 0
+        batch = {}
+        for user_id in RecommendationCache.active_user_ids(days, shard, shards):
+            batch[user_id] = RecommendationCache.build_user(user_id)
+            if len(batch) >= batch_size:
+                RecommendationCache.store_many(batch)
+                built += len(batch)
+                batch = {}
+        if batch:
+            RecommendationCache.store_many(batch)
+            built += len(batch)
+        return built
+
+    @staticmethod
+    def rebuild_all(shards=1, processes=None, days=ACTIVE_DAYS):
+        """
+        Rebuild every active user's entry.
+
+        With processes > 1 the shards run on a process pool. Each worker
+        opens its own database connections; the parent's are closed first so
+        forked children never share a socket. Pools cannot be started from
+        a daemonic (Celery prefork) worker; use the management command or a
+        solo/threads Celery pool for that mode.
+        """
+        if not processes or processes <= 1:
+            return sum(RecommendationCache.rebuild_shard(shard, shards, days) for shard in range(shards))
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = pool.map(_rebuild_shard, [(shard, shards, days) for shard in range(shards)])
+            return sum(results)
+
+
+def _rebuild_shard(args):
+    # Process-pool entry point (must be importable at module level)
+    shard, shards, days = args
+    try:
+        return RecommendationCache.rebuild_shard(shard, shards, days)
+    finally:
+        connections.close_all()
+
+
+@shared_task(name='history.rebuild_recommendations')
+def rebuild_recommendations(shards=None, processes=None):
+    """Periodic batch rebuild (e.g. every few hours with Celery beat)"""
+    processes = processes or getattr(settings, 'RECOMMENDATION_REBUILD_PROCESSES', 1)
+    shards = shards or max(processes, 1) * 4
+    return RecommendationCache.rebuild_all(shards, processes)
@@ -0,0 +1,463 @@
+# Partitioned VideoView storage and daily rollups
+#
+# VideoView serves history, trending, recommendations and the admin
+# dashboard, and the dashboard counted it with full scans
+# (VideoView.objects.count(), per-day filters). Two changes make
+# analytics independent of the raw table's size:
+#
+# - Rollups: VideoViewDaily holds one row per (video, UTC day). New views
+#   increment their row in the same transaction that creates them
+#   (record_view, apply_progress). maintain_video_views (Celery) recomputes
+#   the last ROLLUP_DAYS days from raw rows, which also fills in
+#   completed_views and watch_duration and reflects deleted history. Older
+#   days are never recomputed, so they outlive the raw rows they came from.
+# - Partitions (PostgreSQL): VideoView becomes a table partitioned by month
+#   on viewed_at. The existing table is attached as one "legacy" partition
+#   without copying rows (see ViewPartitions), later months get their own
+#   partitions, created ahead by the maintenance task. Queries filtered on
+#   viewed_at only read the partitions they need, and retention drops whole
+#   partitions instead of deleting rows, so vacuum never sees the churn.
+#
+# Elsewhere (or before conversion) the table stays as it is and retention
+# falls back to batched deletes. Retention is off unless
+# VIDEO_VIEW_RETENTION_MONTHS is set, since dropping raw views also drops the
+# users' watch history for those months.
+import hashlib
+import re
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from celery import shared_task
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Days recomputed from raw rows on every maintenance run (today included)
+ROLLUP_DAYS = 2
+
+# Monthly partitions kept created ahead of the current month
+PARTITIONS_AHEAD = 3
+
+# Raw views older than this many months are dropped; None keeps them
+DEFAULT_RETENTION_MONTHS = None
+
+# Rows per INSERT when rolling up
+UPSERT_BATCH_SIZE = 1000
+
+_UPPER_BOUND = re.compile(r"TO \('(\d{4}-\d{2}-\d{2})")
+
+
+def utc_day(moment):
+    return moment.astimezone(dt_timezone.utc).date()
+
+
+def day_start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def retention_months():
+    return getattr(settings, 'VIDEO_VIEW_RETENTION_MONTHS', DEFAULT_RETENTION_MONTHS)
+
+
+def _bound(day):
+    return f"'{day.isoformat()} 00:00:00+00'"
+
+
+def _index_name(table, columns, suffix):
+    name = f'{table}_{"_".join(columns)}_{suffix}'
+    if len(name) <= 63:
+        return name
+    # PostgreSQL truncates identifiers at 63 bytes; keep them distinct
+    digest = hashlib.md5(name.encode()).hexdigest()[:8]
+    return f'{name[:63 - len(suffix) - 10]}_{digest}_{suffix}'
+
+
+def upsert_totals(model, keys, totals, rows, accumulate=True):
+    """
+    INSERT ... ON CONFLICT (keys) for rows of (*keys, *totals) values.
+
+    accumulate=True adds the totals to an existing row, otherwise replaces
+    them. Works on PostgreSQL and SQLite.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    keys = [qn(name) for name in keys]
+    totals = [qn(name) for name in totals]
+    if accumulate:
+        update = ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in totals)
+    else:
+        update = ', '.join(f'{column} = EXCLUDED.{column}' for column in totals)
+    row = f'({", ".join(["%s"] * (len(keys) + len(totals)))})'
+    sql = (
+        f'INSERT INTO {table} ({", ".join(keys + totals)}) '
+        f'VALUES {", ".join([row] * len(rows))} '
+        f'ON CONFLICT ({", ".join(keys)}) '
+        f'DO UPDATE SET {update}'
+    )
+    params = [value for row in rows for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+class ViewRollups:
+    """Maintains and reads the per-video, per-day view rollups"""
+
+    @staticmethod
+    def _upsert(rows, accumulate=True):
+        """Upsert (video_id, day, views, completed_views, watch_duration) rows"""
+        from ..models import VideoViewDaily
+
+        upsert_totals(VideoViewDaily, ('video_id', 'day'), ('views', 'completed_views', 'watch_duration'),
+                      rows, accumulate)
+
+    @staticmethod
+    def record_views(views):
+        """Count newly created views into their days (call inside the creating transaction)"""
+        counts = Counter((view.video_id, utc_day(view.viewed_at)) for view in views)
+        # Sorted so concurrent writers lock rollup rows in the same order
+        ViewRollups._upsert([
+            (video_id, day, count, 0, 0.0)
+            for (video_id, day), count in sorted(counts.items())
+        ])
+
+    @staticmethod
+    def _daily_totals(start, end):
+        """Raw views in [start, end) grouped by (day, video)"""
+        from ..models import VideoView
+
+        return VideoView.objects.filter(
+            viewed_at__gte=start,
+            viewed_at__lt=end
+        ).annotate(
+            day=TruncDate('viewed_at', tzinfo=dt_timezone.utc)
+        ).values('day', 'video_id').annotate(
+            views=Count('id'),
+            completed_views=Count('id', filter=Q(completed=True)),
+            watch_duration=Sum('watch_duration')
+        ).order_by('day', 'video_id')
+
+    @staticmethod
+    def _rows(totals):
+        for row in totals:
+            yield row['video_id'], row['day'], row['views'], row['completed_views'], row['watch_duration'] or 0.0
+
+    @staticmethod
+    def rollup_day(day):
+        """Recompute one day's rows from raw views; returns the number of videos"""
+        from ..models import VideoViewDaily
+
+        start = day_start(day)
+        rows = list(ViewRollups._rows(ViewRollups._daily_totals(start, start + timedelta(days=1))))
+        with transaction.atomic():
+            VideoViewDaily.objects.filter(day=day).delete()
+            for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+                # Upsert: a view created meanwhile may already have re-added its row
+                ViewRollups._upsert(rows[i:i + UPSERT_BATCH_SIZE], accumulate=False)
+        return len(rows)
+
+    @staticmethod
+    def rollup(days=ROLLUP_DAYS, now=None):
+        """Recompute the last `days` days (today included)"""
+        today = utc_day(now or timezone.now())
+        for offset in range(days):
+            ViewRollups.rollup_day(today - timedelta(days=offset))
+        return days
+
+    @staticmethod
+    def backfill(since=None, until=None):
+        """
+        Roll up every day from `since` (default: the oldest view) through
+        `until` with one grouped scan; returns the number of rows written
+        """
+        from ..models import VideoView, VideoViewDaily
+
+        if since is None:
+            first = VideoView.objects.order_by('viewed_at').values_list('viewed_at', flat=True).first()
+            if first is None:
+                return 0
+            since = utc_day(first)
+        until = until or utc_day(timezone.now())
+
+        VideoViewDaily.objects.filter(day__gte=since, day__lte=until).delete()
+        written, batch = 0, []
+        totals = ViewRollups._daily_totals(day_start(since), day_start(until + timedelta(days=1)))
+        for row in ViewRollups._rows(totals.iterator(chunk_size=UPSERT_BATCH_SIZE)):
+            batch.append(row)
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                ViewRollups._upsert(batch, accumulate=False)
+                written += len(batch)
+                batch = []
+        ViewRollups._upsert(batch, accumulate=False)
+        return written + len(batch)
+
+    @staticmethod
+    def totals(since=None):
+        """{'views', 'completed_views', 'watch_duration'} summed over rollups"""
+        from ..models import VideoViewDaily
+
+        rows = VideoViewDaily.objects.all()
+        if since is not None:
+            rows = rows.filter(day__gte=since)
+        totals = rows.aggregate(views=Sum('views'), completed_views=Sum('completed_views'),
+                                watch_duration=Sum('watch_duration'))
+        return {key: value or 0 for key, value in totals.items()}
+
+    @staticmethod
+    def views_per_day(since):
+        """{day: views} for every day with views since `since`"""
+        from ..models import VideoViewDaily
+
+        return dict(VideoViewDaily.objects.filter(day__gte=since).values('day').annotate(
+            total=Sum('views')
+        ).values_list('day', 'total'))
+
+    @staticmethod
+    def top_videos(limit=10, since=None):
+        """[(video_id, views)] most viewed first"""
+        from ..models import VideoViewDaily
+
+        rows = VideoViewDaily.objects.all()
+        if since is not None:
+            rows = rows.filter(day__gte=since)
+        return list(rows.values('video_id').annotate(
+            total=Sum('views')
+        ).order_by('-total', 'video_id').values_list('video_id', 'total')[:limit])
+
+
+class ViewPartitions:
+    """
+    Monthly range partitioning of VideoView on PostgreSQL.
+
+    Converting an existing table happens in two steps so that it never
+    blocks writers for longer than a catalog update:
+
+    1. prepare_sql() (outside a transaction) builds the unique index on
+       (id, viewed_at) that the partitioned primary key needs and the
+       session index of WatchHistory.install_sql() if it is missing, and
+       validates a CHECK that every row is older than the boundary (see
+       boundary()). All run online (CONCURRENTLY / VALIDATE CONSTRAINT).
+    2. convert_sql() (one transaction) renames the table to <table>_legacy,
+       creates the partitioned parent with the original name and the
+       model's indexes (foreign keys, db_index fields, Meta.indexes), and
+       attaches the legacy table for (MINVALUE, boundary). The validated
+       CHECK and the legacy table's matching indexes let ATTACH skip
+       scanning and re-indexing it.
+
+    The parent's primary key is (id, viewed_at), as PostgreSQL requires the
+    partition key in unique constraints; ids still come from one sequence.
+    """
+
+    @staticmethod
+    def table():
+        from ..models import VideoView
+
+        return VideoView._meta.db_table
+
+    @staticmethod
+    def supported():
+        return connection.vendor == 'postgresql'
+
+    @staticmethod
+    def is_partitioned():
+        if not ViewPartitions.supported():
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [ViewPartitions.table()])
+            row = cursor.fetchone()
+        return row is not None and row[0] == 'p'
+
+    @staticmethod
+    def boundary(now=None):
+        """
+        The legacy partition's upper bound: the month after next, so the
+        CHECK cannot start rejecting new views while the index builds.
+        """
+        return add_months(month_start(utc_day(now or timezone.now())), 2)
+
+    @staticmethod
+    def model_indexes():
+        """[(name, column list)] of the model's single and multi-column indexes"""
+        from ..models import VideoView
+
+        table = ViewPartitions.table()
+        columns = [
+            (field.column,) for field in VideoView._meta.local_fields
+            if field.db_index and not field.unique and not field.primary_key
+        ]
+        for index in VideoView._meta.indexes:
+            if index.fields and not getattr(index, 'condition', None):
+                columns.append(tuple(
+                    VideoView._meta.get_field(name).column + (f' {order}' if order else '')
+                    for name, order in index.fields_orders
+                ))
+        indexes = []
+        for index_columns in dict.fromkeys(columns):
+            names = [column.split()[0] for column in index_columns]
+            indexes.append((_index_name(table, names, 'part_idx'), ', '.join(index_columns)))
+        return indexes
+
+    @staticmethod
+    def prepare_sql(boundary):
+        from .watch_history import WatchHistory
+
+        table = ViewPartitions.table()
+        return WatchHistory.install_sql() + [
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_id_viewed_uniq '
+            f'ON {table} (id, viewed_at)',
+            f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_legacy_range',
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_legacy_range '
+            f'CHECK (viewed_at IS NOT NULL AND viewed_at < {_bound(boundary)}) NOT VALID',
+            f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_legacy_range',
+        ]
+
+    @staticmethod
+    def convert_sql(boundary, next_id):
+        from ..models import VideoView
+
+        table = ViewPartitions.table()
+        legacy = f'{table}_legacy'
+        user_table = VideoView._meta.get_field('user').related_model._meta.db_table
+        video_table = VideoView._meta.get_field('video').related_model._meta.db_table
+        return [
+            f'ALTER TABLE {table} RENAME TO {legacy}',
+            # Index names are schema-wide; the parent's index reuses the old name
+            f'ALTER INDEX IF EXISTS {table}_user_video_viewed_idx RENAME TO {legacy}_user_video_viewed_idx',
+            f'ALTER TABLE {legacy} ALTER COLUMN id DROP IDENTITY IF EXISTS',
+            f'ALTER TABLE {legacy} ALTER COLUMN id DROP DEFAULT',
+            f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING STORAGE) '
+            f'PARTITION BY RANGE (viewed_at)',
+            f'CREATE SEQUENCE {table}_id_seq_part OWNED BY {table}.id',
+            f"SELECT setval('{table}_id_seq_part', {int(next_id)}, false)",
+            f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq_part')",
+            f'ALTER TABLE {table} ADD PRIMARY KEY (id, viewed_at)',
+            f'CREATE INDEX {table}_user_video_viewed_idx ON {table} (user_id, video_id, viewed_at DESC)',
+        ] + [
+            # Matched to the legacy table's Django-created indexes on ATTACH
+            f'CREATE INDEX {name} ON {table} ({columns})'
+            for name, columns in ViewPartitions.model_indexes()
+        ] + [
+            f'ALTER TABLE {table} ADD FOREIGN KEY (user_id) REFERENCES {user_table} (id) '
+            f'DEFERRABLE INITIALLY DEFERRED',
+            f'ALTER TABLE {table} ADD FOREIGN KEY (video_id) REFERENCES {video_table} (id) '
+            f'DEFERRABLE INITIALLY DEFERRED',
+            f'ALTER TABLE {table} ATTACH PARTITION {legacy} '
+            f'FOR VALUES FROM (MINVALUE) TO ({_bound(boundary)})',
+            f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT',
+        ]
+
+    @staticmethod
+    def convert(now=None):
+        """Partition the existing table (no-op if already partitioned); returns the boundary"""
+        if not ViewPartitions.supported():
+            raise RuntimeError('Partitioned VideoView storage requires PostgreSQL')
+        if ViewPartitions.is_partitioned():
+            return None
+
+        table = ViewPartitions.table()
+        boundary = ViewPartitions.boundary(now)
+        with connection.cursor() as cursor:
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+            for statement in ViewPartitions.prepare_sql(boundary):
+                cursor.execute(statement)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+                cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}')
+                next_id = cursor.fetchone()[0]
+                for statement in ViewPartitions.convert_sql(boundary, next_id):
+                    cursor.execute(statement)
+        ViewPartitions.ensure(now=now)
+        return boundary
+
+    @staticmethod
+    def partitions():
+        """[(name, upper bound day or None)] of the current partitions"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)',
+                [ViewPartitions.table()]
+            )
+            rows = cursor.fetchall()
+        partitions = []
+        for name, expression in rows:
+            match = _UPPER_BOUND.search(expression or '')
+            partitions.append((name, date.fromisoformat(match.group(1)) if match else None))
+        return partitions
+
+    @staticmethod
+    def ensure(months_ahead=PARTITIONS_AHEAD, now=None):
+        """Create the monthly partitions up to `months_ahead` months out; returns those created"""
+        table = ViewPartitions.table()
+        existing = ViewPartitions.partitions()
+        covered = max((upper for _, upper in existing if upper is not None), default=None)
+        month = month_start(utc_day(now or timezone.now()))
+        if covered is not None and covered > month:
+            month = covered
+
+        created = []
+        last = add_months(month_start(utc_day(now or timezone.now())), months_ahead + 1)
+        with connection.cursor() as cursor:
+            while month < last:
+                name = f'{table}_p{month:%Y%m}'
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} '
+                    f'FOR VALUES FROM ({_bound(month)}) TO ({_bound(add_months(month, 1))})'
+                )
+                created.append(name)
+                month = add_months(month, 1)
+        return created
+
+    @staticmethod
+    def drop_before(cutoff):
+        """Detach and drop partitions whose every row is older than `cutoff`; returns their names"""
+        table = ViewPartitions.table()
+        dropped = []
+        for name, upper in sorted(ViewPartitions.partitions(), key=lambda item: item[1] or date.max):
+            if upper is None or upper > cutoff:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                cursor.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+        return dropped
+
+
+def enforce_retention(months=None, now=None):
+    """Drop raw views older than `months` months; returns what was removed"""
+    from ..models import VideoView
+    from .watch_history import WatchHistory
+
+    months = months if months is not None else retention_months()
+    if not months:
+        return {'partitions': [], 'rows': 0}
+
+    cutoff = add_months(month_start(utc_day(now or timezone.now())), -months)
+    dropped = []
+    if ViewPartitions.is_partitioned():
+        dropped = ViewPartitions.drop_before(cutoff)
+    # Rows left in partitions spanning the cutoff (or in an unpartitioned table)
+    rows = WatchHistory.delete_in_batches(VideoView.objects.filter(viewed_at__lt=day_start(cutoff)))
+    return {'partitions': dropped, 'rows': rows}
+
+
+@shared_task(name='history.maintain_video_views')
+def maintain_video_views():
+    """Periodic maintenance (e.g. hourly with Celery beat): partitions, rollups, retention"""
+    created = ViewPartitions.ensure() if ViewPartitions.is_partitioned() else []
+    ViewRollups.rollup()
+    removed = enforce_retention()
+    return {'partitions_created': created, 'partitions_dropped': removed['partitions'],
+            'rows_deleted': removed['rows']}
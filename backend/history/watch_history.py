@@ -1,34 +1,129 @@
 # User Watch History Service
-from django.db import models
+import csv
+import json
+import math
+import threading
+from contextlib import contextmanager
+from django.db import connection, models, transaction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from datetime import timedelta
+from ..analytics.engagement import Engagement, view_delta
+from ..analytics.event_log import emit
+from ..api.pagination import KeysetPagination
+from ..search.trending import TrendingEngine
+from .distinct_counters import DistinctCounters
+from .progress_buffer import ProgressBuffer
+from .recommendations import RecommendationCache
+from .view_storage import ViewRollups
+
+# A view of the same (user, video) started within this window is the same session
+SESSION_WINDOW = timedelta(hours=1)
+
+# Rows per DELETE statement when clearing history
+DELETE_BATCH_SIZE = 1000
+
+# Rows fetched per round trip when exporting history
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = ['video_id', 'video_title', 'viewed_at', 'watch_duration', 'last_position', 'completed']
+
+# Stripes for serializing session writes where advisory locks are unavailable
+_LOCAL_SESSION_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+def _advisory_key(user_id, video_id):
+    """Signed 64-bit advisory lock key for one (user, video) pair"""
+    key = ((user_id & 0xFFFFFFFF) << 32) | (video_id & 0xFFFFFFFF)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+@contextmanager
+def session_transaction(pairs):
+    """
+    Transaction in which no other writer touches the sessions of `pairs`
+    
+    There is no unique key for "the session of (user, video) within the last
+    hour", so concurrent heartbeats cannot rely on a constraint. On PostgreSQL
+    each pair takes a transaction-scoped advisory lock (one statement for the
+    whole batch, in key order so batches cannot deadlock), held until the
+    outermost transaction ends. Elsewhere striped process-local locks are
+    held until this block exits: under ATOMIC_REQUESTS (or any enclosing
+    atomic()) that is a savepoint release, before the commit, so a writer
+    in another process or request can still miss the uncommitted row.
+    """
+    pairs = sorted(set(pairs))
+    stripes = []
+    if connection.vendor != 'postgresql':
+        stripes = sorted({hash(pair) % len(_LOCAL_SESSION_LOCKS) for pair in pairs})
+    for stripe in stripes:
+        _LOCAL_SESSION_LOCKS[stripe].acquire()
+    try:
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT pg_advisory_xact_lock(k) FROM unnest(%s::bigint[]) AS k ORDER BY k',
+                        [[_advisory_key(user_id, video_id) for user_id, video_id in pairs]]
+                    )
+            yield
+    finally:
+        for stripe in reversed(stripes):
+            _LOCAL_SESSION_LOCKS[stripe].release()
+
 
 class WatchHistory:
     """Service for managing user watch history"""
     
+    @staticmethod
+    def install_sql():
+        """DDL for the composite index behind the session lookup"""
+        from ..models import VideoView
+        
+        table = VideoView._meta.db_table
+        concurrently = ' CONCURRENTLY' if connection.vendor == 'postgresql' else ''
+        return [
+            f'CREATE INDEX{concurrently} IF NOT EXISTS {table}_user_video_viewed_idx '
+            f'ON {table} (user_id, video_id, viewed_at DESC)',
+        ]
+    
     @staticmethod
     def record_view(user, video, watch_duration, completed=False):
-        """Record a video view in user's history"""
+        """
+        Record a video view in user's history
+        The session lookup is one scan of the (user_id, video_id, viewed_at)
+        index, and concurrent heartbeats for the pair are serialized, so they
+        update one row instead of each inserting their own
+        """
         from ..models import VideoView
         
-        # Check if view already exists for this session
-        existing_view = VideoView.objects.filter(
-            user=user,
-            video=video,
-            viewed_at__gte=timezone.now() - timedelta(hours=1)
-        ).first()
-        
-        if existing_view:
-            # Update existing view
-            existing_view.watch_duration = max(existing_view.watch_duration, watch_duration)
-            existing_view.completed = completed or existing_view.completed
-            existing_view.last_position = watch_duration
-            existing_view.save()
-            return existing_view
-        else:
+        now = timezone.now()
+        with session_transaction([(user.id, video.id)]):
+            # Latest view of this session, if any
+            existing_view = VideoView.objects.filter(
+                user=user,
+                video=video,
+                viewed_at__gte=now - SESSION_WINDOW
+            ).order_by('-viewed_at', '-id').first()
+            
+            if existing_view:
+                # Update existing view
+                delta = view_delta(False, watch_duration, completed,
+                                   existing_view.watch_duration, existing_view.completed)
+                existing_view.watch_duration = max(existing_view.watch_duration, watch_duration)
+                existing_view.completed = completed or existing_view.completed
+                existing_view.last_position = watch_duration
+                existing_view.save(update_fields=['watch_duration', 'completed', 'last_position'])
+                Engagement.record_views({video.id: delta})
+                emit('progress', now, view_id=existing_view.id, video_id=video.id,
+                     watch_duration=existing_view.watch_duration, completed=existing_view.completed)
+                return existing_view
+            
             # Create new view record
             view = VideoView.objects.create(
                 user=user,
@@ -36,20 +131,111 @@ class WatchHistory:
                 watch_duration=watch_duration,
                 completed=completed,
                 last_position=watch_duration,
-                viewed_at=timezone.now()
+                viewed_at=now
+            )
+            ViewRollups.record_views([view])
+            Engagement.record_views({video.id: view_delta(True, watch_duration, completed)})
+        
+        TrendingEngine.instance().record_view(video.id, video.category, view.viewed_at)
+        DistinctCounters.instance().record_views([(user.id, video.id, view.viewed_at)])
+        emit('view', view.viewed_at, view_id=view.id, user_id=user.id, video_id=video.id,
+             category=video.category)
+        emit('progress', now, view_id=view.id, video_id=video.id, watch_duration=view.watch_duration,
+             completed=view.completed)
+        return view
+    
+    @staticmethod
+    def apply_progress(entries):
+        """
+        Write buffered progress entries (see progress_buffer) in bulk
+        Same session rule as record_view: a view of the pair started within
+        the hour before the entry's first heartbeat is updated, otherwise a
+        new view is created. Returns the VideoView of each entry.
+        """
+        from ..models import VideoView, Video
+        from datetime import datetime, timezone as dt_timezone
+        
+        def moment(timestamp):
+            return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        
+        cutoff = moment(min(entry['first_seen'] for entry in entries)) - SESSION_WINDOW
+        
+        with session_transaction((entry['user_id'], entry['video_id']) for entry in entries):
+            # One indexed query for the candidate sessions of the whole batch
+            sessions = {}
+            for view in VideoView.objects.filter(
+                user_id__in={entry['user_id'] for entry in entries},
+                video_id__in={entry['video_id'] for entry in entries},
+                viewed_at__gte=cutoff
+            ).order_by('viewed_at', 'id'):
+                sessions.setdefault((view.user_id, view.video_id), []).append(view)
+            
+            updated, created, views = [], [], []
+            deltas = {}
+            for entry in entries:
+                since = moment(entry['first_seen']) - SESSION_WINDOW
+                candidates = [view for view in sessions.get((entry['user_id'], entry['video_id']), [])
+                              if view.viewed_at >= since]
+                if candidates:
+                    view = candidates[-1]
+                    delta = view_delta(False, entry['watch_duration'], entry['completed'],
+                                       view.watch_duration, view.completed)
+                    view.watch_duration = max(view.watch_duration, entry['watch_duration'])
+                    view.completed = entry['completed'] or view.completed
+                    view.last_position = entry['last_position']
+                    updated.append(view)
+                else:
+                    view = VideoView(
+                        user_id=entry['user_id'],
+                        video_id=entry['video_id'],
+                        watch_duration=entry['watch_duration'],
+                        completed=entry['completed'],
+                        last_position=entry['last_position'],
+                        viewed_at=moment(entry['first_seen'])
+                    )
+                    created.append(view)
+                    delta = view_delta(True, entry['watch_duration'], entry['completed'])
+                views.append(view)
+                deltas[view.video_id] = tuple(map(sum, zip(deltas.get(view.video_id, (0, 0, 0.0)), delta)))
+            
+            if updated:
+                VideoView.objects.bulk_update(updated, ['watch_duration', 'completed', 'last_position'])
+            if created:
+                VideoView.objects.bulk_create(created)
+                ViewRollups.record_views(created)
+            Engagement.record_views(deltas)
+        
+        if created:
+            categories = dict(Video.objects.filter(
+                id__in={view.video_id for view in created}
+            ).values_list('id', 'category'))
+            for view in created:
+                TrendingEngine.instance().record_view(view.video_id, categories.get(view.video_id),
+                                                      view.viewed_at)
+            DistinctCounters.instance().record_views(
+                [(view.user_id, view.video_id, view.viewed_at) for view in created]
             )
-            return view
+            for view in created:
+                emit('view', view.viewed_at, view_id=view.id, user_id=view.user_id, video_id=view.video_id,
+                     category=categories.get(view.video_id))
+        
+        flushed_at = timezone.now()
+        for view in views:
+            emit('progress', flushed_at, view_id=view.id, video_id=view.video_id,
+                 watch_duration=view.watch_duration, completed=view.completed)
+        
+        return views
     
     @staticmethod
     def get_user_history(user, limit=50):
-        """Get user's watch history"""
+        """Get user's watch history (limit=None returns the unsliced queryset)"""
         from ..models import VideoView
         
         history = VideoView.objects.filter(
             user=user
-        ).select_related('video').order_by('-viewed_at')[:limit]
+        ).select_related('video').order_by('-viewed_at', '-id')
         
-        return history
+        return history if limit is None else history[:limit]
     
     @staticmethod
     def get_continue_watching(user, limit=10):
@@ -65,43 +251,52 @@ class WatchHistory:
         return continue_watching
     
     @staticmethod
-    def get_recommended_based_on_history(user, limit=20):
-        """Get video recommendations based on watch history"""
-        from ..models import VideoView, Video
-        from django.db.models import Count
+    def get_recommended_based_on_history(user, limit=20, method=None):
+        """
+        Get video recommendations based on watch history
+        method 'category' (default, RECOMMENDATION_METHOD) serves the
+        precomputed per-user entry (see recommendations); 'item_item' ranks
+        by co-occurrence similarity (see item_similarity) and fills any
+        remaining slots from the category method
+        """
+        method = method or getattr(settings, 'RECOMMENDATION_METHOD', 'category')
+        if method != 'item_item':
+            return RecommendationCache.recommend(user.id, limit)
         
-        # Get user's most watched categories
-        watched_categories = VideoView.objects.filter(
-            user=user
-        ).values_list('video__category', flat=True)
-        
-        # Get category frequency
-        category_counts = {}
-        for category in watched_categories:
-            category_counts[category] = category_counts.get(category, 0) + 1
-        
-        # Get top 3 categories
-        top_categories = sorted(category_counts.items(), key=lambda x: x[1], reverse=True)[:3]
-        top_category_names = [cat[0] for cat in top_categories]
-        
-        # Get watched video IDs to exclude
-        watched_ids = VideoView.objects.filter(user=user).values_list('video_id', flat=True)
+        from .item_similarity import ItemSimilarity
         
-        # Recommend videos from top categories that user hasn't watched
-        recommendations = Video.objects.filter(
-            category__in=top_category_names
-        ).exclude(
-            id__in=watched_ids
-        ).order_by('-views', '-created_at')[:limit]
-        
-        return recommendations
+        videos = ItemSimilarity.recommend(user.id, limit)
+        if len(videos) < limit:
+            chosen = {video.id for video in videos}
+            videos += [video for video in RecommendationCache.recommend(user.id, limit)
+                       if video.id not in chosen][:limit - len(videos)]
+        return videos
+    
+    @staticmethod
+    def delete_in_batches(queryset, batch_size=None):
+        """
+        Delete queryset's rows DELETE_BATCH_SIZE primary keys at a time
+        Each batch is its own short transaction, so row locks are held for
+        at most one batch and other writers interleave between batches
+        """
+        batch_size = batch_size or getattr(settings, 'HISTORY_DELETE_BATCH_SIZE', DELETE_BATCH_SIZE)
+        deleted = 0
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            with transaction.atomic():
+                deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
     
     @staticmethod
     def clear_history(user):
         """Clear user's watch history"""
         from ..models import VideoView
         
-        deleted_count = VideoView.objects.filter(user=user).delete()[0]
+        # Pending heartbeats would otherwise re-create rows after the delete
+        ProgressBuffer.instance().discard(user.id)
+        deleted_count = WatchHistory.delete_in_batches(VideoView.objects.filter(user=user))
+        RecommendationCache.invalidate(user.id)
         return deleted_count
     
     @staticmethod
@@ -109,23 +304,83 @@ class WatchHistory:
         """Remove specific video from history"""
         from ..models import VideoView
         
-        deleted_count = VideoView.objects.filter(
+        ProgressBuffer.instance().discard(user.id, int(video_id))
+        deleted_count = WatchHistory.delete_in_batches(VideoView.objects.filter(
             user=user,
             video_id=video_id
-        ).delete()[0]
+        ))
+        # Recommendations are seeded from history; drop ones based on this video
+        RecommendationCache.invalidate(user.id)
         return deleted_count
+    
+    @staticmethod
+    def export_rows(user):
+        """Yield the user's history as dicts, oldest first, streamed through a server-side cursor"""
+        from ..models import VideoView
+        
+        rows = VideoView.objects.filter(user=user).order_by('viewed_at', 'id').values_list(
+            'video_id', 'video__title', 'viewed_at', 'watch_duration', 'last_position', 'completed'
+        )
+        for video_id, title, viewed_at, watch_duration, last_position, completed in rows.iterator(
+                chunk_size=EXPORT_CHUNK_SIZE):
+            yield {
+                'video_id': video_id,
+                'video_title': title,
+                'viewed_at': viewed_at.isoformat(),
+                'watch_duration': watch_duration,
+                'last_position': last_position,
+                'completed': completed,
+            }
 
 # API Views
+def _flag(value):
+    """Boolean from JSON or a form field ('false', '0' and '' are False)"""
+    if isinstance(value, str):
+        return value.strip().lower() not in ('', 'false', '0', 'no', 'off')
+    return bool(value)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def record_video_view(request):
-    """Record a video view"""
-    video_id = request.data.get('video_id')
-    watch_duration = request.data.get('watch_duration', 0)
-    completed = request.data.get('completed', False)
+    """
+    Record a video view
+    Heartbeats are buffered (see progress_buffer) unless WATCH_PROGRESS_BUFFERED
+    is False; view_id is only known once the session is written, so it is
+    null until the player sends ended=true (or completed=true)
+    """
+    # Form posts carry strings; the buffer and the session merge need numbers
+    try:
+        video_id = int(request.data.get('video_id'))
+        watch_duration = float(request.data.get('watch_duration', 0))
+    except (TypeError, ValueError):
+        return Response({'error': 'video_id must be an integer and watch_duration a number'}, status=400)
+    if not math.isfinite(watch_duration) or watch_duration < 0:
+        return Response({'error': 'watch_duration must be a non-negative number'}, status=400)
+    completed = _flag(request.data.get('completed', False))
+    ended = _flag(request.data.get('ended', False))
     
     from ..models import Video
     
+    if getattr(settings, 'WATCH_PROGRESS_BUFFERED', True):
+        # Cached so steady heartbeats stay off the database
+        exists = cache.get_or_set(
+            f'video:exists:{video_id}',
+            lambda: Video.objects.filter(id=video_id).exists(),
+            300
+        )
+        if not exists:
+            return Response({'error': 'Video not found'}, status=404)
+        
+        buffer = ProgressBuffer.instance()
+        buffer.record(request.user.id, video_id, watch_duration, completed)
+        view = buffer.end_session(request.user.id, video_id) if ended or completed else None
+        
+        return Response({
+            'message': 'View recorded successfully',
+            'view_id': view.id if view is not None else None
+        })
+    
     try:
         video = Video.objects.get(id=video_id)
         view = WatchHistory.record_view(
@@ -145,9 +400,17 @@ def record_video_view(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_watch_history(request):
-    """Get user's watch history"""
-    limit = int(request.GET.get('limit', 50))
-    history = WatchHistory.get_user_history(request.user, limit=limit)
+    """
+    Get user's watch history, newest first
+    Cursor paginated: follow `next`; ?limit= sets the page size, ?count=false skips the total
+    """
+    paginator = KeysetPagination()
+    paginator.page_size = 50
+    paginator.page_size_query_param = 'limit'
+    history = paginator.paginate_queryset(
+        WatchHistory.get_user_history(request.user, limit=None),
+        request
+    )
     
     history_data = [{
         'id': item.id,
@@ -160,7 +423,7 @@ def get_watch_history(request):
         'viewed_at': item.viewed_at.isoformat()
     } for item in history]
     
-    return Response(history_data)
+    return paginator.get_paginated_response(history_data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -196,3 +459,42 @@ def remove_from_history(request, video_id):
         return Response({'message': 'Video removed from history'})
     else:
         return Response({'error': 'Video not found in history'}, status=404)
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+    def write(self, value):
+        return value
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_watch_history(request):
+    """
+    Stream the user's full watch history as NDJSON (default) or CSV (?type=csv)
+    Rows are generated from a server-side cursor as the response is sent, so
+    the history is never held in memory
+    (?format= is taken by DRF's content negotiation, hence ?type=)
+    """
+    export_type = request.GET.get('type', 'ndjson')
+    rows = WatchHistory.export_rows(request.user)
+    
+    if export_type == 'csv':
+        writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+        
+        def stream():
+            yield writer.writeheader()
+            for row in rows:
+                yield writer.writerow(row)
+        
+        response = StreamingHttpResponse(stream(), content_type='text/csv')
+        extension = 'csv'
+    elif export_type == 'ndjson':
+        response = StreamingHttpResponse(
+            (json.dumps(row) + '\n' for row in rows),
+            content_type='application/x-ndjson'
+        )
+        extension = 'ndjson'
+    else:
+        return Response({'error': 'type must be ndjson or csv'}, status=400)
+    
+    response['Content-Disposition'] = f'attachment; filename="watch-history.{extension}"'
+    return response
@@ -8,11 +8,24 @@ Models:
 - Comment: User comments on videos
 - Like: Video likes/favorites
 - View: Video view tracking
+- LadderDecision: Per-title bitrate ladder chosen for a video
+- ContentSource: Content-addressed source file shared by duplicate uploads
+- SearchQueryCount: Hourly/daily counters of normalized search queries
+- VideoViewDaily: Per-video, per-day rollup of views
+- VideoEngagement: Running per-video view, completion and comment totals
+- EngagementCounter: Sharded platform-wide engagement totals
 """
 
 from .user import User
 from .video import Video
 from .category import Category
 from .comment import Comment
+from .ladder_decision import LadderDecision
+from .content_source import ContentSource
+from .search_query_count import SearchQueryCount
+from .video_view_daily import VideoViewDaily
+from .video_engagement import VideoEngagement
+from .engagement_counter import EngagementCounter
 
-__all__ = ['User', 'Video', 'Category', 'Comment']
+__all__ = ['User', 'Video', 'Category', 'Comment', 'LadderDecision', 'ContentSource',
+           'SearchQueryCount', 'VideoViewDaily', 'VideoEngagement', 'EngagementCounter']
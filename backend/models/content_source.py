@@ -0,0 +1,27 @@
+from django.db import models
+
+
+class ContentSource(models.Model):
+    """
+    A stored source file, addressed by the hash of its content.
+
+    Every Video uploaded with the same bytes shares one ContentSource (and
+    therefore one file_path); the renditions produced for the first video
+    are reused by all of them.
+    """
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    file_path = models.CharField(max_length=500)
+    size = models.BigIntegerField()
+    video = models.ForeignKey('Video', null=True, blank=True, on_delete=models.SET_NULL,
+                              related_name='+')
+    hls_url = models.CharField(max_length=500, blank=True, default='')
+    dash_url = models.CharField(max_length=500, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.content_hash[:12]} ({self.size} bytes)'
+
+    @property
+    def is_transcoded(self):
+        return bool(self.hls_url and self.dash_url)
@@ -0,0 +1,28 @@
+from django.db import models
+
+
+class EngagementCounter(models.Model):
+    """
+    Platform-wide engagement totals, split into shards.
+
+    Rows with day=NULL hold all-time totals; dated rows hold that UTC day's
+    comments. Writers add to a random shard so concurrent transactions do
+    not queue on one row; readers sum the shards.
+    """
+
+    day = models.DateField(null=True, blank=True)
+    shard = models.PositiveSmallIntegerField()
+    views = models.BigIntegerField(default=0)
+    completed_views = models.BigIntegerField(default=0)
+    watch_duration = models.FloatField(default=0)
+    comments = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shard'], name='unique_engagement_day_shard'),
+            models.UniqueConstraint(fields=['shard'], condition=models.Q(day__isnull=True),
+                                    name='unique_engagement_total_shard'),
+        ]
+
+    def __str__(self):
+        return f'Engagement {self.day or "total"} shard {self.shard}'
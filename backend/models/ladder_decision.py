@@ -0,0 +1,24 @@
+from django.db import models
+
+
+class LadderDecision(models.Model):
+    """Per-title bitrate ladder chosen for a video's source"""
+
+    video = models.ForeignKey('Video', on_delete=models.CASCADE, related_name='ladder_decisions')
+    source_width = models.PositiveIntegerField()
+    source_height = models.PositiveIntegerField()
+    source_fps = models.FloatField()
+    source_duration = models.FloatField()
+    complexity = models.FloatField()
+    ladder = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['video', '-created_at']),
+        ]
+
+    def __str__(self):
+        rungs = ', '.join(f"{r['name']}@{r['bitrate']}" for r in self.ladder)
+        return f'Ladder for video {self.video_id}: {rungs}'
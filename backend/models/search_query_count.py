@@ -0,0 +1,29 @@
+from django.db import models
+
+
+class SearchQueryCount(models.Model):
+    """
+    Count of a normalized search query within one time bucket.
+
+    Hourly buckets are written by the search logging path and rolled up into
+    daily buckets; popular searches are computed from these rows instead of
+    grouping the raw SearchLog table.
+    """
+
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    query = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket_start', 'query'],
+                                    name='unique_search_query_bucket'),
+        ]
+
+    def __str__(self):
+        return f'{self.query!r} x{self.count} ({self.granularity} {self.bucket_start:%Y-%m-%d %H:00})'
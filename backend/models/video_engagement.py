@@ -0,0 +1,23 @@
+from django.db import models
+
+
+class VideoEngagement(models.Model):
+    """
+    Running engagement totals of one video.
+
+    Incremented as views, watch progress and comments are written and
+    periodically reconciled against VideoView and Comment.
+    """
+
+    video = models.OneToOneField('Video', on_delete=models.CASCADE, primary_key=True, related_name='engagement')
+    views = models.PositiveIntegerField(default=0)
+    completed_views = models.PositiveIntegerField(default=0)
+    watch_duration = models.FloatField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    @property
+    def completion_rate(self):
+        return round(self.completed_views / self.views * 100, 2) if self.views else 0
+
+    def __str__(self):
+        return f'Video {self.video_id}: {self.views} views, {self.comments} comments'
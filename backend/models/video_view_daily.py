@@ -0,0 +1,28 @@
+from django.db import models
+
+
+class VideoViewDaily(models.Model):
+    """
+    Per-video, per-day rollup of VideoView.
+
+    views is incremented as views are created; completed_views and
+    watch_duration are filled in when the day is rolled up from the raw
+    rows. Analytics read these rows instead of scanning VideoView.
+    """
+
+    video = models.ForeignKey('Video', on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    completed_views = models.PositiveIntegerField(default=0)
+    watch_duration = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['video', 'day'], name='unique_video_view_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f'Video {self.video_id} on {self.day}: {self.views} views'
@@ -0,0 +1,375 @@
+# Search-as-you-type autocomplete
+#
+# Suggestions come from an in-process prefix index instead of the full
+# search_videos path, so per-keystroke traffic never reaches the database.
+# Three sources feed it:
+#   * published video titles, weighted by views;
+#   * tags, weighted by how many videos carry them;
+#   * popular queries, weighted by their SearchQueryCount totals over the
+#     popular-searches window (see search_stats).
+# Texts are normalized with search_backends.tokenize. Titles and queries are
+# also indexed from each word onward, so "matrix" completes "The Matrix".
+#
+# Layout (PrefixIndex): one sorted list of keys plus parallel compact arrays
+# (entry id, weight) and a sparse table of range arg-maxes over the weights.
+# All keys sharing a prefix form one contiguous run found with bisect; the
+# sparse table then yields the run's entries best-first in O(limit log limit),
+# however long the run is.
+#
+# Updates: video saves and deletes go into a small copy-on-write delta that
+# overrides the base index; once it reaches COMPACT_THRESHOLD entries a new
+# base is built in a background thread. Each process also rebuilds from the database in the background
+# every AUTOCOMPLETE_REFRESH_INTERVAL seconds, which picks up query counts
+# and writes made by other processes.
+import bisect
+import heapq
+import math
+import threading
+import time
+from array import array
+from django.conf import settings
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from .search_backends import tokenize
+from .search_stats import POPULAR_WINDOW_DAYS
+
+TITLE = 'title'
+TAG = 'tag'
+QUERY = 'query'
+
+# Relative importance of each source; weight = boost * (1 + log1p(signal))
+KIND_BOOSTS = {QUERY: 1.0, TITLE: 0.8, TAG: 0.5}
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+# Most popular queries loaded into the index
+MAX_QUERIES = 20000
+
+# Delta entries tolerated before the base index is rebuilt
+COMPACT_THRESHOLD = 1000
+
+DEFAULT_REFRESH_INTERVAL = 600
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+def split_tags(tags):
+    """Tags field (list or comma-separated text) as a list of tags"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return [tag.strip() for tag in tags if tag and tag.strip()]
+
+
+def weigh(kind, signal):
+    return KIND_BOOSTS[kind] * (1.0 + math.log1p(max(signal, 0)))
+
+
+class PrefixIndex:
+    """Immutable sorted-array prefix index over (text, kind, weight) entries"""
+
+    def __init__(self, entries):
+        # entries: {normalized text: (display text, kind, weight)}
+        self.norms = list(entries)
+        self.displays = [entries[norm][0] for norm in self.norms]
+        self.kinds = [entries[norm][1] for norm in self.norms]
+        self.entry_weights = array('d', (entries[norm][2] for norm in self.norms))
+
+        keyed = []
+        for entry_id, norm in enumerate(self.norms):
+            keyed.append((norm, entry_id))
+            if self.kinds[entry_id] != TAG:
+                words = norm.split(' ')
+                keyed.extend((' '.join(words[i:]), entry_id) for i in range(1, len(words)))
+        keyed.sort()
+
+        self.keys = [key for key, _ in keyed]
+        self.entry_ids = array('I', (entry_id for _, entry_id in keyed))
+        self.weights = array('d', (self.entry_weights[entry_id] for _, entry_id in keyed))
+        self._build_sparse_table()
+
+    def __len__(self):
+        return len(self.norms)
+
+    def _build_sparse_table(self):
+        # levels[j][i] = position of the max weight in keys[i:i + 2**j]
+        weights = self.weights
+        self.levels = [array('I', range(len(weights)))]
+        span = 1
+        while span * 2 <= len(weights):
+            previous = self.levels[-1]
+            level = array('I', bytes(4 * (len(weights) - span * 2 + 1)))
+            for i in range(len(level)):
+                a, b = previous[i], previous[i + span]
+                level[i] = a if weights[a] >= weights[b] else b
+            self.levels.append(level)
+            span *= 2
+
+    def _argmax(self, lo, hi):
+        """Position of the max weight in [lo, hi)"""
+        j = (hi - lo).bit_length() - 1
+        a, b = self.levels[j][lo], self.levels[j][hi - (1 << j)]
+        return a if self.weights[a] >= self.weights[b] else b
+
+    def prefix_range(self, prefix):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + '\uffff', lo)
+        return lo, hi
+
+    def iter_best(self, prefix):
+        """Yield entry ids whose keys start with prefix, best first, each once"""
+        lo, hi = self.prefix_range(prefix)
+        if lo >= hi:
+            return
+        heap = []
+
+        def push(lo, hi):
+            if lo < hi:
+                position = self._argmax(lo, hi)
+                heapq.heappush(heap, (-self.weights[position], position, lo, hi))
+
+        push(lo, hi)
+        seen = set()
+        while heap:
+            _, position, lo, hi = heapq.heappop(heap)
+            entry_id = self.entry_ids[position]
+            if entry_id not in seen:
+                seen.add(entry_id)
+                yield entry_id
+            push(lo, position)
+            push(position + 1, hi)
+
+
+class Catalog:
+    """Source state behind the index, so single videos can be re-indexed"""
+
+    def __init__(self):
+        self.titles = {}   # norm -> {video_id: (display, views)}
+        self.tags = {}     # norm -> {video_id: display}
+        self.queries = {}  # norm -> count
+        self.videos = {}   # video_id -> (title norm, [tag norms])
+
+    def norms(self):
+        return set(self.queries) | set(self.titles) | set(self.tags)
+
+    def entry(self, norm):
+        """(display, kind, weight) of the best source for norm, or None"""
+        best = None
+        if norm in self.queries:
+            best = (norm, QUERY, weigh(QUERY, self.queries[norm]))
+        titles = self.titles.get(norm)
+        if titles:
+            display, views = max(titles.values(), key=lambda item: item[1])
+            candidate = (display, TITLE, weigh(TITLE, views))
+            if best is None or candidate[2] > best[2]:
+                best = candidate
+        tags = self.tags.get(norm)
+        if tags:
+            candidate = (next(iter(tags.values())), TAG, weigh(TAG, len(tags)))
+            if best is None or candidate[2] > best[2]:
+                best = candidate
+        return best
+
+    def add_query(self, query, count):
+        norm = normalize(query)
+        if norm:
+            self.queries[norm] = self.queries.get(norm, 0) + count
+
+    def add_video(self, video_id, title, tags, views):
+        """Returns the norms whose entries changed"""
+        title_norm = normalize(title)
+        if title_norm:
+            self.titles.setdefault(title_norm, {})[video_id] = (title, views or 0)
+        tag_norms = []
+        for tag in split_tags(tags):
+            tag_norm = normalize(tag)
+            if tag_norm:
+                self.tags.setdefault(tag_norm, {})[video_id] = tag
+                tag_norms.append(tag_norm)
+        self.videos[video_id] = (title_norm, tag_norms)
+        return [title_norm] + tag_norms
+
+    def remove_video(self, video_id):
+        """Returns the norms whose entries changed"""
+        title_norm, tag_norms = self.videos.pop(video_id, ('', []))
+        for norm, sources in [(title_norm, self.titles)] + [(tag, self.tags) for tag in tag_norms]:
+            holders = sources.get(norm)
+            if holders is not None:
+                holders.pop(video_id, None)
+                if not holders:
+                    del sources[norm]
+        return [title_norm] + tag_norms
+
+
+class AutocompleteIndex:
+    """Prefix index over titles, tags and popular queries with incremental updates"""
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval or getattr(
+            settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+        self._lock = threading.RLock()
+        self._busy = False
+        self._loaded_at = None
+        self._catalog = Catalog()
+        # (base PrefixIndex, delta {norm: entry or None when removed}), swapped
+        # as one reference so readers never pair a base with the wrong delta
+        self._view = (PrefixIndex({}), {})
+
+    @staticmethod
+    def load():
+        """Read every source from the database into a new Catalog"""
+        from ..models import SearchQueryCount, Video
+        from django.db.models import Sum
+        from django.utils import timezone
+        from datetime import timedelta
+
+        catalog = Catalog()
+        videos = Video.objects.filter(status='published').values_list('id', 'title', 'tags', 'views')
+        for video_id, title, tags, views in videos.iterator():
+            catalog.add_video(video_id, title, tags, views)
+
+        days = getattr(settings, 'POPULAR_SEARCH_WINDOW_DAYS', POPULAR_WINDOW_DAYS)
+        queries = SearchQueryCount.objects.filter(
+            granularity=SearchQueryCount.DAY,
+            bucket_start__gte=timezone.now() - timedelta(days=days)
+        ).values('query').annotate(total=Sum('count')).order_by('-total')[:MAX_QUERIES]
+        for row in queries:
+            catalog.add_query(row['query'], row['total'])
+        return catalog
+
+    def rebuild(self):
+        """
+        Reload from the database and swap the index in.
+
+        Loading happens outside the lock so video writes are not blocked;
+        a write that lands while loading is picked up by the next refresh.
+        """
+        catalog = self.load()
+        base = PrefixIndex({norm: catalog.entry(norm) for norm in catalog.norms()})
+        with self._lock:
+            self._catalog, self._view = catalog, (base, {})
+            self._loaded_at = time.monotonic()
+
+    def _compact(self):
+        """Fold the delta into a new base index (runs in the background)"""
+        with self._lock:
+            catalog = self._catalog
+            entries = {norm: catalog.entry(norm) for norm in catalog.norms()}
+            folded = self._view[1]
+        base = PrefixIndex(entries)
+        with self._lock:
+            if self._catalog is not catalog:
+                return  # a rebuild replaced everything meanwhile
+            # Keep delta entries written while the new base was being built
+            self._view = (base, {norm: entry for norm, entry in self._view[1].items()
+                                 if folded.get(norm, folded) is not entry})
+
+    def _apply(self, norms):
+        base, delta = self._view
+        delta = dict(delta)
+        for norm in norms:
+            if norm:
+                delta[norm] = self._catalog.entry(norm)
+        # Readers may hold the old dict; replace it rather than mutating it
+        self._view = (base, delta)
+        if len(delta) >= COMPACT_THRESHOLD:
+            self._in_background(self._compact)
+
+    def index_video(self, video):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            touched = self._catalog.remove_video(video.pk)
+            if getattr(video, 'status', 'published') == 'published':
+                touched += self._catalog.add_video(video.pk, video.title, getattr(video, 'tags', ''),
+                                                   getattr(video, 'views', 0))
+            self._apply(touched)
+
+    def remove_video(self, video_id):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._apply(self._catalog.remove_video(video_id))
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self.rebuild()
+        elif time.monotonic() - self._loaded_at >= self.refresh_interval:
+            self._in_background(self.rebuild)
+
+    def _in_background(self, work):
+        """Run a rebuild or compaction in a thread, one at a time, serving the current index meanwhile"""
+        with self._lock:
+            if self._busy:
+                return
+            self._busy = True
+        threading.Thread(target=self._run_background, args=(work,), name='autocomplete-rebuild',
+                         daemon=True).start()
+
+    def _run_background(self, work):
+        from django.db import close_old_connections
+
+        try:
+            work()
+        finally:
+            self._busy = False
+            close_old_connections()
+
+    @staticmethod
+    def _delta_matches(norm, entry, prefix):
+        if norm.startswith(prefix):
+            return True
+        # Titles and queries also match from any word onward, as in PrefixIndex
+        return entry[1] != TAG and (' ' + prefix) in (' ' + norm)
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        """[{'text', 'type', 'weight'}] best first for a partially typed query"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self._ensure_fresh()
+
+        base, delta = self._view
+        results = []
+        for entry_id in base.iter_best(prefix):
+            if base.norms[entry_id] in delta:
+                continue
+            results.append((base.displays[entry_id], base.kinds[entry_id], base.entry_weights[entry_id]))
+            if len(results) >= limit:
+                break
+
+        results.extend(entry for norm, entry in delta.items()
+                       if entry is not None and self._delta_matches(norm, entry, prefix))
+
+        results.sort(key=lambda item: -item[2])
+        return [{'text': display, 'type': kind, 'weight': round(weight, 4)}
+                for display, kind, weight in results[:limit]]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_autocomplete_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = AutocompleteIndex()
+        return _index
+
+
+@api_view(['GET'])
+def autocomplete(request):
+    """Search-as-you-type suggestions for ?q="""
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    suggestions = get_autocomplete_index().suggest(request.GET.get('q', ''), max(limit, 1))
+    return Response({'query': request.GET.get('q', ''), 'suggestions': suggestions})
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from ...search_backends import PostgresSearchBackend
+
+
+class Command(BaseCommand):
+    help = 'Install the search_vector trigger/indexes and backfill stored vectors in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows updated per transaction')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every row, not only rows without a vector')
+        parser.add_argument('--skip-install', action='store_true',
+                            help='Do not (re)create the trigger and indexes')
+
+    def handle(self, *args, **options):
+        backend = PostgresSearchBackend()
+
+        if not options['skip_install']:
+            backend.install()
+            self.stdout.write('Installed search_vector trigger and GIN indexes')
+
+        def progress(position, high, updated):
+            self.stdout.write(f'  id {position}/{high}: {updated} rows updated')
+
+        updated = backend.backfill(
+            batch_size=options['batch_size'],
+            only_missing=not options['all'],
+            progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {updated} rows'))
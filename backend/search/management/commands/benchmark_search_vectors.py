@@ -0,0 +1,89 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...search_backends import PostgresSearchBackend
+
+BENCH_TABLE = 'search_vector_bench'
+
+# Word pool for the synthetic catalog; queries draw from the same pool so
+# they have realistic selectivity
+WORDS = [
+    'python', 'guitar', 'cooking', 'travel', 'fitness', 'gaming', 'music', 'science',
+    'history', 'comedy', 'tutorial', 'review', 'vlog', 'podcast', 'news', 'design',
+    'football', 'chess', 'painting', 'camera', 'drone', 'garden', 'yoga', 'finance',
+]
+
+
+class Command(BaseCommand):
+    help = ('Compare advanced_search latency with per-query to_tsvector() against the '
+            'stored, GIN-indexed search_vector on a synthetic catalog')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark table')
+
+    def handle(self, *args, **options):
+        vector = PostgresSearchBackend.vector_sql()
+        words = "ARRAY[%s]" % ', '.join(f"'{w}'" for w in WORDS)
+        pick = f'{words}[1 + floor(random() * {len(WORDS)})::int]'
+
+        with connection.cursor() as cursor:
+            self.stdout.write(f'Building {options["rows"]} synthetic rows in {BENCH_TABLE}...')
+            cursor.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+            cursor.execute(f"""
+                CREATE TABLE {BENCH_TABLE} AS
+                SELECT g AS id,
+                       {pick} || ' ' || {pick} || ' ' || md5(g::text) AS title,
+                       {pick} || ' ' || {pick} || ' ' || {pick} || ' ' || md5((g * 7)::text) AS description,
+                       {pick} || ' ' || {pick} AS tags,
+                       {pick} AS category
+                FROM generate_series(1, %s) AS g
+            """, [options['rows']])
+            cursor.execute(f'ALTER TABLE {BENCH_TABLE} ADD COLUMN search_vector tsvector')
+            cursor.execute(f'UPDATE {BENCH_TABLE} SET search_vector = {vector}')
+            cursor.execute(f'CREATE INDEX ON {BENCH_TABLE} USING GIN (search_vector)')
+            cursor.execute(f'ANALYZE {BENCH_TABLE}')
+
+            queries = [f'{WORDS[i % len(WORDS)]} & {WORDS[(i * 5 + 3) % len(WORDS)]}'
+                       for i in range(options['queries'])]
+
+            before = self._time(cursor, f"""
+                SELECT id, ts_rank({vector}, q) AS rank
+                FROM {BENCH_TABLE}, to_tsquery('simple', %s) AS q
+                WHERE {vector} @@ q
+                ORDER BY rank DESC LIMIT 20
+            """, queries)
+            after = self._time(cursor, f"""
+                SELECT id, ts_rank(search_vector, q) AS rank
+                FROM {BENCH_TABLE}, to_tsquery('simple', %s) AS q
+                WHERE search_vector @@ q
+                ORDER BY rank DESC LIMIT 20
+            """, queries)
+
+            if not options['keep']:
+                cursor.execute(f'DROP TABLE {BENCH_TABLE}')
+
+        self._report('computed per query', before)
+        self._report('stored + GIN index', after)
+        self.stdout.write(self.style.SUCCESS(
+            f'Median speedup: {statistics.median(before) / statistics.median(after):.1f}x'
+        ))
+
+    def _time(self, cursor, sql, queries):
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            cursor.execute(sql, [query])
+            cursor.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def _report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{label:>20}: median {statistics.median(timings):8.1f} ms, p95 {p95:8.1f} ms'
+        )
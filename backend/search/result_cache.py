@@ -0,0 +1,208 @@
+# Query result cache for search, trending, categories and popular searches
+#
+# Results are cached under a key built from the namespace and the normalized
+# query parameters, in Redis (through django-redis, when it is the configured
+# cache) or in a process-local LRU. Each namespace has a generation counter
+# that is part of every key; bumping it on Video writes invalidates all of
+# that namespace's entries at once without scanning keys.
+#
+# Stampede protection:
+# - entries carry a soft expiry and are kept for STALE_GRACE seconds longer;
+#   callers recompute probabilistically before the soft expiry (XFetch),
+#   weighted by how long the value took to compute;
+# - only the caller that wins a short lock recomputes; everyone else keeps
+#   serving the stale value, or briefly waits when there is none.
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+# Default time-to-live (seconds) per namespace; override with QUERY_CACHE_TTLS
+DEFAULT_TTLS = {
+    'search': 30,
+    'trending': 60,
+    'categories': 300,
+    'popular_searches': 300,
+}
+
+# Seconds an entry is kept past its soft expiry to be served while refreshing
+STALE_GRACE = 60
+
+# XFetch aggressiveness; 1.0 is the value from the paper
+EARLY_RECOMPUTE_BETA = 1.0
+
+# How long a caller without a stale value waits for another's recompute
+LOCK_WAIT = 5.0
+LOCK_POLL_INTERVAL = 0.05
+
+LOCAL_MAX_ENTRIES = 10000
+
+
+class LRUCache:
+    """Thread-safe in-process cache with the subset of the Django cache API used here"""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._live(key)
+            return default if item is None else item[0]
+
+    def _set(self, key, value, timeout):
+        expires = time.monotonic() + timeout if timeout else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                raise ValueError(f'Key {key!r} not found')
+            self._data[key] = (item[0] + delta, item[1])
+            return item[0] + delta
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_cache = LRUCache()
+
+
+# Parameters matched case-insensitively, normalized before keying. Every
+# other value (exact filters, keyset cursors) is part of the key as given.
+TEXT_PARAMS = ('q',)
+
+
+def normalize_params(params):
+    """Drop empty values; trim, lower-case and collapse whitespace of the text query"""
+    normalized = {}
+    for key, value in (params or {}).items():
+        if value is None or value == '':
+            continue
+        if key in TEXT_PARAMS and isinstance(value, str):
+            value = ' '.join(value.lower().split())
+        normalized[key] = value
+    return normalized
+
+
+class QueryResultCache:
+    """get_or_compute() wrapper around the configured cache store"""
+
+    @staticmethod
+    def store():
+        alias = getattr(settings, 'QUERY_CACHE_ALIAS', 'default')
+        backend = getattr(settings, 'QUERY_CACHE_BACKEND', None)
+        if backend is None:
+            configured = getattr(settings, 'CACHES', {}).get(alias, {}).get('BACKEND', '')
+            backend = 'redis' if 'redis' in configured.lower() else 'memory'
+        return caches[alias] if backend == 'redis' else _local_cache
+
+    @staticmethod
+    def ttl(namespace):
+        ttls = dict(DEFAULT_TTLS, **getattr(settings, 'QUERY_CACHE_TTLS', {}))
+        return ttls.get(namespace, 60)
+
+    @staticmethod
+    def _generation(store, namespace):
+        return store.get(f'qc:gen:{namespace}') or 0
+
+    @staticmethod
+    def make_key(store, namespace, params):
+        payload = json.dumps(normalize_params(params), sort_keys=True, default=str)
+        digest = hashlib.md5(payload.encode('utf-8')).hexdigest()
+        return f'qc:{namespace}:{QueryResultCache._generation(store, namespace)}:{digest}'
+
+    @staticmethod
+    def get_or_compute(namespace, params, compute, ttl=None):
+        """Return the cached result for (namespace, params), computing it at most once"""
+        store = QueryResultCache.store()
+        ttl = ttl or QueryResultCache.ttl(namespace)
+        key = QueryResultCache.make_key(store, namespace, params)
+        lock_key = f'{key}:lock'
+
+        entry = store.get(key)
+        if entry is not None and not QueryResultCache._should_refresh(entry):
+            return entry['value']
+
+        deadline = time.monotonic() + LOCK_WAIT
+        locked = store.add(lock_key, 1, max(int(LOCK_WAIT * 2), 1))
+        while not locked:
+            if entry is not None:
+                # Someone else is refreshing; stale is good enough
+                return entry['value']
+            if time.monotonic() >= deadline:
+                # The holder is taking too long; compute without the lock
+                break
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = store.get(key)
+            if entry is not None:
+                return entry['value']
+            locked = store.add(lock_key, 1, max(int(LOCK_WAIT * 2), 1))
+
+        try:
+            started = time.monotonic()
+            value = compute()
+            store.set(key, {
+                'value': value,
+                'expires': time.time() + ttl,
+                'delta': time.monotonic() - started,
+            }, ttl + STALE_GRACE)
+            return value
+        finally:
+            if locked:
+                store.delete(lock_key)
+
+    @staticmethod
+    def _should_refresh(entry):
+        """XFetch: refresh early with a probability that grows near expiry"""
+        jitter = entry['delta'] * EARLY_RECOMPUTE_BETA * -math.log(1.0 - random.random())
+        return time.time() + jitter >= entry['expires']
+
+    @staticmethod
+    def invalidate(*namespaces):
+        """Invalidate every cached entry of the given namespaces"""
+        store = QueryResultCache.store()
+        for namespace in namespaces:
+            key = f'qc:gen:{namespace}'
+            if store.add(key, 1, None):
+                continue
+            try:
+                store.incr(key)
+            except ValueError:
+                store.set(key, 1, None)
@@ -0,0 +1,380 @@
+# Indexed search backends for VideoSearchService
+#
+# search_videos used to OR four icontains filters, which is a sequential scan
+# on every keystroke. Text search now goes through a SearchBackend:
+#
+# - PostgresSearchBackend: a stored, weighted tsvector column on Video
+#   (GIN-indexed) for term matching plus a pg_trgm GIN index on title for
+#   typo-tolerant matching.
+# - InMemorySearchBackend: an in-process inverted index with the same
+#   matching and scoring rules, for SQLite and tests.
+#
+# Both backends rank identically:
+#   * every query term must match some field (the last term as a prefix, so
+#     results work while typing), or the title must be trigram-similar to
+#     the query (similarity >= TRIGRAM_THRESHOLD, pg_trgm semantics);
+#   * score = sum over query terms of the weights of the fields they match
+#     (title 1.0, description 0.4, tags 0.2, category 0.1 - the ts_rank
+#     A/B/C/D weights) + trigram similarity of title and query;
+#   * ties are broken by newest id first.
+#
+# The stored vector uses the 'simple' text search configuration: words are
+# lower-cased but neither stemmed nor dropped as stop words, so "running"
+# does not match "run" and "the" is an ordinary term. advanced_search
+# queries with the same configuration; before the stored column it used
+# 'english' and matched stems.
+#
+# The Postgres backend expects Video to declare
+#   search_vector = SearchVectorField(null=True, editable=False)
+# and install_sql() to have been applied once; it creates the GIN indexes and
+# a trigger that keeps search_vector current on every insert and update.
+# Existing rows are filled in with the backfill_search_vectors command.
+import bisect
+import re
+import threading
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Coalesce
+
+# tsvector weight label and ts_rank weight for each indexed field
+FIELD_WEIGHTS = (
+    ('title', 'A', 1.0),
+    ('description', 'B', 0.4),
+    ('tags', 'C', 0.2),
+    ('category', 'D', 0.1),
+)
+
+# pg_trgm's default similarity_threshold
+TRIGRAM_THRESHOLD = 0.3
+
+# The in-memory backend hands at most this many ranked ids back to the ORM,
+# the best ones that pass the queryset's filters
+MAX_RESULTS = 1000
+
+# Ranked ids checked against the queryset's filters per query
+FILTER_BATCH_SIZE = 5000
+
+# Runs of Unicode letters and digits; the default text search parser also
+# splits on underscores
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """Case-folded Unicode words, as the 'simple' text search config sees them"""
+    return _TOKEN_RE.findall((text or '').casefold())
+
+
+def trigrams(text):
+    """Trigram set of text, following pg_trgm's show_trgm()"""
+    grams = set()
+    for word in tokenize(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def trigram_similarity(a, b):
+    """pg_trgm similarity(): shared trigrams over the union of both sets"""
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / float(len(a) + len(b) - shared)
+
+
+class SearchBackend:
+    """Interface for full-text video search"""
+
+    def search(self, query, queryset):
+        """
+        Restrict queryset to videos matching query and annotate each with
+        ``search_rank``; order with VideoSearchService.sort_videos('relevance').
+        Pass the queryset with its filters applied, as a backend may cap
+        the number of matches it keeps.
+        """
+        raise NotImplementedError
+
+    def index_video(self, video):
+        """Add or refresh one video in the index"""
+        raise NotImplementedError
+
+    def remove_video(self, video_id):
+        """Drop one video from the index"""
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Re-index the whole catalog"""
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(SearchBackend):
+    """tsvector + pg_trgm search with GIN indexes"""
+
+    @staticmethod
+    def vector_sql(alias=''):
+        """SQL expression building the weighted tsvector from the row's columns"""
+        prefix = f'{alias}.' if alias else ''
+        return ' || '.join(
+            f"setweight(to_tsvector('simple', coalesce({prefix}{field}, '')), '{label}')"
+            for field, label, _ in FIELD_WEIGHTS
+        )
+
+    @staticmethod
+    def install_sql():
+        """DDL for the pg_trgm extension, GIN indexes and maintenance trigger"""
+        from ..models import Video
+
+        table = Video._meta.db_table
+        columns = ', '.join(field for field, _, _ in FIELD_WEIGHTS)
+        return [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            f'CREATE INDEX IF NOT EXISTS {table}_search_vector_gin ON {table} USING GIN (search_vector)',
+            f'CREATE INDEX IF NOT EXISTS {table}_title_trgm_gin ON {table} USING GIN (title gin_trgm_ops)',
+            f"""
+            CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {PostgresSearchBackend.vector_sql('NEW')};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            f'DROP TRIGGER IF EXISTS {table}_search_vector_trigger ON {table}',
+            f"""
+            CREATE TRIGGER {table}_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF {columns} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_update()
+            """,
+        ]
+
+    def install(self):
+        with connection.cursor() as cursor:
+            for statement in self.install_sql():
+                cursor.execute(statement)
+
+    @staticmethod
+    def _tsquery(term, prefix=False, weight=''):
+        from django.contrib.postgres.search import SearchQuery
+
+        return SearchQuery(f"{term}:{'*' if prefix else ''}{weight}", search_type='raw', config='simple')
+
+    def search(self, query, queryset):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+
+        score = Coalesce(TrigramSimilarity('title', query), Value(0.0), output_field=FloatField())
+        match = Q()
+        for i, term in enumerate(terms):
+            prefix = i == len(terms) - 1
+            match &= Q(search_vector=self._tsquery(term, prefix))
+            for _, label, weight in FIELD_WEIGHTS:
+                score = score + Case(
+                    When(search_vector=self._tsquery(term, prefix, label), then=Value(weight)),
+                    default=Value(0.0),
+                    output_field=FloatField()
+                )
+
+        return queryset.filter(match | Q(title__trigram_similar=query)).annotate(search_rank=score)
+
+    def index_video(self, video):
+        # search_vector is maintained by the trigger in the same statement
+        # that writes the row
+        pass
+
+    def remove_video(self, video_id):
+        # The row (and its stored vector) is deleted with the video
+        pass
+
+    def rebuild(self):
+        self.backfill(only_missing=False)
+
+    def backfill(self, batch_size=10000, only_missing=True, progress=None):
+        """
+        Recompute search_vector in id-range batches.
+
+        Each batch is its own short transaction, so row locks are held only
+        for batch_size rows at a time and the table stays writable. Returns
+        the number of rows updated.
+        """
+        from ..models import Video
+
+        table = Video._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM {table}')
+            low, high = cursor.fetchone()
+
+        updated = 0
+        missing = ' AND search_vector IS NULL' if only_missing else ''
+        for start in range(low, high + 1, batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {table} SET search_vector = {self.vector_sql()} '
+                    f'WHERE id >= %s AND id < %s{missing}',
+                    [start, start + batch_size]
+                )
+                updated += cursor.rowcount
+            if progress:
+                progress(min(start + batch_size - 1, high), high, updated)
+        return updated
+
+
+class InMemorySearchBackend(SearchBackend):
+    """Process-local inverted index with the same scoring as Postgres"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = {}     # term -> {video_id: weight bitmask}
+        self._vocabulary = []   # sorted terms, for prefix lookup
+        self._doc_terms = {}    # video_id -> terms, for removal
+        self._title_grams = {}  # video_id -> title trigram set
+        self._gram_postings = {}  # trigram -> {video_id}
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+
+    def rebuild(self):
+        from ..models import Video
+
+        with self._lock:
+            self._postings, self._vocabulary = {}, []
+            self._doc_terms, self._title_grams, self._gram_postings = {}, {}, {}
+            for video in Video.objects.only('id', *[f for f, _, _ in FIELD_WEIGHTS]).iterator():
+                self._add(video)
+            self._loaded = True
+
+    def index_video(self, video):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(video.pk)
+            self._add(video)
+
+    def remove_video(self, video_id):
+        with self._lock:
+            self._remove(video_id)
+
+    def _add(self, video):
+        terms = {}
+        for bit, (field, _, _) in enumerate(FIELD_WEIGHTS):
+            for term in tokenize(getattr(video, field, '')):
+                terms[term] = terms.get(term, 0) | (1 << bit)
+
+        for term, mask in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._vocabulary, term)
+            postings[video.pk] = mask
+        self._doc_terms[video.pk] = list(terms)
+
+        grams = trigrams(video.title)
+        self._title_grams[video.pk] = grams
+        for gram in grams:
+            self._gram_postings.setdefault(gram, set()).add(video.pk)
+
+    def _remove(self, video_id):
+        for term in self._doc_terms.pop(video_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(video_id, None)
+                if not postings:
+                    del self._postings[term]
+                    self._vocabulary.pop(bisect.bisect_left(self._vocabulary, term))
+        for gram in self._title_grams.pop(video_id, ()):
+            ids = self._gram_postings.get(gram)
+            if ids is not None:
+                ids.discard(video_id)
+                if not ids:
+                    del self._gram_postings[gram]
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self._postings else []
+        # Every vocabulary term with this prefix sorts into one contiguous run
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + '\uffff', start)
+        return self._vocabulary[start:end]
+
+    def _term_masks(self, term, prefix):
+        """video_id -> fields matched by this query term"""
+        masks = {}
+        for expanded in self._expand(term, prefix):
+            for video_id, mask in self._postings[expanded].items():
+                masks[video_id] = masks.get(video_id, 0) | mask
+        return masks
+
+    def rank(self, query):
+        """[(video_id, score)] best first"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            self._ensure_loaded()
+
+            per_term = [self._term_masks(t, i == len(terms) - 1) for i, t in enumerate(terms)]
+            matched = set.intersection(*(set(m) for m in per_term)) if per_term else set()
+
+            query_grams = trigrams(query)
+            similarity = {}
+            for gram in query_grams:
+                for video_id in self._gram_postings.get(gram, ()):
+                    if video_id not in similarity:
+                        similarity[video_id] = trigram_similarity(query_grams, self._title_grams[video_id])
+            fuzzy = {vid for vid, sim in similarity.items() if sim >= TRIGRAM_THRESHOLD}
+
+            scores = []
+            for video_id in matched | fuzzy:
+                score = similarity.get(video_id, 0.0)
+                for masks in per_term:
+                    mask = masks.get(video_id, 0)
+                    score += sum(w for bit, (_, _, w) in enumerate(FIELD_WEIGHTS) if mask & (1 << bit))
+                scores.append((video_id, score))
+
+        scores.sort(key=lambda item: (-item[1], -item[0]))
+        return scores
+
+    def search(self, query, queryset):
+        ranked = self.rank(query)
+        if len(ranked) > MAX_RESULTS:
+            # Keep the best MAX_RESULTS that pass the queryset's filters,
+            # checking candidates in rank order
+            allowed = set()
+            for i in range(0, len(ranked), FILTER_BATCH_SIZE):
+                batch = [vid for vid, _ in ranked[i:i + FILTER_BATCH_SIZE]]
+                allowed.update(queryset.filter(id__in=batch).values_list('id', flat=True))
+                if len(allowed) >= MAX_RESULTS:
+                    break
+            ranked = [(vid, score) for vid, score in ranked if vid in allowed][:MAX_RESULTS]
+        if not ranked:
+            return queryset.none()
+        return queryset.filter(id__in=[vid for vid, _ in ranked]).annotate(
+            search_rank=Case(
+                *[When(id=vid, then=Value(score)) for vid, score in ranked],
+                default=Value(0.0),
+                output_field=FloatField()
+            )
+        )
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    """
+    Configured backend (settings.SEARCH_BACKEND = 'postgres' | 'memory');
+    defaults to Postgres on a PostgreSQL database and in-memory otherwise.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = getattr(settings, 'SEARCH_BACKEND', None)
+            if name is None:
+                name = 'postgres' if connection.vendor == 'postgresql' else 'memory'
+            _backend = PostgresSearchBackend() if name == 'postgres' else InMemorySearchBackend()
+        return _backend
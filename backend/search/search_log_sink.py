@@ -0,0 +1,167 @@
+# Asynchronous, batched search logging
+#
+# log_search used to INSERT one SearchLog row inside every search request.
+# Search events now go onto a bounded in-memory queue and a background
+# thread writes them with bulk_create, in batches bounded by size
+# (SEARCH_LOG_BATCH_SIZE) and time (SEARCH_LOG_FLUSH_INTERVAL). When the
+# queue is above its high-water mark events are sampled, and when it is full
+# they are dropped, so a slow database never adds latency to search.
+#
+# Durability: events still queued when a process dies are lost. An atexit
+# hook flushes on clean shutdown. This is acceptable for search analytics,
+# which are statistical.
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+# Above this fraction of the queue, only SAMPLE_RATE of new events are kept
+HIGH_WATER_MARK = 0.8
+DEFAULT_SAMPLE_RATE = 0.1
+
+
+class SearchLogSink:
+    """Bounded queue + background bulk writer for SearchLog rows"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, queue_size=None, batch_size=None, flush_interval=None, sample_rate=None):
+        self.queue_size = queue_size or getattr(settings, 'SEARCH_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+        self.batch_size = batch_size or getattr(settings, 'SEARCH_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.flush_interval = flush_interval or getattr(settings, 'SEARCH_LOG_FLUSH_INTERVAL',
+                                                        DEFAULT_FLUSH_INTERVAL)
+        self.sample_rate = sample_rate if sample_rate is not None else getattr(
+            settings, 'SEARCH_LOG_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,
+            'sampled_out': 0,
+            'dropped': 0,
+            'written': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'failed_counter_batches': 0,
+        }
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                atexit.register(cls._instance.stop)
+            return cls._instance
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def submit(self, user_id, query, result_count):
+        """Queue one search event; never blocks. Returns False if it was not kept."""
+        self._ensure_started()
+
+        if self._queue.qsize() >= self.queue_size * HIGH_WATER_MARK and random.random() >= self.sample_rate:
+            self._count('sampled_out')
+            return False
+        try:
+            self._queue.put_nowait((user_id, query, result_count))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        stats['queue_size'] = self.queue_size
+        return stats
+
+    def _ensure_started(self):
+        # Threads do not survive fork(); pre-fork servers start one per worker
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._instance_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='search-log-sink', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        close_old_connections()
+
+    def _collect(self):
+        """Block for the first event, then gather until the batch fills or the interval ends"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        from ..models import SearchLog
+        from .search_stats import SearchStats
+
+        with self._flush_lock:
+            close_old_connections()
+            try:
+                SearchLog.objects.bulk_create([
+                    SearchLog(user_id=user_id, query=query, result_count=result_count)
+                    for user_id, query, result_count in batch
+                ], batch_size=self.batch_size)
+            except Exception:
+                self._count('failed_batches')
+                return
+            self._count('written', len(batch))
+            self._count('batches')
+            try:
+                # Popular-search counters: one upsert per distinct query
+                SearchStats.record_batch([query for _, query, _ in batch])
+            except Exception:
+                self._count('failed_counter_batches')
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def stop(self):
+        self._stopping.set()
+        self.flush()
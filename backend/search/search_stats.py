@@ -0,0 +1,195 @@
+# Pre-aggregated popular-search counters
+#
+# get_popular_searches used to GROUP BY the whole SearchLog table. Instead:
+# - every batch written by the search logging path is folded into hourly
+#   SearchQueryCount rows (one upsert per distinct query per batch);
+# - rollup_search_counts() sums hourly buckets into daily ones, drops hourly
+#   buckets older than HOURLY_RETENTION_HOURS and refreshes the top-K
+#   snapshot for the popular-searches window;
+# - prune_search_logs() enforces SEARCH_LOG_RETENTION_DAYS on SearchLog.
+#
+# Popular searches are served from the cached top-K snapshot, so a read is
+# O(K) no matter how large SearchLog grows. Schedule both tasks with Celery
+# beat (e.g. rollup every 10 minutes, prune daily). Without a schedule the
+# snapshot still follows the counters: a read that finds it missing or older
+# than POPULAR_SEARCH_MAX_AGE seconds runs the rollup and refresh inline,
+# one caller at a time, while the others keep serving what is cached.
+import heapq
+import time
+from collections import Counter
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from ..history.view_storage import UPSERT_BATCH_SIZE, upsert_totals
+
+# Popular searches cover this many days
+POPULAR_WINDOW_DAYS = 7
+
+# Size of the cached top-K snapshot (larger limits are capped to this)
+TOP_K = 100
+
+HOURLY_RETENTION_HOURS = 48
+SEARCH_LOG_RETENTION_DAYS = 30
+
+# Rows deleted per statement when pruning SearchLog
+PRUNE_BATCH_SIZE = 5000
+
+TOP_CACHE_KEY = 'search_stats:top_snapshot'
+TOP_REFRESH_LOCK_KEY = 'search_stats:top_snapshot:refreshing'
+TOP_REFRESH_LOCK_TTL = 120
+
+# Seconds before a read refreshes the snapshot
+DEFAULT_TOP_MAX_AGE = 600
+
+# Stale snapshots are kept this many times longer than they are fresh
+TOP_TTL_FACTOR = 12
+
+MAX_QUERY_LENGTH = 255
+
+
+def normalize_query(query):
+    """Lower-case, trim and collapse whitespace; '' for queries not worth counting"""
+    return ' '.join((query or '').lower().split())[:MAX_QUERY_LENGTH]
+
+
+def top_max_age():
+    return getattr(settings, 'POPULAR_SEARCH_MAX_AGE', DEFAULT_TOP_MAX_AGE)
+
+
+def _hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _day_bucket(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class SearchStats:
+    """Maintains SearchQueryCount buckets and the popular-search snapshot"""
+
+    @staticmethod
+    def _upsert(rows, accumulate=True):
+        """
+        Upsert (granularity, bucket_start, query, count) rows, UPSERT_BATCH_SIZE per statement.
+
+        accumulate=True adds to an existing count, otherwise replaces it.
+        """
+        from ..models import SearchQueryCount
+
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            upsert_totals(SearchQueryCount, ('granularity', 'bucket_start', 'query'), ('count',),
+                          rows[i:i + UPSERT_BATCH_SIZE], accumulate)
+
+    @staticmethod
+    def record_batch(queries, moment=None):
+        """Fold a batch of raw query strings into the current hourly bucket"""
+        from ..models import SearchQueryCount
+
+        counts = Counter(q for q in (normalize_query(q) for q in queries) if q)
+        bucket = _hour_bucket(moment or timezone.now())
+        SearchStats._upsert([
+            (SearchQueryCount.HOUR, bucket, query, count)
+            for query, count in counts.items()
+        ])
+
+    @staticmethod
+    def rollup(now=None):
+        """Recompute daily buckets from hourly ones and expire old hourly rows"""
+        from ..models import SearchQueryCount
+
+        now = now or timezone.now()
+        hourly_cutoff = _hour_bucket(now) - timedelta(hours=HOURLY_RETENTION_HOURS)
+        # Every day that still has hourly rows gets its daily total rebuilt
+        first_day = _day_bucket(hourly_cutoff)
+
+        with transaction.atomic():
+            day = first_day
+            while day <= now:
+                totals = SearchQueryCount.objects.filter(
+                    granularity=SearchQueryCount.HOUR,
+                    bucket_start__gte=day,
+                    bucket_start__lt=day + timedelta(days=1)
+                ).values('query').annotate(total=Sum('count'))
+                SearchStats._upsert([
+                    (SearchQueryCount.DAY, day, row['query'], row['total'])
+                    for row in totals
+                ], accumulate=False)
+                day += timedelta(days=1)
+
+            # Only whole days go, so a day that still has hourly rows has all of them
+            SearchQueryCount.objects.filter(
+                granularity=SearchQueryCount.HOUR,
+                bucket_start__lt=first_day
+            ).delete()
+
+    @staticmethod
+    def refresh_top(now=None, days=None):
+        """Compute the top-K queries of the window and cache the snapshot"""
+        from ..models import SearchQueryCount
+
+        now = now or timezone.now()
+        days = days or getattr(settings, 'POPULAR_SEARCH_WINDOW_DAYS', POPULAR_WINDOW_DAYS)
+        window_start = _day_bucket(now) - timedelta(days=days - 1)
+
+        totals = SearchQueryCount.objects.filter(
+            granularity=SearchQueryCount.DAY,
+            bucket_start__gte=window_start
+        ).values('query').annotate(total=Sum('count')).iterator()
+
+        top = heapq.nlargest(TOP_K, ((row['total'], row['query']) for row in totals))
+        snapshot = [{'query': query, 'count': total} for total, query in top]
+        cache.set(TOP_CACHE_KEY, {'snapshot': snapshot, 'computed_at': time.time()},
+                  top_max_age() * TOP_TTL_FACTOR)
+        return snapshot
+
+    @staticmethod
+    def top(limit=10):
+        """Top queries from the snapshot; O(limit)"""
+        entry = cache.get(TOP_CACHE_KEY)
+        if entry is None or time.time() - entry['computed_at'] > top_max_age():
+            # Only the caller holding the lock refreshes
+            if cache.add(TOP_REFRESH_LOCK_KEY, True, TOP_REFRESH_LOCK_TTL):
+                try:
+                    SearchStats.rollup()
+                    entry = {'snapshot': SearchStats.refresh_top()}
+                finally:
+                    cache.delete(TOP_REFRESH_LOCK_KEY)
+            elif entry is None:
+                # Cold cache while another caller builds the snapshot
+                return []
+        return entry['snapshot'][:min(limit, TOP_K)]
+
+    @staticmethod
+    def prune_logs(now=None, days=None):
+        """Delete SearchLog rows past retention in bounded batches"""
+        from ..models import SearchLog
+
+        now = now or timezone.now()
+        days = days or getattr(settings, 'SEARCH_LOG_RETENTION_DAYS', SEARCH_LOG_RETENTION_DAYS)
+        cutoff = now - timedelta(days=days)
+
+        deleted = 0
+        while True:
+            ids = list(SearchLog.objects.filter(
+                created_at__lt=cutoff
+            ).order_by('id').values_list('id', flat=True)[:PRUNE_BATCH_SIZE])
+            if not ids:
+                return deleted
+            deleted += SearchLog.objects.filter(id__in=ids).delete()[0]
+
+
+@shared_task(name='search.rollup_search_counts')
+def rollup_search_counts():
+    """Periodic rollup of hourly counters and top-K refresh"""
+    SearchStats.rollup()
+    return len(SearchStats.refresh_top())
+
+
+@shared_task(name='search.prune_search_logs')
+def prune_search_logs():
+    """Periodic SearchLog retention"""
+    return SearchStats.prune_logs()
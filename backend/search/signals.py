@@ -0,0 +1,39 @@
+# Model signal wiring for search
+#
+# Call connect_search_signals() from the project's AppConfig.ready() so the
+# search index, autocomplete index and cached query results follow Video
+# writes.
+from django.db.models.signals import post_delete, post_save
+
+# Cached result namespaces that depend on the video catalog
+VIDEO_CACHE_NAMESPACES = ('search', 'trending', 'categories')
+
+
+def _video_saved(sender, instance, **kwargs):
+    from .search_backends import get_search_backend
+    from .result_cache import QueryResultCache
+    from .autocomplete import get_autocomplete_index
+
+    get_search_backend().index_video(instance)
+    get_autocomplete_index().index_video(instance)
+    QueryResultCache.invalidate(*VIDEO_CACHE_NAMESPACES)
+
+
+def _video_deleted(sender, instance, **kwargs):
+    from .search_backends import get_search_backend
+    from .result_cache import QueryResultCache
+    from .autocomplete import get_autocomplete_index
+    from .trending import TrendingEngine
+
+    get_search_backend().remove_video(instance.pk)
+    get_autocomplete_index().remove_video(instance.pk)
+    TrendingEngine.instance().remove_video(instance.pk)
+    QueryResultCache.invalidate(*VIDEO_CACHE_NAMESPACES)
+
+
+def connect_search_signals():
+    """Keep the search indexes and result cache in sync with Video writes"""
+    from ..models import Video
+
+    post_save.connect(_video_saved, sender=Video, dispatch_uid='search_video_saved')
+    post_delete.connect(_video_deleted, sender=Video, dispatch_uid='search_video_deleted')
@@ -0,0 +1,370 @@
+# Incremental trending engine
+#
+# get_trending_videos used to join every view of the last N days and count
+# them on each request. Trending scores are now maintained as views happen:
+# every view adds an exponentially time-decayed weight to its video, once per
+# half-life variant, both globally and within the video's category. Reading
+# trending is a top-K range read of a sorted set.
+#
+# Forward decay: a view at time t adds exp(rate * (t - epoch)) where
+# rate = ln 2 / half_life, so old scores never have to be touched when time
+# passes; dividing by exp(rate * (now - epoch)) gives the decayed score.
+# Weights grow with time, so rebase() (run periodically) moves the epoch to
+# now, rescales stored scores and drops those that have decayed away.
+#
+# Stores: Redis sorted sets (through django-redis) when the default cache is
+# Redis, with the increment and rebase as Lua scripts so they are atomic with
+# respect to each other; otherwise an in-process store with the same math,
+# which only sees views recorded by its own process. Every key a script
+# touches is passed in KEYS.
+#
+# rebuild() replays stored views into a staging store and then swaps it in
+# (RENAME on Redis), so readers keep getting the old ranking until the new
+# one is complete instead of a cleared, half-replayed one.
+import heapq
+import math
+import threading
+import time
+import uuid
+from celery import shared_task
+from django.conf import settings
+
+# Half-life variants, in seconds; override with TRENDING_HALF_LIVES
+DEFAULT_HALF_LIVES = {
+    '6h': 6 * 3600,
+    '1d': 24 * 3600,
+    '3d': 3 * 24 * 3600,
+}
+
+KEY_PREFIX = 'trending'
+
+# Decayed scores below this (a fraction of one fresh view) are dropped on rebase
+MIN_SCORE = 0.01
+
+# The in-process store rebases itself before weights get this large
+LOCAL_MAX_EXPONENT = 300.0
+
+_INCREMENT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local epoch = redis.call('GET', KEYS[1])
+if not epoch then
+    epoch = ARGV[1]
+    redis.call('SET', KEYS[1], epoch)
+end
+epoch = tonumber(epoch)
+for i = 3, #KEYS do
+    local rate = tonumber(ARGV[i])
+    redis.call('ZINCRBY', KEYS[i], math.exp(rate * (now - epoch)), ARGV[2])
+    redis.call('HSET', KEYS[2], KEYS[i], ARGV[i])
+end
+return tostring(epoch)
+"""
+
+# KEYS[3..] must be every sorted set in the registry (KEYS[2]); if one was
+# added since the caller read it, nothing changes and -1 is returned
+_REBASE_SCRIPT = """
+if redis.call('HLEN', KEYS[2]) ~= #KEYS - 2 then
+    return -1
+end
+local now = tonumber(ARGV[1])
+local old = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+for i = 3, #KEYS do
+    local factor = math.exp(-tonumber(redis.call('HGET', KEYS[2], KEYS[i])) * (now - old))
+    redis.call('ZUNIONSTORE', KEYS[i], 1, KEYS[i], 'WEIGHTS', tostring(factor))
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', '(' .. ARGV[2])
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return #KEYS - 2
+"""
+
+# Replace a live store with a staged one. KEYS: live epoch and registry,
+# staged epoch and registry, the ARGV[1] staged sorted sets, their live
+# names, then the live sets the staged store does not have (deleted).
+# ARGV[2] is the live registry size the caller saw; -1 if it has changed.
+_SWAP_SCRIPT = """
+local n = tonumber(ARGV[1])
+if redis.call('HLEN', KEYS[2]) ~= tonumber(ARGV[2]) then
+    return -1
+end
+redis.call('DEL', KEYS[2])
+for i = 5, 4 + n do
+    local rate = redis.call('HGET', KEYS[4], KEYS[i])
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + n])
+    else
+        redis.call('DEL', KEYS[i + n])
+    end
+    redis.call('HSET', KEYS[2], KEYS[i + n], rate)
+end
+for i = 5 + 2 * n, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+local epoch = redis.call('GET', KEYS[3])
+if epoch then
+    redis.call('SET', KEYS[1], epoch)
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('DEL', KEYS[3], KEYS[4])
+return n
+"""
+
+
+def half_lives():
+    return getattr(settings, 'TRENDING_HALF_LIVES', DEFAULT_HALF_LIVES)
+
+
+def decay_rate(half_life):
+    return math.log(2) / half_life
+
+
+def half_life_for_days(days):
+    """
+    Variant closest to a sliding window of `days` days.
+
+    The views in a uniform window are days / 2 old on average, and under
+    exponential decay they are half_life / ln 2 old on average.
+    """
+    target = days * 86400 / 2 * math.log(2)
+    return min(half_lives().items(), key=lambda item: abs(item[1] - target))[0]
+
+
+def scope(category=None):
+    return f'cat:{category}' if category else 'all'
+
+
+class RedisTrendingStore:
+    """Sorted sets per (variant, scope) holding forward-decayed scores"""
+
+    def __init__(self, alias='default', prefix=KEY_PREFIX):
+        from django_redis import get_redis_connection
+
+        self.alias = alias
+        self.prefix = prefix
+        self.redis = get_redis_connection(alias)
+        self._increment = self.redis.register_script(_INCREMENT_SCRIPT)
+        self._rebase = self.redis.register_script(_REBASE_SCRIPT)
+        self._swap = self.redis.register_script(_SWAP_SCRIPT)
+        self.epoch_key = f'{prefix}:epoch'
+        self.registry_key = f'{prefix}:keys'
+
+    def key(self, variant, category=None):
+        return f'{self.prefix}:{variant}:{scope(category)}'
+
+    def _registered(self):
+        return [key.decode() for key in self.redis.hkeys(self.registry_key)]
+
+    def add(self, video_id, category, moment):
+        keys, rates = [], []
+        for variant, half_life in half_lives().items():
+            for scoped in ([None, category] if category else [None]):
+                keys.append(self.key(variant, scoped))
+                rates.append(repr(decay_rate(half_life)))
+        # ARGV[i] is the rate of KEYS[i]; the first two slots are now/member
+        self._increment(keys=[self.epoch_key, self.registry_key] + keys,
+                        args=[repr(moment), str(video_id)] + rates)
+
+    def top(self, variant, category, limit, now):
+        pipe = self.redis.pipeline()
+        pipe.get(self.epoch_key)
+        pipe.zrevrange(self.key(variant, category), 0, limit - 1, withscores=True)
+        epoch, rows = pipe.execute()
+        if epoch is None:
+            return []
+        scale = math.exp(-decay_rate(half_lives()[variant]) * (now - float(epoch)))
+        return [(int(member), score * scale) for member, score in rows]
+
+    def remove(self, video_id):
+        keys = self.redis.hkeys(self.registry_key)
+        if keys:
+            pipe = self.redis.pipeline()
+            for key in keys:
+                pipe.zrem(key, str(video_id))
+            pipe.execute()
+
+    def rebase(self, now):
+        while True:
+            # A view that adds a new sorted set meanwhile makes the script refuse
+            rebased = self._rebase(keys=[self.epoch_key, self.registry_key] + self._registered(),
+                                   args=[repr(now), repr(MIN_SCORE)])
+            if rebased >= 0:
+                return rebased
+
+    def staging(self):
+        """An empty store under its own keys, for replace_with()"""
+        return RedisTrendingStore(self.alias, f'{KEY_PREFIX}:staging:{uuid.uuid4().hex}')
+
+    def replace_with(self, staged):
+        """Atomically make a staged store's scores the live ones; consumes the staged keys"""
+        staged_keys = staged._registered()
+        live_keys = [self.prefix + key[len(staged.prefix):] for key in staged_keys]
+        while True:
+            current = self._registered()
+            stale = [key for key in current if key not in live_keys]
+            swapped = self._swap(keys=[self.epoch_key, self.registry_key, staged.epoch_key, staged.registry_key]
+                                 + staged_keys + live_keys + stale,
+                                 args=[len(staged_keys), len(current)])
+            if swapped >= 0:
+                return swapped
+
+    def clear(self):
+        keys = self.redis.hkeys(self.registry_key)
+        self.redis.delete(self.epoch_key, self.registry_key, *keys)
+
+
+class LocalTrendingStore:
+    """In-process equivalent of RedisTrendingStore"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = None
+        self._scores = {}  # (variant, scope) -> {video_id: weight}
+
+    def add(self, video_id, category, moment):
+        with self._lock:
+            if self._epoch is None:
+                self._epoch = moment
+            for variant, half_life in half_lives().items():
+                exponent = decay_rate(half_life) * (moment - self._epoch)
+                if exponent > LOCAL_MAX_EXPONENT:
+                    self._rebase(moment)
+                    exponent = 0.0
+                weight = math.exp(exponent)
+                for scoped in ([None, category] if category else [None]):
+                    scores = self._scores.setdefault((variant, scope(scoped)), {})
+                    scores[video_id] = scores.get(video_id, 0.0) + weight
+
+    def top(self, variant, category, limit, now):
+        with self._lock:
+            if self._epoch is None:
+                return []
+            scores = self._scores.get((variant, scope(category)), {})
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            scale = math.exp(-decay_rate(half_lives()[variant]) * (now - self._epoch))
+        return [(video_id, score * scale) for video_id, score in best]
+
+    def remove(self, video_id):
+        with self._lock:
+            for scores in self._scores.values():
+                scores.pop(video_id, None)
+
+    def _rebase(self, now):
+        for (variant, key_scope), scores in self._scores.items():
+            factor = math.exp(-decay_rate(half_lives()[variant]) * (now - self._epoch))
+            self._scores[(variant, key_scope)] = {
+                video_id: score * factor for video_id, score in scores.items()
+                if score * factor >= MIN_SCORE
+            }
+        self._epoch = now
+        return len(self._scores)
+
+    def rebase(self, now):
+        with self._lock:
+            if self._epoch is None:
+                return 0
+            return self._rebase(now)
+
+    def staging(self):
+        return LocalTrendingStore()
+
+    def replace_with(self, staged):
+        with self._lock:
+            self._epoch, self._scores = staged._epoch, staged._scores
+        return len(self._scores)
+
+    def clear(self):
+        with self._lock:
+            self._epoch = None
+            self._scores = {}
+
+
+class TrendingEngine:
+    """Records view events and serves time-decayed trending rankings"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, store):
+        self.store = store
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                backend = getattr(settings, 'TRENDING_BACKEND', None)
+                if backend is None:
+                    configured = getattr(settings, 'CACHES', {}).get('default', {}).get('BACKEND', '')
+                    backend = 'redis' if 'redis' in configured.lower() else 'memory'
+                cls._instance = cls(RedisTrendingStore() if backend == 'redis' else LocalTrendingStore())
+            return cls._instance
+
+    def record_view(self, video_id, category=None, viewed_at=None):
+        moment = viewed_at.timestamp() if viewed_at is not None else time.time()
+        self.store.add(video_id, category, moment)
+
+    def top(self, limit=20, category=None, half_life=None):
+        """[(video_id, decayed score)] best first"""
+        variant = half_life or getattr(settings, 'TRENDING_DEFAULT_HALF_LIFE', '1d')
+        if variant not in half_lives():
+            raise ValueError(f'Unknown half-life variant {variant!r}')
+        return self.store.top(variant, category, limit, time.time())
+
+    def remove_video(self, video_id):
+        self.store.remove(video_id)
+
+    def rebase(self):
+        return self.store.rebase(time.time())
+
+    def rebuild(self, days=14, batch_size=10000):
+        """
+        Replay the last `days` days of views (cold start); returns the number replayed.
+
+        The views are replayed into a staging store that replaces the live
+        one when complete. Reads the analytics event log instead of
+        VideoView when ANALYTICS_SOURCE is 'events'.
+        """
+        from ..analytics.event_queries import EventQueries, use_events
+        from ..models import VideoView
+        from django.utils import timezone
+        from datetime import timedelta
+
+        def stored_views(**filters):
+            return VideoView.objects.filter(**filters).order_by('viewed_at').values_list(
+                'video_id', 'video__category', 'viewed_at'
+            ).iterator(chunk_size=batch_size)
+
+        staged = self.store.staging()
+        replayed, last = 0, None
+        try:
+            if use_events():
+                views = EventQueries.iter_views(days)
+            else:
+                views = stored_views(viewed_at__gte=timezone.now() - timedelta(days=days))
+            for video_id, category, viewed_at in views:
+                staged.add(video_id, category, viewed_at.timestamp())
+                replayed, last = replayed + 1, viewed_at
+
+            # Views stored while replaying went to the live store only
+            if not use_events() and last is not None:
+                for video_id, category, viewed_at in stored_views(viewed_at__gt=last):
+                    staged.add(video_id, category, viewed_at.timestamp())
+                    replayed += 1
+
+            staged.rebase(time.time())
+            self.store.replace_with(staged)
+        except Exception:
+            staged.clear()
+            raise
+        return replayed
+
+
+@shared_task(name='search.rebase_trending')
+def rebase_trending():
+    """Periodic epoch rebase (e.g. hourly with Celery beat)"""
+    return TrendingEngine.instance().rebase()
+
+
+@shared_task(name='search.rebuild_trending')
+def rebuild_trending(days=14):
+    """Rebuild trending scores from stored views"""
+    return TrendingEngine.instance().rebuild(days)
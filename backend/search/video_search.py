@@ -1,9 +1,18 @@
 # Video Search and Filter Service
 from django.db.models import Q, Count, Avg
-from rest_framework.decorators import api_view
+from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from .search_backends import get_search_backend
+from .result_cache import QueryResultCache
+from .search_log_sink import SearchLogSink
+from .search_stats import SearchStats
+from .trending import TrendingEngine, half_life_for_days, half_lives
+from ..analytics.event_log import emit
+from ..api.pagination import KeysetPagination
 
 class VideoSearchService:
     """Service for searching and filtering videos"""
@@ -16,16 +25,6 @@ class VideoSearchService:
         # Start with all videos
         queryset = Video.objects.all()
         
-        # Apply text search if query provided
-        if query:
-            # Use Q objects for complex search across multiple fields
-            queryset = queryset.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query) |
-                Q(tags__icontains=query) |
-                Q(category__icontains=query)
-            )
-        
         # Apply filters
         if filters:
             # Category filter
@@ -56,6 +55,12 @@ class VideoSearchService:
             if 'status' in filters and filters['status']:
                 queryset = queryset.filter(status=filters['status'])
         
+        # Apply indexed text search if query provided; matches are
+        # annotated with search_rank. Filters go first so a backend that
+        # caps its matches keeps the best ones that pass them.
+        if query:
+            queryset = get_search_backend().search(query, queryset)
+        
         return queryset
     
     @staticmethod
@@ -72,34 +77,39 @@ class VideoSearchService:
             'title_desc': '-title'
         }
         
+        # Relevance only exists for text searches (see search_backends)
+        if sort_by == 'relevance' and 'search_rank' in queryset.query.annotations:
+            return queryset.order_by('-search_rank', '-id')
+        
+        # id breaks ties so the order is total (required for keyset pagination)
         order_by = sort_options.get(sort_by, '-created_at')
-        return queryset.order_by(order_by)
+        return queryset.order_by(order_by, '-id' if order_by.startswith('-') else 'id')
     
     @staticmethod
     def get_popular_searches(limit=10):
-        """Get most popular search queries"""
-        from ..models import SearchLog
-        
-        popular = SearchLog.objects.values('query').annotate(
-            count=Count('id')
-        ).order_by('-count')[:limit]
-        
-        return [item['query'] for item in popular]
+        """
+        Get most popular search queries
+        Read from the pre-aggregated top-K snapshot (see search_stats)
+        """
+        return [item['query'] for item in SearchStats.top(limit)]
     
     @staticmethod
-    def get_trending_videos(days=7, limit=20):
-        """Get trending videos based on recent views"""
-        from ..models import Video, VideoView
-        from django.utils import timezone
-        from datetime import timedelta
+    def get_trending_videos(days=7, limit=20, category=None, half_life=None):
+        """
+        Get trending videos from time-decayed view scores (see trending)
+        Without half_life, the variant closest to a `days` window is used
+        """
+        from ..models import Video
         
-        cutoff_date = timezone.now() - timedelta(days=days)
+        ranked = TrendingEngine.instance().top(limit, category, half_life or half_life_for_days(days))
+        videos = Video.objects.in_bulk([video_id for video_id, _ in ranked])
         
-        trending = Video.objects.filter(
-            views__viewed_at__gte=cutoff_date
-        ).annotate(
-            recent_view_count=Count('views')
-        ).order_by('-recent_view_count')[:limit]
+        trending = []
+        for video_id, score in ranked:
+            video = videos.get(video_id)
+            if video is not None:
+                video.trending_score = score
+                trending.append(video)
         
         return trending
     
@@ -116,40 +126,57 @@ class VideoSearchService:
     
     @staticmethod
     def advanced_search(params):
-        """Advanced search with PostgreSQL full-text search"""
+        """
+        Advanced search with PostgreSQL full-text search
+        Matches and ranks against the stored, GIN-indexed search_vector column
+        (see search_backends) instead of building a tsvector per row per query
+        Uses the column's 'simple' config: no stemming and no stop words, so
+        'running' no longer matches 'run' (it did under the old 'english' config)
+        """
         from ..models import Video
+        from django.db.models import F
         
         query_text = params.get('query', '')
         
         if not query_text:
             return Video.objects.none()
         
-        # Create search vector
-        search_vector = SearchVector('title', weight='A') + \
-                       SearchVector('description', weight='B') + \
-                       SearchVector('tags', weight='C')
-        
-        # Create search query
-        search_query = SearchQuery(query_text)
+        # Same text search config as the stored vector
+        search_query = SearchQuery(query_text, config='simple')
         
         # Apply search and rank results
-        results = Video.objects.annotate(
-            search=search_vector,
-            rank=SearchRank(search_vector, search_query)
-        ).filter(search=search_query).order_by('-rank')
+        results = Video.objects.filter(
+            search_vector=search_query
+        ).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank')
         
         return results
     
     @staticmethod
     def log_search(user, query, result_count):
-        """Log search query for analytics"""
+        """
+        Log search query for analytics
+        Queued for a batched background write unless SEARCH_LOG_ASYNC is False
+        """
         from ..models import SearchLog
         
+        emit('search', None, user_id=user.id if user.is_authenticated else None, query=query,
+             result_count=result_count)
+        if getattr(settings, 'SEARCH_LOG_ASYNC', True):
+            SearchLogSink.instance().submit(
+                user.id if user.is_authenticated else None,
+                query,
+                result_count
+            )
+            return
+        
         SearchLog.objects.create(
             user=user if user.is_authenticated else None,
             query=query,
             result_count=result_count
         )
+        SearchStats.record_batch([query])
 
 class VideoPagination(PageNumberPagination):
     """Custom pagination for video results"""
@@ -178,60 +205,88 @@ def search_videos(request):
     # Remove None values
     filters = {k: v for k, v in filters.items() if v is not None}
     
-    # Search videos
-    videos = VideoSearchService.search_videos(query, filters)
-    
-    # Sort results
-    sort_by = request.GET.get('sort', 'newest')
-    videos = VideoSearchService.sort_videos(videos, sort_by)
+    # Sort results; text searches default to relevance
+    sort_by = request.GET.get('sort', 'relevance' if query else 'newest')
     
-    # Log search
-    VideoSearchService.log_search(request.user, query, videos.count())
+    def compute():
+        # Search videos
+        videos = VideoSearchService.search_videos(query, filters)
+        videos = VideoSearchService.sort_videos(videos, sort_by)
+        
+        # Paginate results: keyset cursors, or legacy page numbers with ?page=
+        paginator = VideoPagination() if 'page' in request.GET else KeysetPagination()
+        paginated_videos = paginator.paginate_queryset(videos, request)
+        
+        video_data = [{
+            'id': video.id,
+            'title': video.title,
+            'description': video.description,
+            'thumbnail': video.thumbnail_url,
+            'duration': video.duration,
+            'views': video.views,
+            'category': video.category,
+            'created_at': video.created_at.isoformat()
+        } for video in paginated_videos]
+        
+        return paginator.get_paginated_response(video_data).data
     
-    # Paginate results
-    paginator = VideoPagination()
-    paginated_videos = paginator.paginate_queryset(videos, request)
+    # Cached on every parameter that shapes the page
+    data = QueryResultCache.get_or_compute('search', dict(request.GET.items(), sort=sort_by), compute)
     
-    video_data = [{
-        'id': video.id,
-        'title': video.title,
-        'description': video.description,
-        'thumbnail': video.thumbnail_url,
-        'duration': video.duration,
-        'views': video.views,
-        'category': video.category,
-        'created_at': video.created_at.isoformat()
-    } for video in paginated_videos]
+    # Log search (count is null when the client passed count=false)
+    result_count = data['count'] if data['count'] is not None else len(data['results'])
+    VideoSearchService.log_search(request.user, query, result_count)
     
-    return paginator.get_paginated_response(video_data)
+    return Response(data)
 
 @api_view(['GET'])
 def get_categories(request):
     """Get all available categories"""
-    categories = VideoSearchService.get_category_suggestions()
-    return Response(list(categories))
+    categories = QueryResultCache.get_or_compute(
+        'categories', {},
+        lambda: list(VideoSearchService.get_category_suggestions())
+    )
+    return Response(categories)
 
 @api_view(['GET'])
 def get_trending(request):
-    """Get trending videos"""
+    """Get trending videos (?category= and ?half_life= select a ranking)"""
     days = int(request.GET.get('days', 7))
     limit = int(request.GET.get('limit', 20))
+    category = request.GET.get('category')
+    half_life = request.GET.get('half_life')
     
-    trending = VideoSearchService.get_trending_videos(days, limit)
+    if half_life and half_life not in half_lives():
+        return Response({'error': f'half_life must be one of {", ".join(half_lives())}'}, status=400)
     
-    trending_data = [{
-        'id': video.id,
-        'title': video.title,
-        'thumbnail': video.thumbnail_url,
-        'views': video.recent_view_count,
-        'category': video.category
-    } for video in trending]
+    def compute():
+        trending = VideoSearchService.get_trending_videos(days, limit, category, half_life)
+        
+        return [{
+            'id': video.id,
+            'title': video.title,
+            'thumbnail': video.thumbnail_url,
+            'views': video.views,
+            'trending_score': round(video.trending_score, 3),
+            'category': video.category
+        } for video in trending]
     
+    params = {'days': days, 'limit': limit, 'category': category, 'half_life': half_life}
+    trending_data = QueryResultCache.get_or_compute('trending', params, compute)
     return Response(trending_data)
 
 @api_view(['GET'])
 def popular_searches(request):
     """Get popular search queries"""
     limit = int(request.GET.get('limit', 10))
-    searches = VideoSearchService.get_popular_searches(limit)
+    searches = QueryResultCache.get_or_compute(
+        'popular_searches', {'limit': limit},
+        lambda: VideoSearchService.get_popular_searches(limit)
+    )
     return Response({'popular_searches': searches})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def search_log_stats(request):
+    """Get counters of the asynchronous search log pipeline"""
+    return Response(SearchLogSink.instance().stats())
@@ -8,7 +8,8 @@ from rest_framework.response import Response
 class AdaptiveBitrateService:
     """Service for handling adaptive bitrate streaming (HLS/DASH)"""
     
-    # Quality presets for adaptive streaming
+    # Quality presets for adaptive streaming; with PER_TITLE_LADDER enabled
+    # these are the ceiling that per-title selection trims and rescales
     QUALITY_PRESETS = [
         {'name': '1080p', 'width': 1920, 'height': 1080, 'bitrate': '5000k', 'audio_bitrate': '192k'},
         {'name': '720p', 'width': 1280, 'height': 720, 'bitrate': '2800k', 'audio_bitrate': '128k'},
@@ -139,6 +140,21 @@ class AdaptiveBitrateService:
             return {'success': True, 'thumbnail_dir': output_dir}
         except subprocess.CalledProcessError as e:
             return {'success': False, 'error': str(e)}
+    
+    @staticmethod
+    def transcode_ladder(input_file, output_dir, presets=None, source_info=None,
+                         progress=None, should_cancel=None):
+        """Decode once and produce HLS, DASH and thumbnails from shared CMAF segments"""
+        from .transcoder import LadderTranscoder, CHUNKED_MIN_DURATION
+        
+        transcoder = LadderTranscoder(
+            presets or AdaptiveBitrateService.QUALITY_PRESETS,
+            workers=getattr(settings, 'TRANSCODE_WORKERS', None),
+            chunked_min_duration=getattr(settings, 'TRANSCODE_CHUNKED_MIN_DURATION', CHUNKED_MIN_DURATION),
+            progress=progress,
+            should_cancel=should_cancel
+        )
+        return transcoder.transcode(input_file, output_dir, source_info=source_info)
 
 class CDNService:
     """Service for CDN integration and caching"""
@@ -204,48 +220,66 @@ class CDNService:
 # API Views
 @api_view(['POST'])
 def process_video_streaming(request):
-    """Process video for adaptive streaming"""
+    """
+    Queue a video for adaptive streaming processing
+    Returns 202 with the job id; poll /api/streaming/jobs/{job_id}/ for progress
+    One transcode produces both HLS and DASH (shared CMAF segments), so
+    there is no format to choose
+    """
     video_id = request.data.get('video_id')
-    format_type = request.data.get('format', 'hls')  # hls or dash
     
     from ..models import Video
+    from .jobs import TranscodeJobQueue
     
-    try:
-        video = Video.objects.get(id=video_id)
-        input_file = video.file_path
-        output_dir = os.path.join(settings.MEDIA_ROOT, 'streaming', str(video.id))
-        
-        if format_type == 'hls':
-            result = AdaptiveBitrateService.transcode_to_hls(input_file, output_dir)
-        elif format_type == 'dash':
-            result = AdaptiveBitrateService.transcode_to_dash(input_file, output_dir)
-        else:
-            return Response({'error': 'Invalid format type'}, status=400)
-        
-        if result['success']:
-            # Generate thumbnails
-            thumb_dir = os.path.join(output_dir, 'thumbnails')
-            AdaptiveBitrateService.generate_thumbnails(input_file, thumb_dir)
-            
-            # Update video with streaming URLs
-            video.hls_url = CDNService.get_cdn_url(result.get('master_playlist', ''))
-            video.dash_url = CDNService.get_cdn_url(result.get('manifest', ''))
-            video.save()
-            
-            return Response({
-                'message': 'Video processed successfully',
-                'streaming_urls': {
-                    'hls': video.hls_url,
-                    'dash': video.dash_url
-                }
-            })
-        else:
-            return Response({'error': result.get('error')}, status=500)
-    
-    except Video.DoesNotExist:
+    if not Video.objects.filter(id=video_id).exists():
         return Response({'error': 'Video not found'}, status=404)
-    except Exception as e:
-        return Response({'error': str(e)}, status=500)
+    
+    job, created = TranscodeJobQueue.submit(video_id)
+    if not created:
+        return Response({
+            'error': 'Video is already being processed',
+            'job': job
+        }, status=409)
+    
+    return Response({'message': 'Video queued for processing', 'job': job}, status=202)
+
+@api_view(['GET'])
+def transcode_job_status(request, job_id):
+    """Get status and progress of a transcoding job"""
+    from .jobs import TranscodeJobQueue
+    
+    job = TranscodeJobQueue.get(job_id)
+    if not job:
+        return Response({'error': 'Job not found'}, status=404)
+    return Response(job)
+
+@api_view(['POST'])
+def cancel_transcode_job(request, job_id):
+    """Cancel a queued or running transcoding job"""
+    from .jobs import TranscodeJobQueue
+    
+    job = TranscodeJobQueue.cancel(job_id)
+    if not job:
+        return Response({'error': 'Job not found'}, status=404)
+    return Response(job)
+
+@api_view(['GET'])
+def ladder_decisions(request, video_id):
+    """Get the per-title ladder decisions recorded for a video"""
+    from ..models import LadderDecision
+    
+    decisions = LadderDecision.objects.filter(video_id=video_id)
+    return Response([{
+        'source': {
+            'width': d.source_width,
+            'height': d.source_height,
+            'fps': d.source_fps,
+            'duration': d.source_duration
+        },
+        'complexity': d.complexity,
+        'ladder': d.ladder,
+        'created_at': d.created_at.isoformat()
+    } for d in decisions])
 
 @api_view(['POST'])
 def purge_video_cache(request):
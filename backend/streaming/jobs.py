@@ -0,0 +1,286 @@
+# Asynchronous transcoding jobs
+#
+# process_video_streaming used to run ffmpeg inside the request, tying up a
+# web worker for the whole transcode. Jobs are now submitted to a bounded
+# pool (Celery when TRANSCODE_QUEUE_BACKEND = 'celery', otherwise an
+# in-process thread pool) and their state lives in the Django cache so any
+# web worker can report progress or request cancellation.
+#
+# One transcode per video: submit() takes a per-video lock holding the job
+# id. Whoever claims the job (the worker that runs it, or cancel() if it
+# gets there first) is the only one that releases the lock, so a second
+# transcode can never start into the same output directory while the first
+# is still starting or running. A running worker keeps refreshing the lock,
+# so LOCK_TTL only bounds how long a crashed worker can block the video.
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+# Job records are kept for a week after their last update
+JOB_TTL = 7 * 24 * 3600
+
+# Upper bound on how long a per-video lock can outlive a crashed worker
+LOCK_TTL = 15 * 60
+
+# Seconds between lock refreshes while a job runs
+LOCK_REFRESH_INTERVAL = 60
+
+# Minimum seconds between progress writes to the cache
+PROGRESS_INTERVAL = 1.0
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+
+def _job_key(job_id):
+    return f'transcode:job:{job_id}'
+
+
+def _cancel_key(job_id):
+    return f'transcode:job:{job_id}:cancel'
+
+
+def _claim_key(job_id):
+    return f'transcode:job:{job_id}:claim'
+
+
+def _video_lock_key(video_id):
+    return f'transcode:video:{video_id}'
+
+
+# SET the key to ARGV[2] only while it still holds ARGV[1]; a missing key
+# counts as free
+_REPLACE_LOCK_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def _replace_lock(lock_key, expected, job_id):
+    """Point lock_key at job_id if it still holds `expected` (or has expired); True on success"""
+    configured = getattr(settings, 'CACHES', {}).get('default', {}).get('BACKEND', '')
+    if 'django_redis' in configured:
+        from django_redis import get_redis_connection
+
+        # Compare the serialized values, as the cache API stores them
+        script = get_redis_connection('default').register_script(_REPLACE_LOCK_SCRIPT)
+        return bool(script(keys=[cache.make_key(lock_key)],
+                           args=[cache.client.encode(expected), cache.client.encode(job_id), LOCK_TTL]))
+
+    # No server-side compare-and-set: serialize replacements behind a short
+    # guard key and re-check the holder under it
+    guard_key = f'{lock_key}:replace'
+    if not cache.add(guard_key, job_id, 30):
+        return False
+    try:
+        current = cache.get(lock_key)
+        if current is not None and current != expected:
+            return False
+        cache.set(lock_key, job_id, LOCK_TTL)
+        return True
+    finally:
+        cache.delete(guard_key)
+
+
+class TranscodeJobQueue:
+    """Submit, track and cancel AdaptiveBitrateService transcodes"""
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @staticmethod
+    def submit(video_id):
+        """
+        Queue a transcode for video_id and return (job, created).
+
+        If the video already has a job in flight that job is returned with
+        created=False instead of starting a second transcode.
+        """
+        job_id = uuid.uuid4().hex
+        lock_key = _video_lock_key(video_id)
+        if not cache.add(lock_key, job_id, LOCK_TTL):
+            existing = TranscodeJobQueue.get(cache.get(lock_key))
+            if existing and existing['status'] not in FINISHED_STATUSES:
+                return existing, False
+            # Stale lock left by a job that already finished. Replace it only
+            # while it still holds that job's id, so a submitter that already
+            # took it over is never overwritten
+            if not _replace_lock(lock_key, existing['id'] if existing else cache.get(lock_key), job_id):
+                return TranscodeJobQueue.get(cache.get(lock_key)), False
+
+        job = {
+            'id': job_id,
+            'video_id': video_id,
+            'status': STATUS_QUEUED,
+            'progress': 0.0,
+            'error': None,
+            'result': None,
+            'created_at': time.time(),
+            'updated_at': time.time(),
+        }
+        cache.set(_job_key(job_id), job, JOB_TTL)
+
+        if getattr(settings, 'TRANSCODE_QUEUE_BACKEND', 'local') == 'celery':
+            transcode_task.apply_async(args=[job_id], task_id=job_id)
+        else:
+            TranscodeJobQueue._get_executor().submit(run_transcode_job, job_id)
+
+        return job, True
+
+    @staticmethod
+    def get(job_id):
+        """Return the job record, or None if it is unknown or expired"""
+        if not job_id:
+            return None
+        return cache.get(_job_key(job_id))
+
+    @staticmethod
+    def cancel(job_id):
+        """Request cancellation; returns the job record or None if unknown"""
+        job = TranscodeJobQueue.get(job_id)
+        if not job or job['status'] in FINISHED_STATUSES:
+            return job
+
+        cache.set(_cancel_key(job_id), True, JOB_TTL)
+        if job['status'] == STATUS_QUEUED and cache.add(_claim_key(job_id), 'cancel', JOB_TTL):
+            # No worker claimed it and none ever will: finish it here
+            if getattr(settings, 'TRANSCODE_QUEUE_BACKEND', 'local') == 'celery':
+                transcode_task.AsyncResult(job_id).revoke()
+            job = TranscodeJobQueue._finish(job, STATUS_CANCELLED)
+        # Otherwise the worker that claimed it stops and releases the lock
+        return job
+
+    @staticmethod
+    def is_cancelled(job_id):
+        return bool(cache.get(_cancel_key(job_id)))
+
+    @staticmethod
+    def _update(job, **fields):
+        job.update(fields, updated_at=time.time())
+        cache.set(_job_key(job['id']), job, JOB_TTL)
+        return job
+
+    @staticmethod
+    def _finish(job, status, **fields):
+        """Record the final status and release the video lock; only the job's claimant calls this"""
+        job = TranscodeJobQueue._update(job, status=status, **fields)
+        lock_key = _video_lock_key(job['video_id'])
+        if cache.get(lock_key) == job['id']:
+            cache.delete(lock_key)
+        return job
+
+    @staticmethod
+    def _hold_lock(job, stop):
+        """Refresh the video lock every LOCK_REFRESH_INTERVAL seconds until `stop` is set"""
+        lock_key = _video_lock_key(job['video_id'])
+        while not stop.wait(LOCK_REFRESH_INTERVAL):
+            if cache.get(lock_key) == job['id']:
+                cache.touch(lock_key, LOCK_TTL)
+
+    @staticmethod
+    def _get_executor():
+        with TranscodeJobQueue._executor_lock:
+            if TranscodeJobQueue._executor is None:
+                TranscodeJobQueue._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'TRANSCODE_MAX_CONCURRENT_JOBS', 2),
+                    thread_name_prefix='transcode'
+                )
+            return TranscodeJobQueue._executor
+
+
+def run_transcode_job(job_id):
+    """Run one queued job to completion (called by the pool or Celery)"""
+    job = TranscodeJobQueue.get(job_id)
+    if not job or job['status'] != STATUS_QUEUED:
+        return job
+    # Cancelled before it started, or delivered twice
+    if not cache.add(_claim_key(job_id), 'worker', JOB_TTL):
+        return job
+    if TranscodeJobQueue.is_cancelled(job_id):
+        return TranscodeJobQueue._finish(job, STATUS_CANCELLED)
+    # The lock is not refreshed while queued; if it expired, a newer job may own the video
+    lock_key = _video_lock_key(job['video_id'])
+    if cache.get(lock_key) != job_id and not cache.add(lock_key, job_id, LOCK_TTL):
+        return TranscodeJobQueue._finish(job, STATUS_CANCELLED, error='Superseded by a newer job')
+
+    job = TranscodeJobQueue._update(job, status=STATUS_RUNNING, started_at=time.time())
+    stop_refresh = threading.Event()
+    threading.Thread(target=TranscodeJobQueue._hold_lock, args=(dict(job), stop_refresh),
+                     name=f'transcode-lock-{job_id}', daemon=True).start()
+    try:
+        return _run_claimed_job(job)
+    finally:
+        stop_refresh.set()
+
+
+def _run_claimed_job(job):
+    """Transcode a job this process has claimed; returns the finished record"""
+    from ..models import Video
+    from ..api.content_store import ContentStore
+    from .cdn_adaptive import AdaptiveBitrateService, CDNService
+    from .ladder import PerTitleLadder
+    from .transcoder import TranscodeCancelled
+
+    job_id = job['id']
+    last_report = [0.0]
+
+    def report(fraction):
+        now = time.time()
+        if now - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = now
+            TranscodeJobQueue._update(job, progress=round(fraction * 100, 1))
+
+    try:
+        video = Video.objects.get(id=job['video_id'])
+        output_dir = os.path.join(settings.MEDIA_ROOT, 'streaming', str(video.id))
+
+        presets, source_info = AdaptiveBitrateService.QUALITY_PRESETS, None
+        if getattr(settings, 'PER_TITLE_LADDER', True):
+            presets, source_info = PerTitleLadder.select(video, video.file_path, presets)
+
+        result = AdaptiveBitrateService.transcode_ladder(
+            video.file_path,
+            output_dir,
+            presets=presets,
+            source_info=source_info,
+            progress=report,
+            should_cancel=lambda: TranscodeJobQueue.is_cancelled(job_id)
+        )
+        if not result['success']:
+            return TranscodeJobQueue._finish(job, STATUS_FAILED, error=result.get('error'))
+
+        video.hls_url = CDNService.get_cdn_url(result['master_playlist'])
+        video.dash_url = CDNService.get_cdn_url(result['manifest'])
+        video.save()
+        # Re-uploads of the same bytes share these renditions
+        ContentStore.mark_transcoded(video, video.hls_url, video.dash_url)
+
+        return TranscodeJobQueue._finish(job, STATUS_SUCCEEDED, progress=100.0, result={
+            'hls': video.hls_url,
+            'dash': video.dash_url,
+        })
+    except TranscodeCancelled:
+        return TranscodeJobQueue._finish(job, STATUS_CANCELLED)
+    except Exception as e:
+        return TranscodeJobQueue._finish(job, STATUS_FAILED, error=str(e))
+
+
+@shared_task(name='streaming.transcode_video')
+def transcode_task(job_id):
+    """Celery entry point for a queued transcode"""
+    job = run_transcode_job(job_id)
+    return job['status'] if job else None
@@ -0,0 +1,136 @@
+# Content-aware (per-title) bitrate ladder selection
+#
+# The fixed QUALITY_PRESETS ladder upscales low-resolution sources and gives
+# static content (slides, screen recordings) the same bitrate as sport. Before
+# transcoding, the source is probed and a handful of short windows are
+# encoded at low resolution with a constant quality target; the resulting
+# bitrate is a cheap proxy for how hard the content is to compress. Rungs
+# above the source resolution are dropped and the remaining bitrates are
+# scaled by that complexity factor.
+import os
+import subprocess
+import tempfile
+from .transcoder import probe_source, _bitrate_kbps, _run_ffmpeg
+
+# Analysis pass: ANALYSIS_WINDOWS samples of ANALYSIS_WINDOW_SECONDS each,
+# encoded at ANALYSIS_HEIGHT with a fixed CRF
+ANALYSIS_WINDOWS = 5
+ANALYSIS_WINDOW_SECONDS = 4
+ANALYSIS_HEIGHT = 144
+ANALYSIS_CRF = 26
+
+# Bitrate (kbps) the analysis encode produces for typical live-action content;
+# the complexity factor is the measured bitrate relative to this
+REFERENCE_ANALYSIS_KBPS = 120.0
+
+# Bounds on how far per-title bitrates may move from the preset ladder
+MIN_COMPLEXITY = 0.35
+MAX_COMPLEXITY = 1.5
+
+# High frame rate sources need more bits for the same quality
+HIGH_FPS_THRESHOLD = 40
+HIGH_FPS_FACTOR = 1.4
+
+# Never encode a rung below this video bitrate (kbps)
+MIN_RUNG_KBPS = 150
+
+
+def _window_starts(duration):
+    """Evenly spaced analysis window start times, skipping intros and credits"""
+    if duration <= ANALYSIS_WINDOW_SECONDS * ANALYSIS_WINDOWS:
+        return [0.0]
+    span = duration * 0.9
+    step = span / ANALYSIS_WINDOWS
+    return [duration * 0.05 + step * i for i in range(ANALYSIS_WINDOWS)]
+
+
+class PerTitleLadder:
+    """Probe a source and derive its bitrate ladder"""
+
+    @staticmethod
+    def analyze_complexity(input_file, source_info):
+        """
+        Encode short low-res windows at constant quality and return the
+        complexity factor (1.0 = typical content).
+        """
+        total_bytes = 0
+        total_seconds = 0.0
+
+        with tempfile.TemporaryDirectory(prefix='ladder_probe_') as work_dir:
+            for index, start in enumerate(_window_starts(source_info['duration'])):
+                output = os.path.join(work_dir, f'window_{index}.mkv')
+                try:
+                    _run_ffmpeg([
+                        'ffmpeg', '-y',
+                        '-ss', f'{start:.2f}',
+                        '-i', input_file,
+                        '-t', str(ANALYSIS_WINDOW_SECONDS),
+                        '-an',
+                        '-vf', f'scale=-2:{ANALYSIS_HEIGHT}',
+                        '-c:v', 'libx264',
+                        '-preset', 'ultrafast',
+                        '-crf', str(ANALYSIS_CRF),
+                        output
+                    ])
+                except subprocess.CalledProcessError:
+                    continue
+                if os.path.exists(output):
+                    total_bytes += os.path.getsize(output)
+                    total_seconds += min(ANALYSIS_WINDOW_SECONDS, source_info['duration'] - start)
+
+        if not total_seconds:
+            return 1.0
+
+        measured_kbps = total_bytes * 8 / 1000 / total_seconds
+        # Normalise for frame rate here so it is not counted twice
+        if source_info['fps'] > HIGH_FPS_THRESHOLD:
+            measured_kbps /= HIGH_FPS_FACTOR
+        factor = measured_kbps / REFERENCE_ANALYSIS_KBPS
+        return round(min(max(factor, MIN_COMPLEXITY), MAX_COMPLEXITY), 3)
+
+    @staticmethod
+    def build_ladder(source_info, complexity, presets):
+        """
+        Drop rungs above the source resolution and scale bitrates.
+
+        At least the lowest rung is always kept so every source is playable.
+        """
+        source_height = source_info['height']
+        rungs = [p for p in presets if not source_height or p['height'] <= source_height]
+        if not rungs:
+            rungs = [min(presets, key=lambda p: p['height'])]
+
+        factor = complexity
+        if source_info['fps'] > HIGH_FPS_THRESHOLD:
+            factor *= HIGH_FPS_FACTOR
+
+        ladder = []
+        for preset in rungs:
+            kbps = max(MIN_RUNG_KBPS, int(round(_bitrate_kbps(preset['bitrate']) * factor / 50.0)) * 50)
+            ladder.append(dict(preset, bitrate=f'{kbps}k'))
+        return ladder
+
+    @staticmethod
+    def select(video, input_file, presets):
+        """
+        Probe, analyse and record the ladder for a video.
+
+        Returns (ladder, source_info); the decision is stored as a
+        LadderDecision row so it can be queried later.
+        """
+        from ..models import LadderDecision
+
+        source_info = probe_source(input_file)
+        complexity = PerTitleLadder.analyze_complexity(input_file, source_info)
+        ladder = PerTitleLadder.build_ladder(source_info, complexity, presets)
+
+        LadderDecision.objects.create(
+            video=video,
+            source_width=source_info['width'],
+            source_height=source_info['height'],
+            source_fps=source_info['fps'],
+            source_duration=source_info['duration'],
+            complexity=complexity,
+            ladder=ladder
+        )
+        return ladder, source_info
@@ -0,0 +1,380 @@
+# Single-pass ladder transcoding engine
+#
+# One ffmpeg decode feeds every rung of the ladder plus the thumbnail track.
+# Renditions are written once as CMAF (fragmented MP4) segments and shared by
+# the DASH manifest and the HLS playlists, so HLS and DASH no longer need
+# separate transcodes. Long sources are split at GOP boundaries and the
+# chunks are encoded in parallel on a process pool, then stitched back
+# together and packaged without re-encoding. Chunks start wherever the
+# source had a keyframe, so each chunk is encoded knowing its offset in the
+# source: forced keyframes and thumbnails stay on the same global grid as a
+# single-pass encode.
+import csv
+import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Target segment length (seconds) shared by HLS and DASH
+SEGMENT_DURATION = 6
+
+# Sources at least this long (seconds) are encoded in parallel chunks
+CHUNKED_MIN_DURATION = 600
+
+# Approximate chunk length (seconds); actual cuts land on the next keyframe
+CHUNK_DURATION = 120
+
+
+class TranscodeCancelled(Exception):
+    """Raised when a running transcode is cancelled"""
+
+
+def _run_ffmpeg(cmd):
+    """Run an ffmpeg/ffprobe command, raising CalledProcessError on failure"""
+    return subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+
+def parse_progress_line(line):
+    """
+    Parse one ``key=value`` line of ffmpeg ``-progress`` output.
+
+    Returns the encoded position in seconds for ``out_time_us``/``out_time_ms``
+    lines (both are microseconds), True for ``progress=end`` and None otherwise.
+    """
+    key, _, value = line.strip().partition('=')
+    if key in ('out_time_us', 'out_time_ms'):
+        try:
+            return int(value) / 1000000
+        except ValueError:
+            return None
+    if key == 'progress' and value == 'end':
+        return True
+    return None
+
+
+def _bitrate_kbps(bitrate):
+    """'2800k' -> 2800"""
+    return int(str(bitrate).rstrip('kK'))
+
+
+def probe_source(input_file):
+    """Read duration, dimensions, frame rate and audio presence with ffprobe"""
+    result = _run_ffmpeg([
+        'ffprobe',
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        input_file
+    ])
+    info = json.loads(result.stdout)
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+
+    fps = 0.0
+    rate = video.get('avg_frame_rate') or video.get('r_frame_rate') or '0/1'
+    num, _, den = rate.partition('/')
+    if den and float(den):
+        fps = float(num) / float(den)
+
+    return {
+        'duration': float(info.get('format', {}).get('duration') or 0),
+        'width': int(video.get('width') or 0),
+        'height': int(video.get('height') or 0),
+        'fps': fps,
+        'has_audio': any(s.get('codec_type') == 'audio' for s in streams),
+    }
+
+
+class LadderTranscoder:
+    """Decode once, encode the whole ladder, package HLS + DASH from CMAF"""
+
+    def __init__(self, presets, segment_duration=SEGMENT_DURATION, thumbnail_interval=10,
+                 workers=None, chunk_duration=CHUNK_DURATION,
+                 chunked_min_duration=CHUNKED_MIN_DURATION, progress=None, should_cancel=None):
+        self.presets = list(presets)
+        self.segment_duration = segment_duration
+        self.thumbnail_interval = thumbnail_interval
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_duration = chunk_duration
+        self.chunked_min_duration = chunked_min_duration
+        # progress(fraction) is called as work completes; should_cancel() is
+        # polled while ffmpeg runs and aborts the job when it returns True
+        self.progress = progress
+        self.should_cancel = should_cancel
+
+    def transcode(self, input_file, output_dir, source_info=None):
+        """
+        Produce master.m3u8, manifest.mpd and thumbnails for input_file.
+
+        Returns the same result dict shape as AdaptiveBitrateService:
+        {'success': True, 'master_playlist': ..., 'manifest': ..., 'thumbnail_dir': ...}
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        thumb_dir = os.path.join(output_dir, 'thumbnails')
+        os.makedirs(thumb_dir, exist_ok=True)
+
+        try:
+            source_info = source_info or probe_source(input_file)
+            if self.workers > 1 and source_info['duration'] >= self.chunked_min_duration:
+                mode = 'chunked'
+                self._transcode_chunked(input_file, output_dir, thumb_dir, source_info)
+            else:
+                mode = 'single_pass'
+                self._run(self._single_pass_command(input_file, output_dir, thumb_dir, source_info),
+                          duration=source_info['duration'])
+        except subprocess.CalledProcessError as e:
+            return {'success': False, 'error': e.stderr or str(e)}
+
+        return {
+            'success': True,
+            'mode': mode,
+            'master_playlist': os.path.join(output_dir, 'master.m3u8'),
+            'manifest': os.path.join(output_dir, 'manifest.mpd'),
+            'thumbnail_dir': thumb_dir,
+        }
+
+    def _run(self, cmd, duration=None):
+        """Run ffmpeg, reporting -progress output and honouring cancellation"""
+        if not (self.progress or self.should_cancel) or cmd[0] != 'ffmpeg':
+            return _run_ffmpeg(cmd)
+
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+        with tempfile.TemporaryFile(mode='w+') as stderr:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            try:
+                for line in process.stdout:
+                    if self.should_cancel and self.should_cancel():
+                        process.kill()
+                        raise TranscodeCancelled()
+                    position = parse_progress_line(line)
+                    if position is True:
+                        self._report(1.0)
+                    elif position is not None and duration:
+                        self._report(min(position / duration, 1.0))
+                returncode = process.wait()
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+            if returncode != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+
+    def _report(self, fraction):
+        if self.progress:
+            self.progress(fraction)
+
+    # Command builders
+
+    def _keyframe_args(self, offset=0.0):
+        """
+        Closed, aligned GOPs on segment boundaries so every rung switches cleanly.
+
+        offset is where the input starts in the source (chunked mode); the
+        boundaries stay multiples of segment_duration of source time.
+        """
+        # Index of the first boundary at or after offset
+        first = math.ceil(offset / self.segment_duration - 1e-6)
+        return [
+            '-force_key_frames',
+            f'expr:gte(t,(n_forced+{first})*{self.segment_duration}-{offset:.6f})',
+            '-sc_threshold', '0',
+        ]
+
+    def _filter_graph(self, with_thumbnails=True, offset=None):
+        """
+        split the decoded video once into every rung (and the thumbnail track).
+
+        With an offset (chunked mode) the thumbnail track is shifted to source
+        time, so its frames are numbered by their global thumbnail index.
+        """
+        outputs = len(self.presets) + (1 if with_thumbnails else 0)
+        labels = ''.join(f'[s{i}]' for i in range(outputs))
+        graph = [f'[0:v]split={outputs}{labels}']
+        for i, preset in enumerate(self.presets):
+            graph.append(f'[s{i}]scale=w={preset["width"]}:h={preset["height"]}[v{i}]')
+        if with_thumbnails:
+            if offset is None:
+                thumbs = f'fps=1/{self.thumbnail_interval}'
+            else:
+                # round=down: a chunk's first frame takes the grid point just
+                # before it, so no thumbnail falls between two chunks
+                thumbs = f'setpts=PTS+{offset:.6f}/TB,fps=1/{self.thumbnail_interval}:round=down'
+            graph.append(f'[s{len(self.presets)}]{thumbs},scale=160:90[thumbs]')
+        return ';'.join(graph)
+
+    def _video_encode_args(self):
+        args = []
+        for i, preset in enumerate(self.presets):
+            args.extend([
+                '-map', f'[v{i}]',
+                f'-c:v:{i}', 'libx264',
+                f'-b:v:{i}', preset['bitrate'],
+                f'-maxrate:v:{i}', preset['bitrate'],
+                f'-bufsize:v:{i}', f'{_bitrate_kbps(preset["bitrate"]) * 2}k',
+            ])
+        return args + self._keyframe_args()
+
+    def _audio_bitrate(self):
+        return max((p['audio_bitrate'] for p in self.presets), key=_bitrate_kbps)
+
+    def _package_args(self, output_dir, has_audio):
+        """CMAF packaging: one set of fMP4 segments, DASH manifest + HLS playlists"""
+        adaptation_sets = 'id=0,streams=v id=1,streams=a' if has_audio else 'id=0,streams=v'
+        return [
+            '-f', 'dash',
+            '-seg_duration', str(self.segment_duration),
+            '-use_template', '1',
+            '-use_timeline', '1',
+            '-adaptation_sets', adaptation_sets,
+            '-hls_playlist', '1',
+            '-hls_master_name', 'master.m3u8',
+            '-init_seg_name', 'init_$RepresentationID$.m4s',
+            '-media_seg_name', 'chunk_$RepresentationID$_$Number%05d$.m4s',
+            os.path.join(output_dir, 'manifest.mpd')
+        ]
+
+    def _thumbnail_output_args(self, thumb_dir, pattern='thumb_%04d.jpg', frame_pts=False):
+        # frame_pts: number files by timestamp, which the fps filter makes the thumbnail index
+        args = ['-map', '[thumbs]', '-q:v', '5']
+        if frame_pts:
+            args.extend(['-frame_pts', '1'])
+        return args + [os.path.join(thumb_dir, pattern)]
+
+    def _single_pass_command(self, input_file, output_dir, thumb_dir, source_info):
+        cmd = ['ffmpeg', '-y', '-i', input_file, '-filter_complex', self._filter_graph()]
+        cmd.extend(self._video_encode_args())
+        if source_info['has_audio']:
+            cmd.extend(['-map', '0:a:0', '-c:a', 'aac', '-b:a', self._audio_bitrate()])
+        cmd.extend(self._package_args(output_dir, source_info['has_audio']))
+        cmd.extend(self._thumbnail_output_args(thumb_dir))
+        return cmd
+
+    # Chunked parallel mode
+
+    def _transcode_chunked(self, input_file, output_dir, thumb_dir, source_info):
+        work_dir = tempfile.mkdtemp(prefix='ladder_', dir=output_dir)
+        try:
+            chunks = self._split_chunks(input_file, work_dir)
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+
+            audio_path = os.path.join(work_dir, 'audio.m4a') if source_info['has_audio'] else None
+
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                audio_future = None
+                if audio_path:
+                    audio_future = pool.submit(_run_ffmpeg, [
+                        'ffmpeg', '-y', '-i', input_file, '-map', '0:a:0', '-vn',
+                        '-c:a', 'aac', '-b:a', self._audio_bitrate(), audio_path
+                    ])
+                pending = {
+                    pool.submit(_run_ffmpeg, self._chunk_command(chunk, offset, index, work_dir, threads))
+                    for index, (chunk, offset) in enumerate(chunks)
+                }
+                total = len(pending)
+                while pending:
+                    done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    if self.should_cancel and self.should_cancel():
+                        # Chunks already on a worker finish; queued ones never start
+                        for future in pending:
+                            future.cancel()
+                        raise TranscodeCancelled()
+                    self._report((total - len(pending)) / total * 0.95)
+                if audio_future:
+                    audio_future.result()
+
+            renditions = [
+                self._concat_rendition(work_dir, rung, len(chunks))
+                for rung in range(len(self.presets))
+            ]
+            self._package(renditions, audio_path, output_dir, source_info['has_audio'])
+            self._collect_thumbnails(work_dir, thumb_dir, len(chunks))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _split_chunks(self, input_file, work_dir):
+        """
+        Stream-copy the video into chunks; the segment muxer cuts on keyframes.
+
+        Returns [(path, start offset in seconds)], in order.
+        """
+        list_path = os.path.join(work_dir, 'chunks.csv')
+        self._run([
+            'ffmpeg', '-y', '-i', input_file,
+            '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', str(self.chunk_duration),
+            '-segment_list', list_path,
+            '-segment_list_type', 'csv',
+            '-reset_timestamps', '1',
+            os.path.join(work_dir, 'source_%05d.mkv')
+        ])
+        with open(list_path, newline='') as f:
+            # Rows are: file name, start time, end time
+            return [(os.path.join(work_dir, os.path.basename(row[0])), float(row[1]))
+                    for row in csv.reader(f) if row]
+
+    def _chunk_command(self, chunk, offset, index, work_dir, threads):
+        """Encode every rung of one chunk (plus its thumbnails) from one decode"""
+        cmd = ['ffmpeg', '-y', '-i', chunk, '-filter_complex', self._filter_graph(offset=offset),
+               '-threads', str(threads)]
+        for i, preset in enumerate(self.presets):
+            cmd.extend([
+                '-map', f'[v{i}]',
+                '-c:v', 'libx264',
+                '-b:v', preset['bitrate'],
+                '-maxrate', preset['bitrate'],
+                '-bufsize', f'{_bitrate_kbps(preset["bitrate"]) * 2}k',
+            ])
+            cmd.extend(self._keyframe_args(offset))
+            cmd.append(os.path.join(work_dir, f'rung{i}_{index:05d}.mp4'))
+        cmd.extend(self._thumbnail_output_args(work_dir, f'thumb_{index:05d}_%d.jpg', frame_pts=True))
+        return cmd
+
+    def _concat_rendition(self, work_dir, rung, chunk_count):
+        """Stitch one rung's chunks back together without re-encoding"""
+        list_path = os.path.join(work_dir, f'rung{rung}.txt')
+        with open(list_path, 'w') as f:
+            for index in range(chunk_count):
+                f.write(f"file '{os.path.join(work_dir, f'rung{rung}_{index:05d}.mp4')}'\n")
+
+        output = os.path.join(work_dir, f'rung{rung}.mp4')
+        self._run(['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', output])
+        return output
+
+    def _package(self, renditions, audio_path, output_dir, has_audio):
+        cmd = ['ffmpeg', '-y']
+        for path in renditions:
+            cmd.extend(['-i', path])
+        if audio_path:
+            cmd.extend(['-i', audio_path])
+        for i in range(len(renditions)):
+            cmd.extend(['-map', f'{i}:v:0'])
+        if audio_path:
+            cmd.extend(['-map', f'{len(renditions)}:a:0'])
+        cmd.extend(['-c', 'copy'])
+        cmd.extend(self._package_args(output_dir, has_audio))
+        self._run(cmd)
+
+    def _collect_thumbnails(self, work_dir, thumb_dir, chunk_count):
+        """
+        Move per-chunk thumbnails into place by their global index.
+
+        Thumbnail n (1-based, as in single-pass mode) shows source time
+        (n - 1) * thumbnail_interval. Where two chunks both produced an
+        index, the earlier chunk's frame wins.
+        """
+        for index in range(chunk_count):
+            prefix = os.path.join(work_dir, f'thumb_{index:05d}_')
+            for path in glob.glob(f'{prefix}*.jpg'):
+                target = os.path.join(thumb_dir, f'thumb_{int(path[len(prefix):-4]) + 1:04d}.jpg')
+                if not os.path.exists(target):
+                    shutil.move(path, target)
@@ -0,0 +1,29 @@
+import os
+import sys
+import django
+from django.conf import settings
+
+# Modules import each other as the `backend` package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def pytest_configure():
+    if settings.configured:
+        return
+    settings.configure(
+        SECRET_KEY='tests',
+        USE_TZ=True,
+        TIME_ZONE='UTC',
+        DATABASES={
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+        },
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'rest_framework',
+        ],
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        },
+    )
+    django.setup()
@@ -0,0 +1,82 @@
+import random
+import pytest
+
+from backend.search.autocomplete import QUERY, TAG, TITLE, Catalog, PrefixIndex, normalize, weigh
+
+
+def index_of(*entries):
+    return PrefixIndex({normalize(text): (text, kind, weight) for text, kind, weight in entries})
+
+
+def best(index, prefix, limit=None):
+    displays = [index.displays[entry_id] for entry_id in index.iter_best(normalize(prefix))]
+    return displays[:limit] if limit else displays
+
+
+def test_empty_index():
+    index = PrefixIndex({})
+    assert len(index) == 0
+    assert list(index.iter_best('a')) == []
+
+
+def test_best_first():
+    index = index_of(('matrix', QUERY, 3.0), ('matrix reloaded', TITLE, 5.0), ('mat', TAG, 1.0),
+                     ('music', QUERY, 9.0))
+    assert best(index, 'mat') == ['matrix reloaded', 'matrix', 'mat']
+    assert best(index, 'm') == ['music', 'matrix reloaded', 'matrix', 'mat']
+    assert best(index, 'x') == []
+
+
+def test_titles_and_queries_complete_from_any_word():
+    index = index_of(('The Matrix', TITLE, 1.0), ('best matrix scenes', QUERY, 2.0), ('red matrix', TAG, 3.0))
+    assert best(index, 'matr') == ['best matrix scenes', 'The Matrix']
+
+
+def test_each_entry_once():
+    index = index_of(('go go go', TITLE, 1.0), ('go west', QUERY, 0.5))
+    assert best(index, 'go') == ['go go go', 'go west']
+
+
+def test_unicode_prefixes():
+    index = index_of(('Café Música', TITLE, 1.0), ('東京タワー', TITLE, 2.0))
+    assert best(index, 'mús') == ['Café Música']
+    assert best(index, 'CAFÉ') == ['Café Música']
+    assert best(index, '東京') == ['東京タワー']
+
+
+def test_matches_brute_force():
+    rng = random.Random(7)
+    words = ['alpha', 'alps', 'beta', 'bet', 'gamma', 'game', 'al', 'b']
+    entries = {}
+    for _ in range(300):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        entries[text] = (text, rng.choice([TITLE, TAG, QUERY]), rng.random())
+    index = PrefixIndex(entries)
+
+    for prefix in ['a', 'al', 'alp', 'b', 'bet', 'g', 'game', 'alpha b', 'z']:
+        def matches(norm, kind):
+            if kind == TAG:
+                return norm.startswith(prefix)
+            parts = norm.split(' ')
+            return any(' '.join(parts[i:]).startswith(prefix) for i in range(len(parts)))
+
+        expected = sorted((norm for norm, (_, kind, _) in entries.items() if matches(norm, kind)),
+                          key=lambda norm: -entries[norm][2])
+        assert [index.norms[entry_id] for entry_id in index.iter_best(prefix)] == expected
+
+
+class TestCatalog:
+    def test_best_source_wins(self):
+        catalog = Catalog()
+        catalog.add_video(1, 'Cooking', ['cooking'], views=10)
+        catalog.add_video(2, 'Cooking', [], views=1000)
+        catalog.add_query('cooking', 2)
+        display, kind, weight = catalog.entry('cooking')
+        assert kind == TITLE and weight == pytest.approx(weigh(TITLE, 1000))
+
+    def test_remove_video(self):
+        catalog = Catalog()
+        catalog.add_video(1, 'Cooking', ['food'], views=10)
+        catalog.remove_video(1)
+        assert catalog.entry('cooking') is None
+        assert catalog.entry('food') is None
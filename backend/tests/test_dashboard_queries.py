@@ -0,0 +1,91 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from django.contrib.auth.models import User
+from django.db.models import Sum
+
+from backend.dashboard.queries import DAY, HOUR, buckets, recent_window, time_series
+
+UTC = timezone.utc
+BERLIN = ZoneInfo('Europe/Berlin')
+
+
+def at(*args, tz=UTC):
+    return datetime(*args, tzinfo=tz)
+
+
+class TestBuckets:
+    def test_days(self):
+        assert list(buckets(at(2024, 3, 1), at(2024, 3, 4), DAY, UTC)) == [
+            date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 3)
+        ]
+
+    def test_partial_last_day_is_included(self):
+        assert list(buckets(at(2024, 3, 1), at(2024, 3, 2, 0, 0, 1), DAY, UTC))[-1] == date(2024, 3, 2)
+
+    def test_days_follow_the_time_zone(self):
+        # 23:30 UTC is already the next day in Berlin
+        assert list(buckets(at(2024, 3, 1, 23, 30), at(2024, 3, 2, 12), DAY, BERLIN)) == [date(2024, 3, 2)]
+
+    def test_hours(self):
+        hours = list(buckets(at(2024, 3, 1, 10, 15), at(2024, 3, 1, 13), HOUR, UTC))
+        assert hours == [at(2024, 3, 1, 10), at(2024, 3, 1, 11), at(2024, 3, 1, 12)]
+
+    @pytest.mark.parametrize('day, expected', [(31, 23), (27, 25)])
+    def test_dst_changes_neither_skip_nor_repeat_hours(self, day, expected):
+        month = 3 if day == 31 else 10
+        start = at(2024, month, day, tz=BERLIN)
+        hours = list(buckets(start, start + timedelta(days=1), HOUR, BERLIN))
+        assert len(hours) == expected
+        assert len({hour.astimezone(UTC) for hour in hours}) == expected
+
+    def test_recent_window(self):
+        now = at(2024, 3, 10, 15, 45)
+        start, end = recent_window(7, DAY, UTC, now)
+        assert (start, end) == (at(2024, 3, 4), now)
+        assert len(list(buckets(start, end, DAY, UTC))) == 7
+        start, _ = recent_window(24, HOUR, UTC, now)
+        assert len(list(buckets(start, now, HOUR, UTC))) == 24
+
+
+@pytest.fixture
+def joined(db):
+    """Users joined at fixed moments (date_joined stands in for a view timestamp)"""
+    moments = [at(2024, 3, 1, 9), at(2024, 3, 1, 17), at(2024, 3, 3, 8), at(2024, 3, 5, 23, 30)]
+    for i, moment in enumerate(moments):
+        User.objects.create(username=f'user{i}', date_joined=moment)
+    return moments
+
+
+def test_daily_series_fills_empty_days(joined):
+    series = time_series(User.objects.all(), 'date_joined', at(2024, 3, 1), at(2024, 3, 6), DAY, UTC, using='default')
+    assert series == [
+        (date(2024, 3, 1), 2), (date(2024, 3, 2), 0), (date(2024, 3, 3), 1),
+        (date(2024, 3, 4), 0), (date(2024, 3, 5), 1),
+    ]
+
+
+def test_range_end_is_exclusive(joined):
+    series = time_series(User.objects.all(), 'date_joined', at(2024, 3, 2), at(2024, 3, 3, 8), DAY, UTC, using='default')
+    assert series == [(date(2024, 3, 2), 0), (date(2024, 3, 3), 0)]
+
+
+def test_daily_series_in_another_time_zone(joined):
+    start = at(2024, 3, 5, tz=BERLIN)
+    series = time_series(User.objects.all(), 'date_joined', start, start + timedelta(days=2), DAY, BERLIN,
+                         using='default')
+    # 23:30 UTC on the 5th is the 6th in Berlin
+    assert series == [(date(2024, 3, 5), 0), (date(2024, 3, 6), 1)]
+
+
+def test_hourly_series(joined):
+    series = time_series(User.objects.all(), 'date_joined', at(2024, 3, 1, 8), at(2024, 3, 1, 11), HOUR, UTC,
+                         using='default')
+    assert series == [(at(2024, 3, 1, 8), 0), (at(2024, 3, 1, 9), 1), (at(2024, 3, 1, 10), 0)]
+
+
+def test_custom_aggregate(joined):
+    series = time_series(User.objects.all(), 'date_joined', at(2024, 3, 1), at(2024, 3, 4), DAY, UTC,
+                         value=Sum('id'), using='default')
+    ids = list(User.objects.order_by('date_joined').values_list('id', flat=True))
+    assert series == [(date(2024, 3, 1), ids[0] + ids[1]), (date(2024, 3, 2), 0), (date(2024, 3, 3), ids[2])]
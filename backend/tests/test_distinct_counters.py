@@ -0,0 +1,73 @@
+import pytest
+
+from backend.history.distinct_counters import SPARSE_LIMIT, HyperLogLog, LocalDistinctStore
+
+# Four standard errors at precision 14 (~0.81% each)
+TOLERANCE = 0.033
+
+
+def sketch_of(members):
+    sketch = HyperLogLog()
+    for member in members:
+        sketch.add(member)
+    return sketch
+
+
+def dense_copy(sketch):
+    copy = HyperLogLog()
+    copy.merge(sketch)
+    copy._densify()
+    return copy
+
+
+@pytest.mark.parametrize('n', [0, 1, 10, 100, 1000, 10000, 100000])
+def test_count_accuracy(n):
+    assert sketch_of(range(n)).count() == pytest.approx(n, rel=TOLERANCE, abs=1)
+
+
+def test_duplicates_are_not_counted():
+    sketch = sketch_of(list(range(500)) * 4)
+    assert sketch.count() == pytest.approx(500, rel=TOLERANCE)
+
+
+def test_small_sketches_stay_sparse():
+    sketch = sketch_of(range(SPARSE_LIMIT // 2))
+    assert sketch.sparse is not None and sketch.registers is None
+    big = sketch_of(range(SPARSE_LIMIT * 4))
+    assert big.sparse is None and len(big.registers) == 1 << big.precision
+
+
+def test_sparse_and_dense_estimates_agree():
+    sketch = sketch_of(range(200))
+    assert sketch.sparse is not None
+    assert dense_copy(sketch).count() == sketch.count()
+
+
+@pytest.mark.parametrize('left, right', [(50, 60), (50, 5000), (5000, 50), (5000, 6000)])
+def test_merge_matches_adding_everything_to_one_sketch(left, right):
+    a = sketch_of(range(left))
+    b = sketch_of(range(left // 2, left // 2 + right))
+    expected = sketch_of(list(range(left)) + list(range(left // 2, left // 2 + right)))
+    assert a.merge(b).count() == expected.count()
+    assert list(dense_copy(a).registers) == list(dense_copy(expected).registers)
+
+
+def test_union_of_disjoint_days():
+    days = [sketch_of(f'{day}:{user}' for user in range(3000)) for day in range(7)]
+    assert HyperLogLog.union(days).count() == pytest.approx(21000, rel=TOLERANCE)
+
+
+def test_union_of_overlapping_days():
+    days = [sketch_of(range(day * 1000, day * 1000 + 3000)) for day in range(7)]
+    assert HyperLogLog.union(days).count() == pytest.approx(9000, rel=TOLERANCE)
+
+
+def test_local_store_counts_across_keys():
+    store = LocalDistinctStore()
+    store.add({'viewers:a': set(range(100)), 'viewers:b': set(range(50, 400))}, ttl=3600)
+    assert store.count(['viewers:a']) == pytest.approx(100, abs=1)
+    assert store.count(['viewers:a', 'viewers:b']) == pytest.approx(400, rel=TOLERANCE)
+    assert store.count(['viewers:missing']) == 0
+    assert store.count_many([['viewers:a'], ['viewers:b']]) == [
+        store.count(['viewers:a']), store.count(['viewers:b'])
+    ]
@@ -0,0 +1,130 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+import pytest
+from django.contrib.auth.models import User
+from django.test import RequestFactory
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from backend.api.pagination import KeysetPagination
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def request_for(**params):
+    return Request(RequestFactory().get('/videos/', params))
+
+
+def paginator_for(ordering, nullable=()):
+    paginator = KeysetPagination()
+    paginator.ordering = ordering
+    paginator.nullable = set(nullable)
+    return paginator
+
+
+def all_pages(queryset, page_size):
+    """Walk every page through the next links; returns the ids of each page"""
+    pages, params = [], {'page_size': page_size}
+    while True:
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, request_for(**params))
+        pages.append([user.id for user in page])
+        link = paginator.get_next_link()
+        if link is None:
+            return pages
+        params = {key: values[0] for key, values in parse_qs(urlparse(link).query).items()}
+
+
+class TestCursor:
+    def test_round_trip(self):
+        paginator = paginator_for(['-last_login', 'id'])
+        row = User(id=7, last_login=START)
+        cursor = paginator.encode_cursor(row)
+        assert paginator.decode_cursor(request_for(cursor=cursor), User) == [START, 7]
+
+    def test_null_value_round_trip(self):
+        paginator = paginator_for(['last_login', 'id'])
+        cursor = paginator.encode_cursor(User(id=3, last_login=None))
+        assert paginator.decode_cursor(request_for(cursor=cursor), User) == [None, 3]
+
+    def test_no_cursor(self):
+        assert paginator_for(['id']).decode_cursor(request_for(), User) is None
+
+    def test_cursor_of_another_ordering_is_rejected(self):
+        cursor = paginator_for(['-id']).encode_cursor(User(id=1))
+        with pytest.raises(NotFound):
+            paginator_for(['id']).decode_cursor(request_for(cursor=cursor), User)
+
+    @pytest.mark.parametrize('cursor', [
+        'not base64!',
+        base64.urlsafe_b64encode(b'{"o": ["id"]}').decode(),
+        base64.urlsafe_b64encode(json.dumps({'o': ['id'], 'v': ['x']}).encode()).decode(),
+    ])
+    def test_malformed_cursor(self, cursor):
+        with pytest.raises(NotFound):
+            paginator_for(['id']).decode_cursor(request_for(cursor=cursor), User)
+
+
+@pytest.fixture
+def users(db):
+    """Eight users; every third one never logged in, two share a login time"""
+    created = []
+    for i in range(8):
+        last_login = None if i % 3 == 0 else START + timedelta(hours=min(i, 5))
+        created.append(User.objects.create(username=f'user{i}', last_login=last_login))
+    return created
+
+
+def expected_ids(users, descending):
+    """NULLs last in both directions, ids ascending as the tie-breaker"""
+    logged_in = sorted((user for user in users if user.last_login), key=lambda user: user.id)
+    logged_in.sort(key=lambda user: user.last_login, reverse=descending)
+    never = sorted((user for user in users if user.last_login is None), key=lambda user: user.id)
+    return [user.id for user in logged_in + never]
+
+
+class TestKeysetFilter:
+    def test_rows_strictly_after_the_cursor(self, users):
+        paginator = paginator_for(['username', 'id'])
+        after = User.objects.filter(paginator.keyset_filter(['user3', users[3].id])).order_by('username', 'id')
+        assert [user.username for user in after] == ['user4', 'user5', 'user6', 'user7']
+
+    def test_nullable_column_includes_nulls_after_values(self, users):
+        paginator = paginator_for(['last_login', 'id'], nullable=['last_login'])
+        after = User.objects.filter(paginator.keyset_filter([START + timedelta(hours=5), users[5].id]))
+        assert sorted(user.id for user in after) == sorted([users[7].id] + [users[i].id for i in (0, 3, 6)])
+
+    def test_null_cursor_only_continues_within_nulls(self, users):
+        paginator = paginator_for(['-last_login', 'id'], nullable=['last_login'])
+        after = User.objects.filter(paginator.keyset_filter([None, users[3].id]))
+        assert sorted(user.id for user in after) == [users[6].id]
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('page_size', [1, 2, 3, 20])
+def test_pages_cover_every_row_once_with_nulls_last(users, descending, page_size):
+    queryset = User.objects.order_by('-last_login' if descending else 'last_login', 'id')
+    pages = all_pages(queryset, page_size)
+    assert [user_id for page in pages for user_id in page] == expected_ids(users, descending)
+    assert all(len(page) == page_size for page in pages[:-1])
+
+
+def test_response_shape(users):
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(User.objects.order_by('id'), request_for(page_size=5))
+    data = paginator.get_paginated_response([user.id for user in page]).data
+    assert data['count'] == 8 and data['previous'] is None and len(data['results']) == 5
+    assert 'cursor=' in data['next']
+
+
+def test_count_can_be_skipped(users):
+    paginator = KeysetPagination()
+    paginator.paginate_queryset(User.objects.order_by('id'), request_for(count='false'))
+    assert paginator.count is None
+
+
+def test_ordering_needs_an_id_tie_breaker(db):
+    with pytest.raises(ValueError):
+        KeysetPagination().paginate_queryset(User.objects.order_by('username'), request_for())
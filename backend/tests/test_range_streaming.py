@@ -0,0 +1,97 @@
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse
+from django.test import RequestFactory, override_settings
+
+from backend.api.range_streaming import MAX_RANGES, parse_range_header, serve_file
+
+SIZE = 1000
+
+
+class TestParseRangeHeader:
+    @pytest.mark.parametrize('header', [None, '', 'bytes', 'items=0-10', 'bytes=abc-', 'bytes=5-1', 'bytes=0-1,,2-3'])
+    def test_ignored_headers(self, header):
+        assert parse_range_header(header, SIZE) is None
+
+    def test_single_range(self):
+        assert parse_range_header('bytes=0-99', SIZE) == [(0, 99)]
+
+    def test_open_ended(self):
+        assert parse_range_header('bytes=900-', SIZE) == [(900, 999)]
+
+    def test_end_is_clamped(self):
+        assert parse_range_header('bytes=900-5000', SIZE) == [(900, 999)]
+
+    def test_suffix(self):
+        assert parse_range_header('bytes=-100', SIZE) == [(900, 999)]
+        assert parse_range_header('bytes=-5000', SIZE) == [(0, 999)]
+
+    def test_unit_is_case_insensitive(self):
+        assert parse_range_header('Bytes = 0-0', SIZE) == [(0, 0)]
+
+    def test_unsatisfiable(self):
+        assert parse_range_header('bytes=1000-', SIZE) == []
+        assert parse_range_header('bytes=-0', SIZE) == []
+
+    def test_unsatisfiable_parts_are_dropped(self):
+        assert parse_range_header('bytes=2000-3000, 0-9', SIZE) == [(0, 9)]
+
+    def test_overlapping_and_adjacent_ranges_coalesce(self):
+        assert parse_range_header('bytes=50-99, 0-49, 40-60, 200-299, 300-310', SIZE) == [(0, 99), (200, 310)]
+
+    def test_too_many_ranges(self):
+        header = 'bytes=' + ','.join(f'{i * 10}-{i * 10}' for i in range(MAX_RANGES + 1))
+        assert parse_range_header(header, SIZE) is None
+
+
+@pytest.fixture
+def storage(tmp_path, db):
+    # db: closing a response sends request_finished, which closes old connections
+    storage = FileSystemStorage(location=str(tmp_path))
+    storage.save('video.mp4', ContentFile(bytes(range(256)) * 4))
+    return storage
+
+
+def body(response):
+    return b''.join(response.streaming_content)
+
+
+@pytest.mark.parametrize('use_sendfile', [True, False])
+def test_single_range_response(storage, use_sendfile):
+    request = RequestFactory().get('/', HTTP_RANGE='bytes=10-19')
+    with override_settings(STREAMING_USE_SENDFILE=use_sendfile):
+        response = serve_file(request, storage, 'video.mp4')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 10-19/1024'
+    assert body(response) == bytes(range(10, 20))
+    # Only FileResponse is handed to the server's file_wrapper (sendfile)
+    assert isinstance(response, FileResponse) is use_sendfile
+    response.close()
+
+
+@pytest.mark.parametrize('use_sendfile', [True, False])
+def test_full_response(storage, use_sendfile):
+    with override_settings(STREAMING_USE_SENDFILE=use_sendfile):
+        response = serve_file(RequestFactory().get('/'), storage, 'video.mp4')
+    assert response.status_code == 200
+    assert response['Content-Length'] == '1024'
+    assert body(response) == bytes(range(256)) * 4
+    assert isinstance(response, FileResponse) is use_sendfile
+    response.close()
+
+
+def test_unsatisfiable_range(storage):
+    response = serve_file(RequestFactory().get('/', HTTP_RANGE='bytes=5000-'), storage, 'video.mp4')
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */1024'
+
+
+def test_multipart_ranges(storage):
+    response = serve_file(RequestFactory().get('/', HTTP_RANGE='bytes=0-1,100-101'), storage, 'video.mp4')
+    content = body(response)
+    assert response.status_code == 206
+    assert response['Content-Type'].startswith('multipart/byteranges')
+    assert int(response['Content-Length']) == len(content)
+    assert b'Content-Range: bytes 100-101/1024' in content
+    response.close()
@@ -0,0 +1,115 @@
+import os
+from types import SimpleNamespace
+import pytest
+
+from backend.search.search_backends import (
+    InMemorySearchBackend, tokenize, trigram_similarity, trigrams,
+)
+
+TITLES = {
+    1: 'Música latina en vivo',
+    2: 'Привет мир',
+    3: '東京タワー 夜景',
+    4: 'Cafe music',
+    5: 'Ünïcödé ÄRGER',
+}
+
+
+def backend_with(titles):
+    backend = InMemorySearchBackend()
+    for video_id, title in titles.items():
+        backend._add(SimpleNamespace(pk=video_id, title=title, description='', tags='', category=''))
+    backend._loaded = True
+    return backend
+
+
+def ranked_ids(backend, query):
+    return [video_id for video_id, _ in backend.rank(query)]
+
+
+class TestTokenize:
+    def test_keeps_accented_words_whole(self):
+        assert tokenize('Música del Café') == ['música', 'del', 'café']
+
+    def test_keeps_cyrillic_and_cjk_words(self):
+        assert tokenize('Привет МИР') == ['привет', 'мир']
+        assert tokenize('東京タワー 夜景') == ['東京タワー', '夜景']
+
+    def test_splits_on_punctuation_and_underscores(self):
+        assert tokenize('foo_bar, baz-2') == ['foo', 'bar', 'baz', '2']
+
+    def test_empty(self):
+        assert tokenize(None) == []
+        assert tokenize('  !! ') == []
+
+
+class TestInMemoryRanking:
+    def test_accented_query_matches_accented_title(self):
+        assert ranked_ids(backend_with(TITLES), 'música') == [1]
+
+    def test_accented_prefix(self):
+        assert ranked_ids(backend_with(TITLES), 'músi') == [1]
+
+    def test_cyrillic_query(self):
+        assert ranked_ids(backend_with(TITLES), 'привет') == [2]
+
+    def test_cjk_query(self):
+        assert ranked_ids(backend_with(TITLES), '夜景') == [3]
+
+    def test_case_folding(self):
+        assert ranked_ids(backend_with(TITLES), 'ärger') == [5]
+
+    def test_ascii_query_does_not_match_accented_term(self):
+        # 'simple' does not strip accents either
+        assert 1 not in ranked_ids(backend_with(TITLES), 'musica')
+
+    def test_unicode_trigrams(self):
+        grams = trigrams('мир')
+        assert grams == {'  м', ' ми', 'мир', 'ир '}
+        assert trigram_similarity(grams, trigrams('мир')) == 1.0
+
+
+# Parity with PostgreSQL's 'simple' configuration and pg_trgm. Set
+# SEARCH_TEST_DATABASE_URL (a UTF-8 database with pg_trgm available) to run.
+DATABASE_URL = os.environ.get('SEARCH_TEST_DATABASE_URL')
+
+
+@pytest.fixture(scope='module')
+def pg_cursor():
+    if not DATABASE_URL:
+        pytest.skip('SEARCH_TEST_DATABASE_URL is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    connection = psycopg2.connect(DATABASE_URL)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        yield cursor
+    connection.close()
+
+
+@pytest.mark.parametrize('title', TITLES.values())
+def test_tokens_match_postgres(pg_cursor, title):
+    pg_cursor.execute("SELECT array(SELECT unnest(tsvector_to_array(to_tsvector('simple', %s))))", [title])
+    assert sorted(set(tokenize(title))) == sorted(pg_cursor.fetchone()[0])
+
+
+@pytest.mark.parametrize('query', ['música', 'músi', 'привет', '夜景', 'ärger', 'musica', 'cafe mus'])
+def test_matches_agree_with_postgres(pg_cursor, query):
+    terms = tokenize(query)
+    tsquery = ' & '.join(f"{term}{':*' if i == len(terms) - 1 else ''}" for i, term in enumerate(terms))
+    expected = set()
+    for video_id, title in TITLES.items():
+        pg_cursor.execute(
+            "SELECT to_tsvector('simple', %s) @@ to_tsquery('simple', %s) OR similarity(%s, %s) >= 0.3",
+            [title, tsquery, title, query]
+        )
+        if pg_cursor.fetchone()[0]:
+            expected.add(video_id)
+    assert set(ranked_ids(backend_with(TITLES), query)) == expected
+
+
+@pytest.mark.parametrize('title', TITLES.values())
+def test_trigram_similarity_matches_pg_trgm(pg_cursor, title):
+    query = title.split()[0]
+    pg_cursor.execute('SELECT similarity(%s, %s)', [title, query])
+    assert trigram_similarity(trigrams(query), trigrams(title)) == pytest.approx(pg_cursor.fetchone()[0], abs=1e-6)
@@ -0,0 +1,98 @@
+import threading
+import time
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase
+
+# Needs the project's models (Video, VideoView) to be installed
+models = pytest.importorskip('backend.models')
+watch_history = pytest.importorskip('backend.history.watch_history')
+
+Video, VideoView = models.Video, models.VideoView
+WatchHistory = watch_history.WatchHistory
+
+THREADS = 8
+BEATS = 5
+
+
+class SessionConcurrencyTests(TransactionTestCase):
+    """Concurrent heartbeats of one (user, video) pair must share one session row"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='viewer', password='secret')
+        self.video = Video.objects.create(title='Clip', description='', file_path='clip.mp4')
+
+    def run_concurrently(self, target):
+        """Start THREADS workers together; returns the exceptions they raised"""
+        errors = []
+        start = threading.Barrier(THREADS)
+
+        def worker(index):
+            try:
+                start.wait()
+                target(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Each thread has its own connection
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def session_rows(self):
+        return list(VideoView.objects.filter(user=self.user, video=self.video))
+
+    def test_record_view_creates_one_session(self):
+        def heartbeats(index):
+            for beat in range(BEATS):
+                WatchHistory.record_view(self.user, self.video, float(index * BEATS + beat))
+
+        self.assertEqual(self.run_concurrently(heartbeats), [])
+        rows = self.session_rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].watch_duration, float(THREADS * BEATS - 1))
+
+    def test_apply_progress_creates_one_session(self):
+        now = time.time()
+
+        def flush(index):
+            WatchHistory.apply_progress([{
+                'user_id': self.user.id,
+                'video_id': self.video.id,
+                'watch_duration': float(index),
+                'completed': False,
+                'last_position': float(index),
+                'first_seen': now,
+                'last_seen': now,
+            }])
+
+        self.assertEqual(self.run_concurrently(flush), [])
+        rows = self.session_rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].watch_duration, float(THREADS - 1))
+
+    def test_record_view_and_apply_progress_share_the_session(self):
+        now = time.time()
+
+        def mixed(index):
+            if index % 2:
+                WatchHistory.record_view(self.user, self.video, float(index))
+            else:
+                WatchHistory.apply_progress([{
+                    'user_id': self.user.id,
+                    'video_id': self.video.id,
+                    'watch_duration': float(index),
+                    'completed': False,
+                    'last_position': float(index),
+                    'first_seen': now,
+                    'last_seen': now,
+                }])
+
+        self.assertEqual(self.run_concurrently(mixed), [])
+        self.assertEqual(len(self.session_rows()), 1)
@@ -0,0 +1,53 @@
+import pytest
+
+from backend.streaming.transcoder import LadderTranscoder
+
+PRESETS = [{'width': 640, 'height': 360, 'bitrate': '800k', 'audio_bitrate': '96k'}]
+
+
+def forced_keyframes(transcoder, offset, duration, fps=25):
+    """Chunk-local frame times at which the force_key_frames expression fires"""
+    expr = transcoder._keyframe_args(offset)[1]
+    assert expr.startswith('expr:gte(t,') and expr.endswith(')')
+    threshold = expr[len('expr:gte(t,'):-1]
+    forced, times = 0, []
+    for frame in range(int(duration * fps)):
+        t = frame / fps
+        if t >= eval(threshold, {'n_forced': forced}):
+            times.append(round(t, 6))
+            forced += 1
+    return times
+
+
+@pytest.mark.parametrize('offset', [0.0, 120.0, 125.0, 250.48])
+def test_forced_keyframes_stay_on_the_source_grid(offset):
+    transcoder = LadderTranscoder(PRESETS, segment_duration=6, workers=1)
+    times = forced_keyframes(transcoder, offset, duration=30)
+    assert times
+    for t in times:
+        source_time = t + offset
+        # Within one frame after a multiple of the segment duration
+        assert (source_time % 6) < 1 / 25 + 1e-6 or 6 - (source_time % 6) < 1e-6
+    assert len(times) == len([k for k in range(0, 100) if offset <= k * 6 < offset + 30 - 1e-9])
+
+
+def test_thumbnails_shift_to_source_time_in_chunks():
+    transcoder = LadderTranscoder(PRESETS, thumbnail_interval=10, workers=1)
+    assert 'setpts' not in transcoder._filter_graph()
+    assert 'setpts=PTS+125.000000/TB,fps=1/10:round=down' in transcoder._filter_graph(offset=125.0)
+
+
+def test_collect_thumbnails_by_global_index(tmp_path):
+    work_dir, thumb_dir = tmp_path / 'work', tmp_path / 'thumbs'
+    work_dir.mkdir(), thumb_dir.mkdir()
+    # Chunk 0 covers indexes 0-12, chunk 1 starts inside index 12's frame
+    for index, numbers in [(0, range(0, 13)), (1, range(12, 25))]:
+        for number in numbers:
+            (work_dir / f'thumb_{index:05d}_{number}.jpg').write_text(f'{index}:{number}')
+
+    LadderTranscoder(PRESETS, workers=1)._collect_thumbnails(str(work_dir), str(thumb_dir), 2)
+
+    names = sorted(path.name for path in thumb_dir.iterdir())
+    assert names == [f'thumb_{n:04d}.jpg' for n in range(1, 26)]
+    assert (thumb_dir / 'thumb_0013.jpg').read_text() == '0:12'
+    assert (thumb_dir / 'thumb_0014.jpg').read_text() == '1:13'
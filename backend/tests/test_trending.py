@@ -0,0 +1,35 @@
+import pytest
+
+from backend.search.trending import LocalTrendingStore, half_lives
+
+DAY = 24 * 3600
+
+
+def test_scores_decay_by_half_life():
+    store = LocalTrendingStore()
+    store.add(1, 'music', 0.0)
+    half_life = half_lives()['1d']
+    assert store.top('1d', None, 10, half_life) == [(1, pytest.approx(0.5))]
+    assert store.top('1d', 'music', 10, 2 * half_life) == [(1, pytest.approx(0.25))]
+
+
+def test_rebase_keeps_ranking_and_drops_decayed_scores():
+    store = LocalTrendingStore()
+    store.add(1, None, 0.0)
+    store.add(2, None, 10 * DAY)
+    before = store.top('1d', None, 10, 10 * DAY)
+    store.rebase(10 * DAY)
+    assert store.top('1d', None, 10, 10 * DAY) == [(2, pytest.approx(1.0))]
+    assert before[0] == (2, pytest.approx(1.0))
+
+
+def test_staged_store_replaces_live_scores_at_once():
+    live = LocalTrendingStore()
+    live.add(1, 'news', 0.0)
+    staged = live.staging()
+    staged.add(2, 'music', 0.0)
+    # Readers keep the old ranking while the staging store fills
+    assert [video_id for video_id, _ in live.top('1d', None, 10, 0.0)] == [1]
+    live.replace_with(staged)
+    assert [video_id for video_id, _ in live.top('1d', None, 10, 0.0)] == [2]
+    assert live.top('1d', 'news', 10, 0.0) == []